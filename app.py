@@ -4,19 +4,32 @@ import json
 import uuid
 import re
 import sqlite3
+import math
+import random
+import socket
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
 
 import hashlib
+import hmac
+import base64
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 
-import requests
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, jsonify, request, send_from_directory, send_file, g, has_request_context, Response
 from railway_deploy import get_deploy_manager
+from password_hashing import PasswordHasher, PasswordHasherBusy, default_pool_size
+from pricing_snapshot import PricingSnapshot, etag_matches
+from static_assets import StaticAssets
+from session_tokens import SessionTokens
+from rate_limiter import RateLimit, get_rate_limiter
+from token_budget import (TokenLedger, TokenBudgetExceeded, estimate_tokens, usage_tokens,
+                          parse_budgets, parse_prices, set_token_ledger)
+from provider_client import get_provider_client
 import logging
 
 # Try importing bcrypt, fallback to hashlib if not available
@@ -129,7 +142,8 @@ PORT = int(os.getenv("PORT", "8080"))
 K1_API_TOKEN = os.getenv("K1_API_TOKEN", "")          # header: X-API-Token
 # Admin protection (required for admin endpoints)
 # Admin protection (required for admin endpoints)
-K1_ADMIN_TOKEN = os.getenv("K1_ADMIN_TOKEN", "KELION_ADMIN_MASTER_KEY_2026")      # header: X-Admin-Token
+_DEFAULT_ADMIN_TOKEN = "KELION_ADMIN_MASTER_KEY_2026"
+K1_ADMIN_TOKEN = os.getenv("K1_ADMIN_TOKEN", _DEFAULT_ADMIN_TOKEN)      # header: X-Admin-Token
 DEPLOY_API_KEY = os.getenv('DEPLOY_API_KEY', '')  # Authorization: Bearer <key>
 
 # Database configuration - PostgreSQL or SQLite
@@ -219,34 +233,49 @@ PERSONA_STYLE = "friendly_conversational"
 K1_SOURCE_ALLOWLIST = os.getenv('K1_SOURCE_ALLOWLIST', '')
 
 # --- Password hashing helpers ---
+# bcrypt runs in a process pool (see password_hashing.py): K1_PASSWORD_POOL_SIZE
+# processes per web worker (default: CPU count / K1_WEB_WORKERS, 0 = on the request thread),
+# K1_PASSWORD_QUEUE_MAX more waiting, beyond which requests get a 503 instead of queueing
+PASSWORD_POOL_SIZE = int(os.getenv("K1_PASSWORD_POOL_SIZE") or default_pool_size())
+PASSWORD_QUEUE_MAX = int(os.getenv("K1_PASSWORD_QUEUE_MAX", "32"))
+PASSWORD_TIMEOUT_SECONDS = float(os.getenv("K1_PASSWORD_TIMEOUT_SECONDS", "10"))
+BCRYPT_ROUNDS = int(os.getenv("K1_BCRYPT_ROUNDS", "12"))
+
+password_hasher = PasswordHasher(workers=PASSWORD_POOL_SIZE, max_queue=PASSWORD_QUEUE_MAX,
+                                 timeout=PASSWORD_TIMEOUT_SECONDS, rounds=BCRYPT_ROUNDS)
+
 def hash_password(password: str) -> str:
-    """Hash password using bcrypt or fallback to SHA256."""
-    if USE_BCRYPT:
-        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-    else:
-        # Fallback: SHA256 with salt
-        salt = uuid.uuid4().hex
-        hashed = hashlib.sha256((password + salt).encode()).hexdigest()
-        return f"sha256${salt}${hashed}"
+    """Hash password with bcrypt (PBKDF2 when bcrypt is not installed)."""
+    return password_hasher.hash(password)
 
 def verify_password(password: str, hashed: str) -> bool:
-    """Verify password against hash."""
-    if not hashed:
-        return False
-    if USE_BCRYPT and not hashed.startswith("sha256$"):
+    """Verify password against any stored format (bcrypt, pbkdf2, legacy sha256)."""
+    return password_hasher.verify(password, hashed)
+
+def check_password_upgrade(password: str, profile: dict) -> bool:
+    """Verify against profile["password_hash"]; on success re-hash a legacy or
+    under-cost hash into the profile. The caller saves the profile."""
+    ok, needs_rehash = password_hasher.check(password, profile.get("password_hash", ""))
+    if ok and needs_rehash:
         try:
-            return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
-        except Exception:
-            return False
-    elif hashed.startswith("sha256$"):
-        # Fallback verification
-        parts = hashed.split("$")
-        if len(parts) != 3:
-            return False
-        _, salt, stored_hash = parts
-        computed = hashlib.sha256((password + salt).encode()).hexdigest()
-        return computed == stored_hash
-    return False
+            profile["password_hash"] = hash_password(password)
+            password_hasher.record_rehash()
+        except PasswordHasherBusy:
+            pass   # upgrade on a later login
+    return ok
+
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    resp = jsonify({"error": "Server busy, please retry"})
+    resp.headers["Retry-After"] = "2"
+    return resp, 503
+
+@app.errorhandler(TokenBudgetExceeded)
+def token_budget_exceeded(e):
+    resp = jsonify({"error": f"Your plan's {'daily' if e.period == 'day' else 'monthly'} AI usage is used up. "
+                             "Upgrade to chat more.", "budget": e.to_dict()})
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, 429
 
 # --- Email helpers ---
 def send_email(to: str, subject: str, html_body: str, text_body: str = None) -> bool:
@@ -329,179 +358,294 @@ def _admin_ok(req) -> bool:
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
-# Database connection pool for PostgreSQL
+# Database connection pool for PostgreSQL / per-thread SQLite connections
+from db_pool import PGConnectionPool, SQLiteConnectionCache, UnitOfWork
+from db_query import PGConnection
+from write_behind import WriteBehindBuffer
+import write_behind
+import ttl_cache   # by module: `TTLCache` in this file is cachetools' (TTS_CACHE)
+from demo_usage import DEMO_USAGE_UPSERT, DemoUsage
+from system_prompt import SystemPromptBuilder
+from source_trust import SourceTrustMap, SuffixTrie
+from gdpr_export import ExportJobs, ndjson_stream, zip_stream
+from message_search import search_messages
+import visitor_traffic
+from event_hub import EventHub, sse_stream
+import periodic
+import db_query
+import db_migrations
+
+DB_POOL_MIN = int(os.getenv("K1_DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("K1_DB_POOL_MAX", "10"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("K1_DB_POOL_MAX_LIFETIME", "1800"))  # seconds
+DB_POOL_TIMEOUT = float(os.getenv("K1_DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_AFTER = float(os.getenv("K1_DB_POOL_HEALTHCHECK_AFTER", "30"))  # idle seconds before pre-ping
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("K1_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_BYTES = int(os.getenv("K1_SQLITE_MMAP_BYTES", str(64 * 1024 * 1024)))
+# Audit events are written by a background writer in batches (set K1_AUDIT_WRITE_BEHIND=false to write inline)
+AUDIT_WRITE_BEHIND = os.getenv("K1_AUDIT_WRITE_BEHIND", "true").lower() == "true"
+AUDIT_BATCH_MAX = int(os.getenv("K1_AUDIT_BATCH_MAX", "200"))
+AUDIT_BATCH_LATENCY_MS = int(os.getenv("K1_AUDIT_BATCH_LATENCY_MS", "250"))
+AUDIT_QUEUE_MAX = int(os.getenv("K1_AUDIT_QUEUE_MAX", "10000"))
+AUDIT_OVERFLOW = os.getenv("K1_AUDIT_OVERFLOW", "block")  # drop_oldest | drop_newest | block
+# In-process cache in front of usage_counters (per worker; entries may lag other workers by up to the TTL)
+USAGE_CACHE_SIZE = int(os.getenv("K1_USAGE_CACHE_SIZE", "10000"))
+USAGE_CACHE_TTL = float(os.getenv("K1_USAGE_CACHE_TTL", "30"))
+# Seconds a worker may serve cached rules/summaries changed by another worker
+PROMPT_CACHE_TTL = float(os.getenv("K1_PROMPT_CACHE_TTL", "60"))
+# Seconds before a worker reloads the sources trust map (picks up other workers' writes)
+SOURCE_TRUST_TTL = float(os.getenv("K1_SOURCE_TRUST_TTL", "300"))
+# GDPR export: rows per batch, where async exports are written and how long they are kept
+GDPR_EXPORT_BATCH = int(os.getenv("K1_GDPR_EXPORT_BATCH", "500"))
+GDPR_EXPORT_DIR = os.getenv("K1_GDPR_EXPORT_DIR", os.path.join(os.path.dirname(DB_PATH) or ".", "exports"))
+GDPR_EXPORT_TTL_HOURS = float(os.getenv("K1_GDPR_EXPORT_TTL_HOURS", "24"))
+# Largest page /admin/audit returns (use ?cursor= to page further)
+AUDIT_PAGE_MAX = int(os.getenv("K1_AUDIT_PAGE_MAX", "1000"))
+# Dashboard counters: shards per counter (spreads concurrent writers) and seconds between drift corrections (0 = off)
+STATS_SHARDS = max(1, int(os.getenv("K1_STATS_SHARDS", "8")))
+STATS_RECONCILE_SECONDS = float(os.getenv("K1_STATS_RECONCILE_SECONDS", "3600"))
+# Visitor tracking: page views are buffered and written in batches; raw rows kept this many days (0 = forever)
+VISITOR_BATCH_MAX = int(os.getenv("K1_VISITOR_BATCH_MAX", "500"))
+VISITOR_BATCH_LATENCY_MS = float(os.getenv("K1_VISITOR_BATCH_LATENCY_MS", "1000"))
+VISITOR_QUEUE_MAX = int(os.getenv("K1_VISITOR_QUEUE_MAX", "20000"))
+VISITOR_RETENTION_DAYS = float(os.getenv("K1_VISITOR_RETENTION_DAYS", "30"))
+TRAFFIC_HOURLY_RETENTION_DAYS = float(os.getenv("K1_TRAFFIC_HOURLY_RETENTION_DAYS", "90"))
+# Server-sent events (/api/events): tail poll interval, heartbeat, stream lifetime, streams per worker, retention.
+# Each open stream holds one of the worker's K1_WEB_THREADS gthread threads for up to the stream lifetime,
+# so at most half of them may stream: past that /api/events answers 503 (EventSource retries) while
+# /api/chat and /health keep the other half
+WEB_THREADS = int(os.getenv("K1_WEB_THREADS", "16"))
+EVENTS_POLL_MS = float(os.getenv("K1_EVENTS_POLL_MS", "500"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("K1_EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_STREAM_SECONDS = float(os.getenv("K1_EVENTS_STREAM_SECONDS", "300"))
+EVENTS_MAX_STREAMS = min(int(os.getenv("K1_EVENTS_MAX_STREAMS", "100")), max(1, WEB_THREADS // 2))
+EVENTS_RETENTION_SECONDS = float(os.getenv("K1_EVENTS_RETENTION_SECONDS", "3600"))
+LIVE_USERS_INTERVAL = float(os.getenv("K1_LIVE_USERS_INTERVAL", "15"))
+# Key for password-reset / email-verify token digests (changing it invalidates outstanding tokens)
+def _token_hmac_key() -> str:
+    """K1_TOKEN_HMAC_KEY; without it a key derived from a configured K1_ADMIN_TOKEN, else start-up fails."""
+    key = os.getenv("K1_TOKEN_HMAC_KEY", "")
+    if key:
+        return key
+    if K1_ADMIN_TOKEN and K1_ADMIN_TOKEN != _DEFAULT_ADMIN_TOKEN:
+        logger.error("K1_TOKEN_HMAC_KEY is not set: token digests use a key derived from K1_ADMIN_TOKEN; set it explicitly")
+        return hmac.new(K1_ADMIN_TOKEN.encode("utf-8"), b"kelion token digest key", hashlib.sha256).hexdigest()
+    raise RuntimeError("K1_TOKEN_HMAC_KEY is not set (password-reset / email-verify token digests need a secret key)")
+
+TOKEN_HMAC_KEY = _token_hmac_key()
+# Seconds between purges of expired and used tokens (0 = off)
+TOKEN_PURGE_SECONDS = float(os.getenv("K1_TOKEN_PURGE_SECONDS", "3600"))
+# Public pricing snapshot: rebuilt on tier changes, else every K1_PRICING_CACHE_TTL seconds (other workers' edits); browser/CDN max-age
+PRICING_CACHE_TTL = float(os.getenv("K1_PRICING_CACHE_TTL", "60"))
+PRICING_MAX_AGE = int(os.getenv("K1_PRICING_MAX_AGE", "60"))
+# Output of `python static_assets.py build` (hashed, minified, precompressed); static/ is served as-is when it is missing
+STATIC_BUILD_DIR = os.path.join(app.root_path, os.getenv("K1_STATIC_BUILD_DIR", "static_build"))
+# LLM token budgets (see token_budget.py): per tier "daily/monthly" tokens (0 = unlimited), model prices in USD per 1M tokens
+TOKEN_BUDGETS = parse_budgets(os.getenv("K1_TOKEN_BUDGETS", ""))
+TOKEN_PRICES = parse_prices(os.getenv("K1_TOKEN_PRICES", ""))
+# Seconds a worker may serve cached token usage (other workers' calls show up after this)
+TOKEN_USAGE_CACHE_TTL = float(os.getenv("K1_TOKEN_USAGE_CACHE_TTL", "30"))
+# Answer tokens reserved per call until the provider reports the real usage
+TOKEN_OUTPUT_ESTIMATE = int(os.getenv("K1_TOKEN_OUTPUT_ESTIMATE", "1024"))
+# Demo account limits per client IP (see demo_usage.py); activity is flushed every K1_DEMO_FLUSH_SECONDS,
+# other workers' usage is seen after K1_DEMO_CACHE_TTL seconds, rows older than K1_DEMO_RETENTION_DAYS are purged
+DEMO_DAILY_LIMIT_MINUTES = float(os.getenv("K1_DEMO_DAILY_MINUTES", "30"))
+DEMO_MAX_DAYS = int(os.getenv("K1_DEMO_MAX_DAYS", "5"))
+DEMO_FLUSH_SECONDS = float(os.getenv("K1_DEMO_FLUSH_SECONDS", "5"))
+DEMO_CACHE_TTL = float(os.getenv("K1_DEMO_CACHE_TTL", "30"))
+DEMO_RETENTION_DAYS = float(os.getenv("K1_DEMO_RETENTION_DAYS", "180"))
+# Upstream HTTP (see provider_client.py for pool size, timeouts and retries): open this many keep-alive
+# connections per configured provider when a worker starts
+HTTP_PREWARM_CONNECTIONS = int(os.getenv("K1_HTTP_PREWARM_CONNECTIONS", "2"))
+# Login session tokens (see session_tokens.py; not revocable, so keep the lifetime short): hours valid, signing key
+# (default: derived from the token HMAC key; changing it signs everyone out)
+SESSION_TOKEN_HOURS = float(os.getenv("K1_SESSION_TOKEN_HOURS", "24"))
+SESSION_TOKEN_KEY = os.getenv("K1_SESSION_TOKEN_KEY", "")
+# Server-side prepare a statement after it ran this many times on a connection (0 = off; keep off behind pgbouncer transaction pooling)
+PG_PREPARE_THRESHOLD = int(os.getenv("K1_PG_PREPARE_THRESHOLD", "0"))
+# Apply pending schema migrations at startup (set false when running `python db_migrations.py migrate` before serving)
+K1_AUTO_MIGRATE = os.getenv("K1_AUTO_MIGRATE", "true").lower() == "true"
+
 _pg_pool = None
+_pg_pool_lock = threading.Lock()
+_sqlite_cache = SQLiteConnectionCache(DB_PATH, busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS, mmap_size=SQLITE_MMAP_BYTES)
+# Requests' units of work get their own per-thread connection, so out-of-band work in a
+# request thread (_raw_db / db_autonomous) never commits or rolls back the request's transaction
+_sqlite_request_cache = SQLiteConnectionCache(DB_PATH, busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS,
+                                              mmap_size=SQLITE_MMAP_BYTES)
+
+def _pg_connect():
+    """Open a PostgreSQL connection with the sqlite3-style API (used by the pool)."""
+    from urllib.parse import urlparse
+    result = urlparse(DATABASE_URL)
+    raw = psycopg2.connect(
+        host=result.hostname,
+        database=result.path[1:],
+        user=result.username,
+        password=result.password,
+        port=result.port or 5432
+    )
+    return PGConnection(raw, prepare_threshold=PG_PREPARE_THRESHOLD)
 
-def get_pg_connection():
-    """Get PostgreSQL connection from pool."""
+def get_pg_pool() -> PGConnectionPool:
+    """Get (or lazily create) the process-wide PostgreSQL pool."""
     global _pg_pool
     if _pg_pool is None:
-        from urllib.parse import urlparse
-        result = urlparse(DATABASE_URL)
-        _pg_pool = {
-            'host': result.hostname,
-            'database': result.path[1:],
-            'user': result.username,
-            'password': result.password,
-            'port': result.port or 5432
-        }
-    return psycopg2.connect(**_pg_pool, cursor_factory=psycopg2.extras.RealDictCursor)
-
-class DBRow:
-    """SQLite-like Row wrapper for PostgreSQL dict results."""
-    def __init__(self, data):
-        self._data = data
-    def __getitem__(self, key):
-        if isinstance(key, int):
-            return list(self._data.values())[key]
-        return self._data.get(key)
-    def keys(self):
-        return self._data.keys()
+        with _pg_pool_lock:
+            if _pg_pool is None:
+                _pg_pool = PGConnectionPool(
+                    _pg_connect,
+                    minconn=DB_POOL_MIN,
+                    maxconn=DB_POOL_MAX,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    acquire_timeout=DB_POOL_TIMEOUT,
+                    health_check_after=DB_POOL_HEALTHCHECK_AFTER
+                )
+                _pg_pool.prefill()
+    return _pg_pool
 
-def db():
-    """Get database connection - PostgreSQL if configured, otherwise SQLite."""
+def get_pg_connection():
+    """Get PostgreSQL connection from pool (returned to the pool on `with` exit)."""
+    return get_pg_pool().connection()
+
+def db_pool_stats() -> dict:
+    """Connection pool metrics for /health."""
+    if USE_POSTGRES:
+        return get_pg_pool().stats() if _pg_pool is not None else {"size": 0}
+    return dict(_sqlite_cache.stats(), requests=_sqlite_request_cache.stats())
+
+def _db_dialect() -> str:
+    return db_migrations.POSTGRES if USE_POSTGRES else db_migrations.SQLITE
+
+def _raw_db():
+    """Connection outside of the request's unit of work: commits on `with` exit.
+
+    Always a different connection from db() inside a request. On SQLite a
+    write here waits for the request's own pending writes (single writer),
+    so request code that must write out of band uses db_autonomous().
+    """
     if USE_POSTGRES:
         return get_pg_connection()
     else:
-        con = sqlite3.connect(DB_PATH)
-        con.row_factory = sqlite3.Row
-        return con
+        return _sqlite_cache.get()
+
+def _request_uow(create: bool = True):
+    """Unit of work bound to the current request (None outside a request)."""
+    if not has_request_context():
+        return None
+    uow = g.get("_db_uow")
+    if uow is None and create:
+        if USE_POSTGRES:
+            uow = UnitOfWork(lambda: get_pg_pool().acquire(), lambda c: get_pg_pool().release(c))
+        else:
+            uow = UnitOfWork(_sqlite_request_cache.get, lambda c: None)
+        g._db_uow = uow
+    return uow
+
+def db():
+    """Get database connection.
+
+    Inside a request every helper shares one connection and one transaction,
+    committed once when the request finishes. Elsewhere (background threads,
+    CLI) it is a pooled PostgreSQL / per-thread SQLite connection.
+    """
+    uow = _request_uow()
+    if uow is not None:
+        return uow.connection()
+    return _raw_db()
+
+def db_autonomous():
+    """Connection for writes that must survive a later failure of the request.
+
+    Commits on `with` exit, on its own connection. SQLite allows a single
+    writer, so when the request already has pending writes they are
+    committed first instead of waiting on our own write lock: on SQLite
+    this ends the request's single transaction early, and a later failure
+    keeps the writes made before the call. Each call site says why that
+    trade is taken; for cache invalidation use on_request_commit instead.
+    """
+    uow = _request_uow(create=False)
+    if uow is not None and not USE_POSTGRES and uow.pending:
+        uow.checkpoint()
+    return _raw_db()
+
+def db_checkpoint():
+    """Commit the request's work so far and release its connection.
+
+    Call before slow upstream (LLM/TTS/STT) calls so the request does not
+    hold a pooled connection or the SQLite write lock while it waits. This
+    deliberately splits the request's transaction: writes made before the
+    call stay committed if the request fails after it.
+    """
+    uow = _request_uow(create=False)
+    if uow is not None:
+        uow.checkpoint()
+
+def on_request_commit(fn):
+    """Run `fn` once the request's pending writes are committed (never if they roll back);
+    right away when nothing is pending. For cache invalidation, which must not see the
+    old rows after a concurrent reload, without committing the request early."""
+    uow = _request_uow(create=False)
+    if uow is not None and uow.pending:
+        uow.after_commit(fn)
+    else:
+        fn()
+
+@app.after_request
+def commit_request_db(response):
+    uow = _request_uow(create=False)
+    if uow is not None and uow.active:
+        try:
+            uow.commit()
+        except Exception as e:
+            logger.error(f"Request commit failed: {e}")
+            uow.rollback()
+            # after_request hooks must return a Response, not a (body, status) tuple
+            failed = jsonify({"error": "Database commit failed"})
+            failed.status_code = 500
+            return failed
+    return response
+
+@app.teardown_request
+def release_request_db(exc):
+    uow = g.pop("_db_uow", None)
+    if uow is None:
+        return
+    if exc is not None:
+        uow.failed = True
+    # Rolls back anything not committed by commit_request_db (unhandled errors)
+    uow.close()
 
 
 def init_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    """Bring the schema to head (see db_migrations.py) or, with K1_AUTO_MIGRATE=false, just verify it."""
+    if not USE_POSTGRES:
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     os.makedirs(AUDIO_DIR, exist_ok=True)
-    with db() as con:
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id TEXT PRIMARY KEY,
-                created_at TEXT NOT NULL,
-                last_seen_at TEXT NOT NULL,
-                profile_json TEXT NOT NULL
-            )
-        """)
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                session_id TEXT NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                meta_json TEXT NOT NULL
-            )
-        """)
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS audit (
-                id TEXT PRIMARY KEY,
-                ts TEXT NOT NULL,
-                user_id TEXT,
-                session_id TEXT,
-                action TEXT NOT NULL,
-                detail_json TEXT NOT NULL
-            )
-        """)
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS leads (
-                id TEXT PRIMARY KEY,
-                ts TEXT NOT NULL,
-                name TEXT,
-                email TEXT,
-                message TEXT
-            )
-        """)
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS summaries (
-                user_id TEXT PRIMARY KEY,
-                updated_at TEXT NOT NULL,
-                summary TEXT NOT NULL
-            )
-        """)
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS feedback (
-                id TEXT PRIMARY KEY,
-                ts TEXT NOT NULL,
-                user_id TEXT,
-                session_id TEXT,
-                message_id TEXT,
-                rating INTEGER,
-                correction TEXT
-            )
-        """)
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS rules (
-                id TEXT PRIMARY KEY,
-                ts TEXT NOT NULL,
-                title TEXT NOT NULL,
-                body TEXT NOT NULL,
-                enabled INTEGER NOT NULL
-            )
-        """)
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS sources (
-                domain TEXT PRIMARY KEY,
-                trust INTEGER NOT NULL,
-                updated_at TEXT NOT NULL
-            )
-        """)
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS presence (
-                user_id TEXT NOT NULL,
-                session_id TEXT NOT NULL,
-                updated_at INTEGER NOT NULL,
-                state_json TEXT NOT NULL,
-                PRIMARY KEY (user_id, session_id)
-            )
-        """)
-        # Token table for password reset, email verification, etc.
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS tokens (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                token_type TEXT NOT NULL,
-                token_hash TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                expires_at TEXT NOT NULL,
-                used INTEGER DEFAULT 0
-            )
-        """)
-        # 2FA backup codes table
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS backup_codes (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                code_hash TEXT NOT NULL,
-                used INTEGER DEFAULT 0,
-                created_at TEXT NOT NULL
-            )
-        """)
-        # Broadcasts table for admin messages
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS broadcasts (
-                id TEXT PRIMARY KEY,
-                title TEXT NOT NULL,
-                body TEXT NOT NULL,
-                priority TEXT DEFAULT 'info',
-                require_confirmation INTEGER DEFAULT 1,
-                target TEXT DEFAULT 'all',
-                target_user_id TEXT,
-                created_at TEXT NOT NULL,
-                confirmations_json TEXT DEFAULT '[]'
-            )
-        """)
-        # Subscription tiers table
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS subscription_tiers (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                price REAL DEFAULT 0,
-                features_json TEXT DEFAULT '[]',
-                msg_limit INTEGER DEFAULT 0,
-                active INTEGER DEFAULT 1,
-                popular INTEGER DEFAULT 0
-            )
-        """)
-        con.commit()
+    dialect = _db_dialect()
+    with _raw_db() as con:
+        if K1_AUTO_MIGRATE:
+            applied = db_migrations.migrate(con, dialect)
+            if applied:
+                logger.info(f"Schema migrated: applied {applied}")
+        else:
+            report = db_migrations.verify(con, dialect)
+            if not report["ok"]:
+                logger.error(f"Schema is not at head, run `python db_migrations.py migrate`: {report}")
+
+
+def _user_index_values(user_id: str, profile: dict) -> tuple:
+    cols = db_migrations.user_columns_from_profile(user_id, profile)
+    return tuple(cols[c] for c in db_migrations.USER_INDEX_COLUMNS)
+
+
+_USER_INDEX_SET_SQL = ", ".join(f"{c} = ?" for c in db_migrations.USER_INDEX_COLUMNS)
+
+
+def save_user_profile(con, user_id: str, profile: dict):
+    """Write profile_json together with its indexed columns (email, tier, ...)."""
+    con.execute(f"UPDATE users SET profile_json = ?, {_USER_INDEX_SET_SQL} WHERE user_id = ?",
+                (json.dumps(profile, ensure_ascii=False),) + _user_index_values(user_id, profile) + (user_id,))
 
 
 def upsert_user(user_id: str, profile: dict | None = None):
@@ -510,30 +654,185 @@ def upsert_user(user_id: str, profile: dict | None = None):
     with db() as con:
         row = con.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,)).fetchone()
         if row:
-            con.execute("UPDATE users SET last_seen_at = ?, profile_json = ? WHERE user_id = ?",
-                        (now, json.dumps(profile, ensure_ascii=False), user_id))
+            con.execute(f"UPDATE users SET last_seen_at = ?, profile_json = ?, {_USER_INDEX_SET_SQL} WHERE user_id = ?",
+                        (now, json.dumps(profile, ensure_ascii=False)) + _user_index_values(user_id, profile) + (user_id,))
         else:
-            con.execute("INSERT INTO users (user_id, created_at, last_seen_at, profile_json) VALUES (?,?,?,?)",
-                        (user_id, now, now, json.dumps(profile, ensure_ascii=False)))
+            columns = ", ".join(db_migrations.USER_INDEX_COLUMNS)
+            placeholders = ",".join("?" * (4 + len(db_migrations.USER_INDEX_COLUMNS)))
+            con.execute(f"INSERT INTO users (user_id, created_at, last_seen_at, profile_json, {columns}) VALUES ({placeholders})",
+                        (user_id, now, now, json.dumps(profile, ensure_ascii=False)) + _user_index_values(user_id, profile))
+            bump_stat(con, "users")
         con.commit()
 
+# --- usage counters (see migration 0004): O(1) daily / lifetime message counts ---
+USAGE_LIFETIME = "*"
+_usage_cache = ttl_cache.TTLCache(maxsize=USAGE_CACHE_SIZE, ttl=USAGE_CACHE_TTL)
+
+def _bump_usage(con, user_id: str, day: str, role: str):
+    """Increment the day and lifetime counters on `con` (caller's transaction).
+
+    Cached counts follow only once the request commits; on a connection
+    outside a request the cached keys are dropped instead. Until then the
+    keys are pending: get_usage reads see the +1 and must not cache it.
+    """
+    is_user = 1 if role == "user" else 0
+    for key in (day, USAGE_LIFETIME):
+        con.execute(
+            """INSERT INTO usage_counters (user_id, day, messages, user_messages) VALUES (?,?,1,?)
+               ON CONFLICT(user_id, day) DO UPDATE SET messages = usage_counters.messages + 1,
+               user_messages = usage_counters.user_messages + excluded.user_messages""",
+            (user_id, key, is_user)
+        )
+        if hasattr(con, "after_commit"):
+            pending = g.setdefault("_usage_pending", set())
+            pending.add((user_id, key))
+            con.after_commit(lambda k=(user_id, key): _usage_committed(k, is_user, pending))
+        else:
+            _usage_cache.pop((user_id, key))
+
+def _usage_committed(key: tuple, is_user: int, pending: set):
+    pending.discard(key)
+    _usage_cache.update(key, lambda v: (v[0] + 1, v[1] + is_user))
+
+def get_usage(user_id: str, day: str = USAGE_LIFETIME) -> tuple:
+    """(messages, user_messages) for a UTC day (YYYY-MM-DD) or the lifetime totals."""
+    key = (user_id, day)
+    cached = _usage_cache.get(key)
+    if cached is not None:
+        return cached
+    with db() as con:
+        row = con.execute("SELECT messages, user_messages FROM usage_counters WHERE user_id = ? AND day = ?",
+                          (user_id, day)).fetchone()
+    value = (int(row["messages"]), int(row["user_messages"])) if row else (0, 0)
+    # A bump still pending in this request is in `value` already; its after_commit +1 would count it twice
+    if not (has_request_context() and key in g.get("_usage_pending", ())):
+        _usage_cache.set(key, value)
+    return value
+
+def forget_usage(user_id: str):
+    _usage_cache.discard_where(lambda k: k[0] == user_id)
+
+# --- global counters (see migration 0007): O(1) dashboard totals ---
+STAT_QUERIES = {
+    "users": "SELECT COUNT(*) c FROM users",
+    "messages": "SELECT COUNT(*) c FROM messages",
+    "leads": "SELECT COUNT(*) c FROM leads",
+}
+
+def bump_stat(con, name: str, delta: int = 1):
+    """Add `delta` to counter `name` on `con` (caller's transaction)."""
+    if not delta:
+        return
+    con.execute(
+        """INSERT INTO stats (name, shard, value) VALUES (?,?,?)
+           ON CONFLICT(name, shard) DO UPDATE SET value = stats.value + excluded.value""",
+        (name, random.randrange(STATS_SHARDS), int(delta))
+    )
+
+def get_stats() -> dict:
+    """{name: value} for every counter in STAT_QUERIES."""
+    with db() as con:
+        rows = con.execute("SELECT name, SUM(value) AS value FROM stats GROUP BY name").fetchall()
+    values = {r["name"]: int(r["value"] or 0) for r in rows}
+    return {name: values.get(name, 0) for name in STAT_QUERIES}
+
+def reconcile_stats() -> dict:
+    """Reset each counter to its true COUNT(*); returns {name: drift corrected}.
+
+    Each counter is recounted in its own transaction with writers to `stats`
+    held off (BEGIN IMMEDIATE on SQLite, an EXCLUSIVE table lock on
+    PostgreSQL), so no increment lands between the count and the reset.
+    """
+    drift = {}
+    with _raw_db() as con:
+        for name, count_sql in STAT_QUERIES.items():
+            if USE_POSTGRES:
+                con.execute("LOCK TABLE stats IN EXCLUSIVE MODE")
+            else:
+                if con.in_transaction:
+                    con.commit()
+                con.execute("BEGIN IMMEDIATE")
+            try:
+                actual = int(con.execute(count_sql).fetchone()["c"])
+                row = con.execute("SELECT SUM(value) AS value FROM stats WHERE name = ?", (name,)).fetchone()
+                counted = int(row["value"] or 0) if row else 0
+                con.execute("DELETE FROM stats WHERE name = ?", (name,))
+                con.execute("INSERT INTO stats (name, shard, value) VALUES (?, 0, ?)", (name, actual))
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
+            drift[name] = actual - counted
+    if any(drift.values()):
+        logger.warning(f"Stats counters drifted, corrected: {drift}")
+    return drift
+
+stats_reconciler = periodic.register(
+    periodic.PeriodicJob("stats_reconcile", reconcile_stats, STATS_RECONCILE_SECONDS,
+                         jitter=STATS_RECONCILE_SECONDS * 0.1)
+) if STATS_RECONCILE_SECONDS > 0 else None
+
 def add_message(user_id: str, session_id: str, role: str, content: str, meta: dict | None = None):
     meta = meta or {}
     mid = str(uuid.uuid4())
+    now = utc_now_iso()
     with db() as con:
         con.execute(
             "INSERT INTO messages (id, user_id, session_id, role, content, created_at, meta_json) VALUES (?,?,?,?,?,?,?)",
-            (mid, user_id, session_id, role, content, utc_now_iso(), json.dumps(meta, ensure_ascii=False))
+            (mid, user_id, session_id, role, content, now, json.dumps(meta, ensure_ascii=False))
         )
+        _bump_usage(con, user_id, now[:10], role)
+        bump_stat(con, "messages")
         con.commit()
     return mid
 
-def log_audit(action: str, detail: dict, user_id: str | None = None, session_id: str | None = None):
-    with db() as con:
+_AUDIT_INSERT = "INSERT INTO audit (id, ts, user_id, session_id, action, detail_json) VALUES "
+_AUDIT_ROWS_PER_STATEMENT = 100  # 6 params per row, well under SQLite's variable limit
+
+def _insert_audit_rows(con, rows: list):
+    """Multi-row insert of audit rows plus their audit_hourly rollup increments."""
+    for i in range(0, len(rows), _AUDIT_ROWS_PER_STATEMENT):
+        chunk = rows[i:i + _AUDIT_ROWS_PER_STATEMENT]
+        con.execute(_AUDIT_INSERT + ",".join(["(?,?,?,?,?,?)"] * len(chunk)),
+                    [v for row in chunk for v in row])
+    hourly = {}
+    for row in rows:
+        key = (row[1][:13], row[4])  # (ts hour 'YYYY-MM-DDTHH', action)
+        hourly[key] = hourly.get(key, 0) + 1
+    for (hour, action), n in sorted(hourly.items()):
         con.execute(
-            "INSERT INTO audit (id, ts, user_id, session_id, action, detail_json) VALUES (?,?,?,?,?,?)",
-            (str(uuid.uuid4()), utc_now_iso(), user_id, session_id, action, json.dumps(detail, ensure_ascii=False))
+            """INSERT INTO audit_hourly (hour, action, count) VALUES (?,?,?)
+               ON CONFLICT(hour, action) DO UPDATE SET count = audit_hourly.count + excluded.count""",
+            (hour, action, n)
         )
+
+def _write_audit_rows(rows: list):
+    """One transaction per batch from the audit write-behind buffer."""
+    with _raw_db() as con:
+        _insert_audit_rows(con, rows)
+
+audit_buffer = WriteBehindBuffer(
+    "audit", _write_audit_rows,
+    max_batch=AUDIT_BATCH_MAX,
+    max_latency=AUDIT_BATCH_LATENCY_MS / 1000.0,
+    max_queue=AUDIT_QUEUE_MAX,
+    overflow=AUDIT_OVERFLOW
+)
+
+def log_audit(action: str, detail: dict, user_id: str | None = None, session_id: str | None = None,
+              durable: bool = False):
+    """Append an audit row.
+
+    Rows go through the write-behind buffer and are committed by its writer
+    thread. durable=True writes synchronously and commits before returning,
+    through db_autonomous: on SQLite that commits the request's earlier writes too.
+    """
+    row = (str(uuid.uuid4()), utc_now_iso(), user_id, session_id, action, json.dumps(detail, ensure_ascii=False))
+    if not durable and AUDIT_WRITE_BEHIND:
+        audit_buffer.put(row)
+        return
+    with (db_autonomous() if durable else db()) as con:
+        _insert_audit_rows(con, [row])
         con.commit()
 
 def get_recent_context(user_id: str, session_id: str, limit: int = 14) -> list[dict]:
@@ -544,11 +843,14 @@ def get_recent_context(user_id: str, session_id: str, limit: int = 14) -> list[d
         ).fetchall()
     return [{"role": r["role"], "content": r["content"]} for r in reversed(rows)]
 
-def get_user_summary(user_id: str) -> str:
+def _load_user_summary(user_id: str) -> str:
     with db() as con:
         row = con.execute("SELECT summary FROM summaries WHERE user_id = ?", (user_id,)).fetchone()
     return row["summary"] if row else ""
 
+def get_user_summary(user_id: str) -> str:
+    return prompt_builder.summary(user_id)
+
 def set_user_summary(user_id: str, summary: str):
     with db() as con:
         row = con.execute("SELECT user_id FROM summaries WHERE user_id = ?", (user_id,)).fetchone()
@@ -559,12 +861,17 @@ def set_user_summary(user_id: str, summary: str):
             con.execute("INSERT INTO summaries (user_id, updated_at, summary) VALUES (?,?,?)",
                         (user_id, utc_now_iso(), summary))
         con.commit()
+    on_request_commit(lambda: prompt_builder.invalidate_summary(user_id))
 
 def get_enabled_rules() -> list[dict]:
     with db() as con:
         rows = con.execute("SELECT id, title, body FROM rules WHERE enabled = 1 ORDER BY ts DESC").fetchall()
     return [{"id": r["id"], "title": r["title"], "body": r["body"]} for r in rows]
 
+# System prompt: static text + admin rules cached per rules version, summaries per user
+prompt_builder = SystemPromptBuilder(get_enabled_rules, _load_user_summary,
+                                     language=DEFAULT_LANGUAGE, ttl=PROMPT_CACHE_TTL)
+
 def domain_from_url(url: str) -> str:
     try:
         import urllib.parse as up
@@ -572,12 +879,23 @@ def domain_from_url(url: str) -> str:
     except Exception:
         return ""
 
-def get_source_trust(domain: str) -> int:
-    if not domain:
-        return 50
+def _load_source_trust(limit: int) -> dict:
+    with db() as con:
+        rows = con.execute("SELECT domain, trust FROM sources LIMIT ?", (limit,)).fetchall()
+    return {r["domain"]: int(r["trust"]) for r in rows}
+
+def _load_source_trust_for(domains: list[str]) -> dict:
     with db() as con:
-        row = con.execute("SELECT trust FROM sources WHERE domain = ?", (domain,)).fetchone()
-    return int(row["trust"]) if row else 50
+        rows = con.execute(f"SELECT domain, trust FROM sources WHERE domain IN ({','.join('?' * len(domains))})",
+                           tuple(domains)).fetchall()
+    return {r["domain"]: int(r["trust"]) for r in rows}
+
+# In-memory sources.trust (refreshed by set_source_trust, reloaded every K1_SOURCE_TRUST_TTL seconds)
+source_trust_map = SourceTrustMap(_load_source_trust, _load_source_trust_for, ttl=SOURCE_TRUST_TTL)
+_source_allowlist = SuffixTrie.from_csv(K1_SOURCE_ALLOWLIST)
+
+def get_source_trust(domain: str) -> int:
+    return source_trust_map.get(domain)
 
 def set_source_trust(domain: str, trust: int):
     trust = max(0, min(100, int(trust)))
@@ -590,15 +908,28 @@ def set_source_trust(domain: str, trust: int):
             con.execute("INSERT INTO sources (domain, trust, updated_at) VALUES (?,?,?)",
                         (domain, trust, utc_now_iso()))
         con.commit()
+    on_request_commit(lambda: source_trust_map.set(domain, trust))
 
 def allowlisted(domain: str) -> bool:
-    if not K1_SOURCE_ALLOWLIST.strip():
+    if not len(_source_allowlist):
         return True
-    allowed = [d.strip().lower() for d in K1_SOURCE_ALLOWLIST.split(",") if d.strip()]
-    return any(domain == d or domain.endswith("." + d) for d in allowed)
+    return _source_allowlist.matches(domain)
 
 # --- AI helpers ---
 
+# Pooled keep-alive sessions per provider host, shared with the Super AI modules (see provider_client.py)
+provider_http = get_provider_client()
+
+def provider_warm_urls() -> list[str]:
+    urls = []
+    if OPENAI_API_KEY:
+        urls.append(OPENAI_BASE_URL)
+    if DEEPSEEK_API_KEY:
+        urls.append(DEEPSEEK_BASE_URL)
+    if os.getenv("ANTHROPIC_API_KEY"):
+        urls.append("https://api.anthropic.com/v1")
+    return urls
+
 def deepseek_headers_json():
     if not DEEPSEEK_API_KEY:
         raise RuntimeError("DEEPSEEK_API_KEY is not configured")
@@ -609,23 +940,10 @@ def openai_headers_json():
         raise RuntimeError("OPENAI_API_KEY is not configured")
     return {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
 
-def call_deepseek_chat(user_id: str, user_text: str, context: list[dict]) -> dict:
-    """Call DeepSeek API (OpenAI-compatible, free tier available)."""
-    user_summary = get_user_summary(user_id)
-    rules = get_enabled_rules()
-    rules_text = "\n".join([f"- {r['title']}: {r['body']}" for r in rules])
-    system_instructions = (
-        "You are Kelion, a WebGL hologram assistant.\n"
-        "USER SUMMARY (persistent memory, may be empty):\n" + user_summary + "\n"
-        "ADMIN RULES (must follow):\n" + rules_text + "\n"
-        f"Default language: {DEFAULT_LANGUAGE}.\n"
-        "Tone: friendly, conversational.\n"
-        "You should answer directly. Do not mention tools.\n"
-        "If the user asks to delete/reset memory: refuse politely. Users cannot delete data; only admin/legal process.\n"
-        "When the situation is ambiguous or information is uncertain: ask a clarifying question first.\n"
-        "If after clarification you believe the request is illegal or unsafe: refuse politely and explain limits.\n"
-        "Return: plain answer text.\n"
-    )
+def call_deepseek_chat(user_id: str, user_text: str, context: list[dict], budget_id: str | None = None) -> dict:
+    """Call DeepSeek API (OpenAI-compatible, free tier available). Tokens are charged to
+    `budget_id` (see budget_identity), `user_id` when not given."""
+    system_instructions = prompt_builder.build("deepseek", user_id)
 
     messages = [{"role": "system", "content": system_instructions}]
     for m in context:
@@ -639,9 +957,20 @@ def call_deepseek_chat(user_id: str, user_text: str, context: list[dict]) -> dic
         "max_tokens": 2048,
     }
 
-    r = requests.post(f"{DEEPSEEK_BASE_URL}/chat/completions", headers=deepseek_headers_json(), json=payload, timeout=60)
-    r.raise_for_status()
-    data = r.json()
+    # Raises TokenBudgetExceeded before anything is sent; settled with the reported usage below
+    reservation = token_ledger.reserve(budget_id or user_id, estimate_tokens(*(m["content"] for m in messages))
+                                       + min(payload["max_tokens"], TOKEN_OUTPUT_ESTIMATE))
+    # Don't hold the request's DB transaction across the upstream call; deliberately commits the
+    # stored user message, which stays if the call or anything after it fails
+    db_checkpoint()
+    try:
+        r = provider_http.post(f"{DEEPSEEK_BASE_URL}/chat/completions", headers=deepseek_headers_json(), json=payload, timeout=60)
+        r.raise_for_status()
+        data = r.json()
+    except Exception:
+        token_ledger.release(reservation)
+        raise
+    token_ledger.settle(reservation, data.get("model") or DEEPSEEK_MODEL, *usage_tokens(data.get("usage")))
 
     output_text = ""
     if data.get("choices"):
@@ -657,23 +986,9 @@ def call_deepseek_chat(user_id: str, user_text: str, context: list[dict]) -> dic
 
     return {"text": output_text.strip(), "sources": [], "emotion": emotion}
 
-def call_openai_chat(user_id: str, user_text: str, context: list[dict]) -> dict:
-    user_summary = get_user_summary(user_id)
-    rules = get_enabled_rules()
-    rules_text = "\n".join([f"- {r['title']}: {r['body']}" for r in rules])
-    system_instructions = (
-        "You are Kelion, a WebGL hologram assistant.\n"
-        "USER SUMMARY (persistent memory, may be empty):\n" + user_summary + "\n"
-        "ADMIN RULES (must follow):\n" + rules_text + "\n"
-        f"Default language: {DEFAULT_LANGUAGE}.\n"
-        "Tone: friendly, conversational.\n"
-        "You should answer directly. Do not mention tools.\n"
-        "If the user asks to delete/reset memory: refuse politely. Users cannot delete data; only admin/legal process.\n"
-        "When the situation is ambiguous or information is uncertain: ask a clarifying question first.\n"
-        "If after clarification you believe the request is illegal or unsafe: refuse politely and explain limits.\n"
-        "You may use web search for up-to-date information when needed.\n"
-        "Return: plain answer text + optionally sources list.\n"
-    )
+def call_openai_chat(user_id: str, user_text: str, context: list[dict], budget_id: str | None = None) -> dict:
+    """OpenAI Responses API with web search; tokens charged as in call_deepseek_chat."""
+    system_instructions = prompt_builder.build("openai", user_id)
 
     dialog = []
     for m in context:
@@ -689,9 +1004,19 @@ def call_openai_chat(user_id: str, user_text: str, context: list[dict]) -> dict:
         "input": [{"role": "system", "content": system_instructions}, *dialog],
     }
 
-    r = requests.post(f"{OPENAI_BASE_URL}/responses", headers=openai_headers_json(), json=payload, timeout=60)
-    r.raise_for_status()
-    data = r.json()
+    reservation = token_ledger.reserve(budget_id or user_id, estimate_tokens(system_instructions, *(m["content"] for m in dialog))
+                                       + TOKEN_OUTPUT_ESTIMATE)
+    # Don't hold the request's DB transaction across the upstream call; deliberately commits the
+    # stored user message, which stays if the call or anything after it fails
+    db_checkpoint()
+    try:
+        r = provider_http.post(f"{OPENAI_BASE_URL}/responses", headers=openai_headers_json(), json=payload, timeout=60)
+        r.raise_for_status()
+        data = r.json()
+    except Exception:
+        token_ledger.release(reservation)
+        raise
+    token_ledger.settle(reservation, data.get("model") or OPENAI_MODEL, *usage_tokens(data.get("usage")))
 
     output_text = ""
     sources = []
@@ -725,8 +1050,10 @@ def call_openai_chat(user_id: str, user_text: str, context: list[dict]) -> dict:
         if not allowlisted(d):
             continue
         s["domain"] = d
-        s["trust"] = get_source_trust(d)
         filtered.append(s)
+    trust = source_trust_map.lookup_many(s["domain"] for s in filtered)
+    for s in filtered:
+        s["trust"] = trust.get(s["domain"], source_trust_map.default)
     filtered.sort(key=lambda x: x.get("trust", 50), reverse=True)
     return {"text": output_text.strip(), "sources": filtered[:8], "emotion": emotion}
 
@@ -744,7 +1071,9 @@ def call_openai_tts(text: str) -> str | None:
         "input": text,
         "instructions": "Speak in a friendly, conversational tone. Male voice."
     }
-    r = requests.post(f"{OPENAI_BASE_URL}/audio/speech", headers=openai_headers_json(), json=payload, timeout=60)
+    # Upstream TTS call ahead: commits the request's writes so far (a failed TTS keeps the chat turn)
+    db_checkpoint()
+    r = provider_http.post(f"{OPENAI_BASE_URL}/audio/speech", headers=openai_headers_json(), json=payload, timeout=60)
     r.raise_for_status()
     with open(out_path, "wb") as f:
         f.write(r.content)
@@ -752,9 +1081,7 @@ def call_openai_tts(text: str) -> str | None:
 
 def maybe_update_summary(user_id: str, session_id: str):
     # Update summary every ~30 user messages
-    with db() as con:
-        row = con.execute("SELECT COUNT(*) c FROM messages WHERE user_id = ? AND role = 'user'", (user_id,)).fetchone()
-    c = int(row["c"])
+    c = get_usage(user_id)[1]
     if c % 30 != 0:
         return
     recent = get_recent_context(user_id, session_id, limit=40)
@@ -775,7 +1102,9 @@ def maybe_update_summary(user_id: str, session_id: str):
                 {"role": "user", "content": prompt},
             ],
         }
-        r = requests.post(f"{OPENAI_BASE_URL}/responses", headers=openai_headers_json(), json=payload, timeout=60)
+        # Summarizer call ahead: commits the chat turn first; a failed summary leaves it stored
+        db_checkpoint()
+        r = provider_http.post(f"{OPENAI_BASE_URL}/responses", headers=openai_headers_json(), json=payload, timeout=60)
         r.raise_for_status()
         data = r.json()
         txt = ""
@@ -803,7 +1132,9 @@ def call_openai_stt_words(file_bytes: bytes, filename: str = "audio.mp3") -> dic
         ("response_format", "verbose_json"),
         ("timestamp_granularities[]", "word"),
     ]
-    r = requests.post(f"{OPENAI_BASE_URL}/audio/transcriptions", headers=headers, files=files, data=data, timeout=60)
+    # Upstream STT call ahead: commits the request's writes so far, kept if transcription fails
+    db_checkpoint()
+    r = provider_http.post(f"{OPENAI_BASE_URL}/audio/transcriptions", headers=headers, files=files, data=data, timeout=60)
     r.raise_for_status()
     return r.json()
 
@@ -860,7 +1191,7 @@ def call_openai_stt(file_bytes: bytes, filename: str = "speech.webm") -> dict:
     files = {"file": (filename, file_bytes)}
     # Use verbose_json to get detected language, no forced language
     data = {"model": OPENAI_STT_MODEL, "response_format": "verbose_json"}
-    r = requests.post(f"{OPENAI_BASE_URL}/audio/transcriptions", headers=headers, files=files, data=data, timeout=60)
+    r = provider_http.post(f"{OPENAI_BASE_URL}/audio/transcriptions", headers=headers, files=files, data=data, timeout=60)
     r.raise_for_status()
     j = r.json()
     return {
@@ -884,30 +1215,117 @@ def add_security_headers(response):
         response.headers["Access-Control-Allow-Origin"] = origin
     else:
         response.headers["Access-Control-Allow-Origin"] = "https://kelionai.app"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type, X-API-Token, X-Admin-Token"
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type, X-API-Token, X-Admin-Token, X-Session-Token"
     response.headers["Access-Control-Allow-Credentials"] = "true"
     return response
 
-# Rate Limit generic (in-memory simple)
-REQUEST_COUNTS = {}
+# Set once the worker starts shutting down (see begin_drain)
+_draining = threading.Event()
+# New long-running work refused while draining: the client retries and lands on a live worker
+DRAIN_REFUSED_PATHS = ("/api/chat", "/external/input", "/api/events", "/api/super/chat")
+
+@app.before_request
+def refuse_new_work_while_draining():
+    if _draining.is_set() and request.path in DRAIN_REFUSED_PATHS:
+        resp = jsonify({"error": "Server restarting, please retry"})
+        resp.headers["Retry-After"] = "1"
+        return resp, 503
+
+@app.before_request
+def ensure_background_jobs():
+    # Cheap pid check; (re)starts job threads in each worker, including forked ones
+    if not _draining.is_set():
+        periodic.ensure_all_running()
+
+# Rate limits (see rate_limiter.py): every request counts against `global` per IP;
+# routes with a policy of their own are limited per user (or IP), by tier where set.
+# K1_RATE_LIMITS overrides any of these, e.g. "global=600/60,api_chat@Pro=90/60".
+rate_limiter = get_rate_limiter()
+rate_limiter.define("global", RateLimit(300, 60))
+rate_limiter.define("api_login", RateLimit(10, 60))
+rate_limiter.define("api_register", RateLimit(5, 60))
+rate_limiter.define("api_forgot_password", RateLimit(5, 900))
+rate_limiter.define("api_chat", RateLimit(20, 60), tiers={"Pro": RateLimit(60, 60), "Elite": RateLimit(240, 60)})
+_tier_cache = ttl_cache.TTLCache(maxsize=USAGE_CACHE_SIZE, ttl=60)
+
+def user_tier(user_id: str) -> str:
+    tier = _tier_cache.get(user_id)
+    if tier is None:
+        with db() as con:
+            row = con.execute("SELECT tier FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        tier = (row["tier"] if row else None) or "Starter"
+        _tier_cache.set(user_id, tier)
+    return tier
+
+# --- LLM token ledger (migration 12): day and month rows per user ---
+def _load_token_usage(user_id: str, day: str, month: str) -> tuple:
+    with db() as con:
+        rows = con.execute("SELECT period, input_tokens + output_tokens AS tokens FROM token_usage "
+                           "WHERE user_id = ? AND period IN (?, ?)", (user_id, day, month)).fetchall()
+    used = {r["period"]: int(r["tokens"]) for r in rows}
+    return used.get(day, 0), used.get(month, 0)
+
+def _record_token_usage(user_id: str, day: str, month: str, input_tokens: int, output_tokens: int, cost: float):
+    # Spend already happened upstream: keep it even if the request fails afterwards. Deliberately
+    # autonomous; on SQLite the request's writes so far are committed with it (the upstream call
+    # already checkpointed them)
+    with db_autonomous() as con:
+        for period in (day, month):
+            con.execute(
+                """INSERT INTO token_usage (user_id, period, input_tokens, output_tokens, cost_usd, requests)
+                   VALUES (?,?,?,?,?,1)
+                   ON CONFLICT(user_id, period) DO UPDATE SET
+                   input_tokens = token_usage.input_tokens + excluded.input_tokens,
+                   output_tokens = token_usage.output_tokens + excluded.output_tokens,
+                   cost_usd = token_usage.cost_usd + excluded.cost_usd,
+                   requests = token_usage.requests + 1""",
+                (user_id, period, input_tokens, output_tokens, cost)
+            )
+        con.commit()
+
+token_ledger = TokenLedger(_load_token_usage, _record_token_usage, user_tier, budgets=TOKEN_BUDGETS,
+                           prices=TOKEN_PRICES, ttl=TOKEN_USAGE_CACHE_TTL, maxsize=USAGE_CACHE_SIZE)
+set_token_ledger(token_ledger)   # claude_brain.call_claude meters through it too
+
+def _rate_limited(decision):
+    resp = jsonify({"error": "Too many requests"})
+    resp.headers["Retry-After"] = str(max(1, math.ceil(decision.retry_after)))
+    resp.headers["X-RateLimit-Limit"] = str(decision.limit)
+    resp.headers["X-RateLimit-Remaining"] = "0"
+    return resp, 429
+
 @app.before_request
 def limit_check():
-    ip = request.remote_addr
-    now = time.time()
-    # clean old
-    to_del = [k for k,v in REQUEST_COUNTS.items() if now - v['start'] > 60]
-    for k in to_del: del REQUEST_COUNTS[k]
-    
-    if ip not in REQUEST_COUNTS:
-        REQUEST_COUNTS[ip] = {'count': 1, 'start': now}
-    else:
-        REQUEST_COUNTS[ip]['count'] += 1
-        if REQUEST_COUNTS[ip]['count'] > 300: # 300 req/min
-            return jsonify({"error": "Too many requests"}), 429
+    ip = request.remote_addr or "unknown"
+    g.session_user = session_user(request)   # blueprints meter against it too (super_ai_routes.chat)
+    decision = rate_limiter.check("global", ip)
+    if not decision.allowed:
+        return _rate_limited(decision)
+    endpoint = request.endpoint
+    if endpoint in rate_limiter.policies and endpoint != "global":
+        # Only a signed session token names the user: a body `userId` is the client's claim,
+        # so anonymous calls share their IP's bucket at the default tier
+        user_id = g.session_user
+        tier = user_tier(user_id) if user_id and rate_limiter.has_tiers(endpoint) else None
+        decision = rate_limiter.check(endpoint, f"user:{user_id}" if user_id else f"ip:{ip}", tier=tier)
+        if not decision.allowed:
+            return _rate_limited(decision)
+
+static_assets = StaticAssets(STATIC_BUILD_DIR)
+
+def send_static_page(filename: str):
+    """A file under static/: from the build when it has it (hashed names are
+    immutable, HTML references them, br/gzip by Accept-Encoding), else as-is."""
+    if static_assets.has(filename):
+        return static_assets.send(filename, request.headers.get("Accept-Encoding", ""))
+    return app.send_static_file(filename)
+
+# Flask's own static route (/<path:filename>, see static_url_path) goes through the build too
+app.view_functions["static"] = send_static_page
 
 @app.get("/")
 def index():
-    return send_from_directory("static", "index.html")
+    return send_static_page("index.html")
 
 @app.get("/audio/<path:filename>")
 def audio_file(filename: str):
@@ -916,24 +1334,24 @@ def audio_file(filename: str):
 # Legal and utility pages
 @app.get("/legal/terms")
 def legal_terms():
-    return send_from_directory("static", "terms.html")
+    return send_static_page("terms.html")
 
 @app.get("/legal/privacy")
 def legal_privacy():
-    return send_from_directory("static", "privacy.html")
+    return send_static_page("privacy.html")
 
 @app.get("/reset-password")
 def reset_password_page():
-    return send_from_directory("static", "reset-password.html")
+    return send_static_page("reset-password.html")
 
 @app.get("/verify-email")
 def verify_email_page():
-    return send_from_directory("static", "verify-email.html")
+    return send_static_page("verify-email.html")
 
 # Admin reports dashboard (authentication handled client-side with token)
 @app.get("/admin/reports")
 def admin_reports_page():
-    return send_from_directory(os.path.join("static", "admin", "reports"), "index.html")
+    return send_static_page("admin/reports/index.html")
 
 # Health check endpoint - shows complete system status
 @app.get("/health")
@@ -945,27 +1363,34 @@ def health_check():
     db_type = "PostgreSQL" if USE_POSTGRES else "SQLite"
     try:
         with db() as con:
-            if USE_POSTGRES:
-                cur = con.cursor()
-                cur.execute("SELECT 1")
-                cur.close()
-            else:
-                con.execute("SELECT 1")
+            con.execute("SELECT 1")
     except Exception as e:
         db_status = f"error: {str(e)[:50]}"
     
     return jsonify({
-        "status": "healthy",
+        "status": "draining" if _draining.is_set() else "healthy",
         "version": "3.0.0",
         "timestamp": utc_now_iso(),
         "components": {
             "database": {
                 "type": db_type,
                 "status": db_status,
-                "path": DB_PATH if not USE_POSTGRES else DATABASE_URL[:30] + "..."
+                "path": DB_PATH if not USE_POSTGRES else DATABASE_URL[:30] + "...",
+                "pool": db_pool_stats(),
+                "queries": db_query.stats() if USE_POSTGRES else None,
+                "audit_writer": audit_buffer.stats(),
+                "visitor_writer": visitor_buffer.stats(),
+                "demo_usage": demo_usage.stats(),
+                "jobs": periodic.all_stats(),
+                "events": events_hub.stats(),
+                "pricing": pricing_snapshot.stats()
             },
+            "rate_limits": rate_limiter.stats(),
+            "token_budget": token_ledger.stats(),
+            "upstream_http": provider_http.stats(),
+            "password_hasher": password_hasher.stats(),
             "security": {
-                "bcrypt": "enabled" if USE_BCRYPT else "fallback (SHA256)",
+                "bcrypt": "enabled" if USE_BCRYPT else "fallback (PBKDF2)",
                 "admin_protected": "yes" if K1_ADMIN_TOKEN else "⚠️ NOT SET",
                 "api_protected": "yes" if K1_API_TOKEN else "open"
             },
@@ -982,7 +1407,7 @@ def health_check():
                 "caching": "enabled" if CACHE_AVAILABLE else "disabled"
             }
         }
-    }), 200
+    }), 503 if _draining.is_set() else 200   # load balancers stop routing to a draining worker
     
 @app.get("/api/version")
 def api_version_endpoint():
@@ -1015,72 +1440,39 @@ def api_stt():
 # ============================================
 # DEMO USAGE LIMITS (30 min/day, 5 days max per IP)
 # ============================================
-DEMO_USAGE_CACHE = {}  # In-memory cache: {ip: {"days": [date1, date2...], "today_minutes": X, "last_activity": timestamp}}
-DEMO_DAILY_LIMIT_MINUTES = 30
-DEMO_MAX_DAYS = 5
+def _load_demo_usage(ip: str) -> list:
+    with db() as con:
+        rows = con.execute("SELECT day, seconds, last_activity FROM demo_usage WHERE ip = ?", (ip,)).fetchall()
+    return [(r["day"], r["seconds"], r["last_activity"]) for r in rows]
+
+def _write_demo_usage(rows: list):
+    """One transaction per batch of (ip, day, timestamp, idle gap), applied in order."""
+    with _raw_db() as con:
+        con.executemany(DEMO_USAGE_UPSERT, rows)
+
+demo_usage = DemoUsage(_load_demo_usage, _write_demo_usage,
+                       daily_limit_minutes=DEMO_DAILY_LIMIT_MINUTES, max_days=DEMO_MAX_DAYS,
+                       ttl=DEMO_CACHE_TTL, max_ips=USAGE_CACHE_SIZE, flush_seconds=DEMO_FLUSH_SECONDS)
 
 def check_demo_limits(client_ip: str) -> dict:
     """Check if demo is allowed for this IP."""
-    from datetime import datetime, date
-    
-    today = date.today().isoformat()
-    now = datetime.now().timestamp()
-    
-    if client_ip not in DEMO_USAGE_CACHE:
-        DEMO_USAGE_CACHE[client_ip] = {"days": [], "today_minutes": 0, "today_date": today, "last_activity": now}
-    
-    usage = DEMO_USAGE_CACHE[client_ip]
-    
-    # Reset daily counter if new day
-    if usage.get("today_date") != today:
-        usage["today_date"] = today
-        usage["today_minutes"] = 0
-        if today not in usage["days"]:
-            usage["days"].append(today)
-    
-    # Check if max days exceeded
-    if len(usage["days"]) > DEMO_MAX_DAYS:
-        return {
-            "allowed": False,
-            "reason": f"Demo limit exceeded. Maximum {DEMO_MAX_DAYS} days reached. Please create an account to continue.",
-            "days_remaining": 0,
-            "minutes_remaining": 0
-        }
-    
-    # Check if daily limit exceeded
-    if usage["today_minutes"] >= DEMO_DAILY_LIMIT_MINUTES:
-        return {
-            "allowed": False,
-            "reason": f"Daily demo limit ({DEMO_DAILY_LIMIT_MINUTES} minutes) reached. Try again tomorrow or create an account.",
-            "days_remaining": DEMO_MAX_DAYS - len(usage["days"]),
-            "minutes_remaining": 0
-        }
-    
-    return {
-        "allowed": True,
-        "days_remaining": DEMO_MAX_DAYS - len(usage["days"]),
-        "minutes_remaining": DEMO_DAILY_LIMIT_MINUTES - usage["today_minutes"]
-    }
+    return demo_usage.check(client_ip)
 
 def track_demo_session(client_ip: str, action: str):
-    """Track demo session activity."""
-    from datetime import datetime
-    
-    if client_ip not in DEMO_USAGE_CACHE:
-        DEMO_USAGE_CACHE[client_ip] = {"days": [], "today_minutes": 0, "today_date": "", "last_activity": 0}
-    
-    usage = DEMO_USAGE_CACHE[client_ip]
-    now = datetime.now().timestamp()
-    
+    """Track demo session activity ("start" on login, "activity" per demo request)."""
     if action == "start":
-        usage["last_activity"] = now
+        demo_usage.start(client_ip)
     elif action == "activity":
-        # Calculate minutes since last activity
-        if usage["last_activity"]:
-            elapsed = (now - usage["last_activity"]) / 60  # Convert to minutes
-            if elapsed < 5:  # Only count if less than 5 min gap (activity)
-                usage["today_minutes"] += elapsed
-        usage["last_activity"] = now
+        demo_usage.activity(client_ip)
+
+def purge_demo_usage() -> int:
+    if DEMO_RETENTION_DAYS <= 0:
+        return 0
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=DEMO_RETENTION_DAYS)).strftime("%Y-%m-%d")
+    with _raw_db() as con:
+        return con.execute("DELETE FROM demo_usage WHERE day < ?", (cutoff,)).rowcount
+
+demo_retention = periodic.register(periodic.PeriodicJob("demo_retention", purge_demo_usage, 86400, jitter=3600))
 
 @app.post("/api/register")
 def api_register():
@@ -1117,6 +1509,8 @@ def api_register():
                     pass
     
     # Hash password and create user
+    # The hash runs in the password pool: end the lookup transaction first (nothing written yet)
+    db_checkpoint()
     password_hash = hash_password(password)
     
     # Get device info for tracking
@@ -1179,18 +1573,10 @@ def api_check_user():
     if not username:
         return jsonify({"exists": False, "error": "Username required"}), 400
     
-    # Check database for user
-    if USE_POSTGRES:
-        with get_pg_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT user_id FROM users WHERE LOWER(user_id) = %s", (username,))
-                row = cur.fetchone()
-                exists = row is not None
-    else:
-        with db() as conn:
-            cur = conn.execute("SELECT user_id FROM users WHERE LOWER(user_id) = ?", (username,))
-            row = cur.fetchone()
-            exists = row is not None
+    # Check database for user (user_key = lower(user_id), indexed)
+    with db() as conn:
+        row = conn.execute("SELECT user_id FROM users WHERE user_key = ?", (username,)).fetchone()
+        exists = row is not None
     
     return jsonify({"exists": exists, "username": username})
 
@@ -1210,17 +1596,22 @@ def api_login():
         # Verify password for admin accounts
         # Get password hash from profile_json
         with db() as conn:
-            row = conn.execute("SELECT profile_json FROM users WHERE LOWER(user_id) = ?", (username.lower(),)).fetchone()
+            row = conn.execute("SELECT user_id, profile_json FROM users WHERE user_key = ?", (username.lower(),)).fetchone()
         
-        stored_hash = None
+        profile = {}
         if row:
             try:
                 profile = json.loads(row["profile_json"])
-                stored_hash = profile.get("password_hash")
             except:
                 pass
+        stored_hash = profile.get("password_hash")
         
-        if stored_hash and verify_password(password, stored_hash):
+        # Don't hold the request's connection while the hash runs (nothing written yet)
+        db_checkpoint()
+        if stored_hash and check_password_upgrade(password, profile):
+            if profile["password_hash"] != stored_hash:
+                with db() as conn:
+                    save_user_profile(conn, row["user_id"], profile)
             admin_token = K1_ADMIN_TOKEN if K1_ADMIN_TOKEN else str(uuid.uuid4())
             log_audit("admin_login", {"user": username, "full_rights": True}, user_id=username, session_id="web")
             return jsonify({
@@ -1303,16 +1694,18 @@ def api_login():
         # User has password - must verify
         if not password:
             return jsonify({"error": "Password required"}), 401
-        if not verify_password(password, stored_hash):
+        # Password check in the pool: commit first; nothing written yet, the login row follows the check
+        db_checkpoint()
+        if not check_password_upgrade(password, profile):
             log_audit("login_failed", {"user": username, "reason": "wrong_password"}, user_id=username)
             return jsonify({"error": "Invalid credentials"}), 401
     
-    # Update last seen
+    # Update last seen (and a re-hashed legacy password)
     upsert_user(username, profile=profile)
     log_audit("login", {"user": username}, user_id=username, session_id="web")
     
     # Generate session token
-    session_token = str(uuid.uuid4())
+    session_token = session_tokens.issue(username)
     
     response = {
         "ok": True,
@@ -1341,41 +1734,74 @@ def generate_token(length: int = 32) -> str:
     import secrets
     return secrets.token_urlsafe(length)
 
+def token_digest(token: str) -> str:
+    """HMAC-SHA256 of a token. Tokens are 32 random bytes, so no slow hash is needed."""
+    return hmac.new(TOKEN_HMAC_KEY.encode("utf-8"), token.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def budget_identity() -> str:
+    """Who a request's LLM tokens and plan limits are charged to: the signed session
+    user, else "ip:<client ip>" (no users row, so the default tier)."""
+    return g.get("session_user") or f"ip:{request.remote_addr or 'unknown'}"
+
+session_tokens = SessionTokens(
+    SESSION_TOKEN_KEY or hmac.new(TOKEN_HMAC_KEY.encode("utf-8"), b"kelion session token key", hashlib.sha256).hexdigest(),
+    hours=SESSION_TOKEN_HOURS)
+
+def session_user(req):
+    """The user whose unexpired session token is in X-Session-Token, else None."""
+    return session_tokens.verify(req.headers.get("X-Session-Token", ""))
+
 def create_token(user_id: str, token_type: str, expires_hours: int = 24) -> str:
-    """Create a token and store its hash in the database."""
-    from datetime import timedelta
+    """Create a token and store its digest in the database."""
     token = generate_token()
-    token_hash = hash_password(token)
     expires_at = (datetime.now(timezone.utc) + timedelta(hours=expires_hours)).isoformat()
     
     with db() as con:
         con.execute(
-            "INSERT INTO tokens (id, user_id, token_type, token_hash, created_at, expires_at, used) VALUES (?,?,?,?,?,?,0)",
-            (str(uuid.uuid4()), user_id, token_type, token_hash, utc_now_iso(), expires_at)
+            "INSERT INTO tokens (id, user_id, token_type, token_hash, token_digest, created_at, expires_at, used) VALUES (?,?,?,?,?,?,?,0)",
+            (str(uuid.uuid4()), user_id, token_type, "", token_digest(token), utc_now_iso(), expires_at)
         )
         con.commit()
     return token
 
 def verify_token(user_id: str, token: str, token_type: str) -> bool:
-    """Verify a token against stored hash."""
+    """Check a token and mark it used (single use)."""
+    if not token:
+        return False
+    now = utc_now_iso()
     with db() as con:
+        # One indexed statement: concurrent uses of the same token can't both succeed
+        claimed = con.execute(
+            "UPDATE tokens SET used = 1, expires_at = ? WHERE token_digest = ? AND user_id = ? AND token_type = ? AND used = 0 AND expires_at > ?",
+            (now, token_digest(token), user_id, token_type, now)
+        ).rowcount
+        if claimed:
+            con.commit()
+            return True
+        # Tokens issued before the digest column existed (bcrypt) until they expire
         rows = con.execute(
-            "SELECT id, token_hash, expires_at, used FROM tokens WHERE user_id = ? AND token_type = ? AND used = 0 ORDER BY created_at DESC LIMIT 5",
-            (user_id, token_type)
+            "SELECT id, token_hash FROM tokens WHERE user_id = ? AND token_type = ? AND used = 0 "
+            "AND token_digest IS NULL AND expires_at > ? ORDER BY created_at DESC LIMIT 5",
+            (user_id, token_type, now)
         ).fetchall()
-    
     for row in rows:
         if verify_password(token, row["token_hash"]):
-            # Check expiration
-            expires = datetime.fromisoformat(row["expires_at"].replace('Z', '+00:00'))
-            if datetime.now(timezone.utc) < expires:
-                # Mark as used
-                with db() as con:
-                    con.execute("UPDATE tokens SET used = 1 WHERE id = ?", (row["id"],))
-                    con.commit()
-                return True
+            with db() as con:
+                claimed = con.execute("UPDATE tokens SET used = 1, expires_at = ? WHERE id = ? AND used = 0",
+                                      (utc_now_iso(), row["id"])).rowcount
+                con.commit()
+            return bool(claimed)
     return False
 
+def purge_tokens() -> int:
+    """Delete expired and used tokens (a used token expires when it is used), on idx_tokens_expires_at."""
+    with _raw_db() as con:
+        return con.execute("DELETE FROM tokens WHERE expires_at < ?", (utc_now_iso(),)).rowcount
+
+token_purge = periodic.register(
+    periodic.PeriodicJob("token_purge", purge_tokens, TOKEN_PURGE_SECONDS, jitter=TOKEN_PURGE_SECONDS * 0.1)
+) if TOKEN_PURGE_SECONDS > 0 else None
+
 
 @app.post("/api/forgot-password")
 def api_forgot_password():
@@ -1386,18 +1812,10 @@ def api_forgot_password():
     if not email:
         return jsonify({"error": "Email required"}), 400
     
-    # Find user by email
-    user_id = None
+    # Find user by email (indexed column, stored lowercased)
     with db() as con:
-        rows = con.execute("SELECT user_id, profile_json FROM users").fetchall()
-        for row in rows:
-            try:
-                profile = json.loads(row["profile_json"])
-                if profile.get("email", "").lower() == email:
-                    user_id = row["user_id"]
-                    break
-            except:
-                pass
+        row = con.execute("SELECT user_id FROM users WHERE email = ? LIMIT 1", (email,)).fetchone()
+    user_id = row["user_id"] if row else None
     
     if not user_id:
         # Don't reveal if email exists
@@ -1444,6 +1862,9 @@ def api_reset_password():
     if len(new_password) < 4:
         return jsonify({"error": "Password must be at least 4 characters"}), 400
     
+    # Hash first: a 503 from a saturated hasher must not consume the reset token
+    new_hash = hash_password(new_password)
+    
     # Verify token
     if not verify_token(user_id, token, "password_reset"):
         return jsonify({"error": "Invalid or expired reset link"}), 401
@@ -1455,9 +1876,8 @@ def api_reset_password():
             return jsonify({"error": "User not found"}), 404
         
         profile = json.loads(row["profile_json"])
-        profile["password_hash"] = hash_password(new_password)
-        con.execute("UPDATE users SET profile_json = ? WHERE user_id = ?",
-                   (json.dumps(profile, ensure_ascii=False), user_id))
+        profile["password_hash"] = new_hash
+        save_user_profile(con, user_id, profile)
         con.commit()
     
     log_audit("password_reset", {"user_id": user_id}, user_id=user_id)
@@ -1540,8 +1960,7 @@ def api_verify_email():
         profile = json.loads(row["profile_json"])
         profile["email_verified"] = True
         profile["email_verified_at"] = utc_now_iso()
-        con.execute("UPDATE users SET profile_json = ? WHERE user_id = ?",
-                   (json.dumps(profile, ensure_ascii=False), user_id))
+        save_user_profile(con, user_id, profile)
         con.commit()
     
     log_audit("email_verified", {"user_id": user_id}, user_id=user_id)
@@ -1557,20 +1976,18 @@ def api_resend_verification():
     if not email:
         return jsonify({"error": "Email required"}), 400
     
-    # Find user by email
+    # Find user by email (indexed column, stored lowercased)
     with db() as con:
-        rows = con.execute("SELECT user_id, profile_json FROM users").fetchall()
-        user_id = None
-        for row in rows:
-            try:
-                profile = json.loads(row["profile_json"])
-                if profile.get("email") == email:
-                    user_id = row["user_id"]
-                    if profile.get("email_verified"):
-                        return jsonify({"error": "Email already verified"}), 400
-                    break
-            except:
-                continue
+        row = con.execute("SELECT user_id, profile_json FROM users WHERE email = ? LIMIT 1",
+                          (email.lower(),)).fetchone()
+    user_id = None
+    if row:
+        user_id = row["user_id"]
+        try:
+            if json.loads(row["profile_json"]).get("email_verified"):
+                return jsonify({"error": "Email already verified"}), 400
+        except ValueError:
+            pass
     
     if not user_id:
         return jsonify({"error": "Email not found"}), 404
@@ -1672,8 +2089,7 @@ def api_2fa_setup():
     # Store pending secret (not activated until verified)
     profile["totp_secret_pending"] = secret
     with db() as con:
-        con.execute("UPDATE users SET profile_json = ? WHERE user_id = ?",
-                   (json.dumps(profile, ensure_ascii=False), user_id))
+        save_user_profile(con, user_id, profile)
         con.commit()
     
     # Generate QR code URL
@@ -1736,8 +2152,7 @@ def api_2fa_verify():
         profile["2fa_enabled"] = True
         profile["2fa_enabled_at"] = utc_now_iso()
         with db() as con:
-            con.execute("UPDATE users SET profile_json = ? WHERE user_id = ?",
-                       (json.dumps(profile, ensure_ascii=False), user_id))
+            save_user_profile(con, user_id, profile)
             con.commit()
         log_audit("2fa_enabled", {"user_id": user_id}, user_id=user_id)
     
@@ -1778,8 +2193,7 @@ def api_2fa_disable():
     profile["2fa_enabled"] = False
     
     with db() as con:
-        con.execute("UPDATE users SET profile_json = ? WHERE user_id = ?",
-                   (json.dumps(profile, ensure_ascii=False), user_id))
+        save_user_profile(con, user_id, profile)
         # Delete backup codes
         con.execute("DELETE FROM backup_codes WHERE user_id = ?", (user_id,))
         con.commit()
@@ -1806,7 +2220,7 @@ def admin_users_list():
             "SELECT user_id, created_at, last_seen_at, profile_json FROM users ORDER BY created_at DESC LIMIT ? OFFSET ?",
             (limit, offset)
         ).fetchall()
-        total = con.execute("SELECT COUNT(*) c FROM users").fetchone()["c"]
+    total = get_stats()["users"]
     
     users = []
     for row in rows:
@@ -1860,8 +2274,7 @@ def admin_users_upgrade():
         profile["tier_updated_at"] = utc_now_iso()
         profile["tier_updated_by"] = "admin"
         
-        con.execute("UPDATE users SET profile_json = ? WHERE user_id = ?",
-                   (json.dumps(profile, ensure_ascii=False), user_id))
+        save_user_profile(con, user_id, profile)
         con.commit()
     
     log_audit("admin_tier_change", {"user_id": user_id, "old_tier": old_tier, "new_tier": new_tier})
@@ -1882,14 +2295,22 @@ def admin_users_delete():
     
     with db() as con:
         # Delete all user data
-        con.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+        removed = con.execute("DELETE FROM messages WHERE user_id = ?", (user_id,)).rowcount
+        bump_stat(con, "messages", -removed)
         con.execute("DELETE FROM feedback WHERE user_id = ?", (user_id,))
         con.execute("DELETE FROM summaries WHERE user_id = ?", (user_id,))
         con.execute("DELETE FROM presence WHERE user_id = ?", (user_id,))
+        con.execute("DELETE FROM usage_counters WHERE user_id = ?", (user_id,))
+        con.execute("DELETE FROM token_usage WHERE user_id = ?", (user_id,))
+        _delete_broadcast_receipts(con, user_id)
         con.execute("DELETE FROM tokens WHERE user_id = ?", (user_id,))
         con.execute("DELETE FROM backup_codes WHERE user_id = ?", (user_id,))
-        con.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+        removed = con.execute("DELETE FROM users WHERE user_id = ?", (user_id,)).rowcount
+        bump_stat(con, "users", -removed)
         con.commit()
+    forget_usage(user_id)
+    token_ledger.forget(user_id)
+    prompt_builder.invalidate_summary(user_id)
     
     log_audit("admin_user_deleted", {"user_id": user_id})
     return jsonify({"ok": True, "message": f"User {user_id} deleted"}), 200
@@ -1943,8 +2364,7 @@ def admin_upgrade_demo():
                 profile["upgraded_at"] = utc_now_iso()
                 profile["upgraded_by"] = "admin"
                 
-                con.execute("UPDATE users SET profile_json = ? WHERE user_id = ?",
-                           (json.dumps(profile, ensure_ascii=False), uid))
+                save_user_profile(con, uid, profile)
                 con.commit()
             
             log_audit("demo_upgraded", {"user_id": uid, "old_type": old_type}, user_id=uid)
@@ -1965,9 +2385,59 @@ def admin_upgrade_demo():
 # VISITOR TRACKING
 # ============================================
 
+_VISITOR_INSERT = "INSERT INTO visitors (id, ip, user_agent, referer, accept_language, page, country, visited_at) VALUES "
+_VISITOR_ROWS_PER_STATEMENT = 100  # 8 params per row
+
+def _write_visitor_rows(rows: list):
+    """One transaction per batch: raw visitors rows plus traffic_hourly / traffic_daily increments."""
+    hits = [(r[7], visitor_traffic.hit_dimensions(r[5], r[3], r[2], r[4])) for r in rows]
+    with _raw_db() as con:
+        for i in range(0, len(rows), _VISITOR_ROWS_PER_STATEMENT):
+            chunk = rows[i:i + _VISITOR_ROWS_PER_STATEMENT]
+            con.execute(_VISITOR_INSERT + ",".join(["(?,?,?,?,?,?,?,?)"] * len(chunk)),
+                        [v for row in chunk for v in row])
+        for table, column, width in db_migrations.TRAFFIC_ROLLUPS:
+            con.executemany(
+                f"""INSERT INTO {table} ({column}, dimension, value, count) VALUES (?,?,?,?)
+                    ON CONFLICT({column}, dimension, value) DO UPDATE SET count = {table}.count + excluded.count""",
+                [(b, d, v, n) for (b, d, v), n in visitor_traffic.rollup_counts(hits, width).items()]
+            )
+
+# Page views are analytics: under overload drop the oldest queued hits rather than block requests
+visitor_buffer = WriteBehindBuffer(
+    "visitors", _write_visitor_rows,
+    max_batch=VISITOR_BATCH_MAX,
+    max_latency=VISITOR_BATCH_LATENCY_MS / 1000.0,
+    max_queue=VISITOR_QUEUE_MAX,
+    overflow="drop_oldest"
+)
+
+def purge_visitors(batch: int = 5000) -> int:
+    """Delete raw visitors rows (and hourly rollups) past retention, in short batches."""
+    now = datetime.now(timezone.utc)
+    removed = 0
+    if VISITOR_RETENTION_DAYS > 0:
+        cutoff = (now - timedelta(days=VISITOR_RETENTION_DAYS)).isoformat()
+        while True:
+            with _raw_db() as con:
+                n = con.execute(
+                    "DELETE FROM visitors WHERE id IN (SELECT id FROM visitors WHERE visited_at < ? LIMIT ?)",
+                    (cutoff, batch)
+                ).rowcount
+            removed += max(n, 0)
+            if n < batch:
+                break
+    if TRAFFIC_HOURLY_RETENTION_DAYS > 0:
+        cutoff = (now - timedelta(days=TRAFFIC_HOURLY_RETENTION_DAYS)).isoformat()[:13]
+        with _raw_db() as con:
+            con.execute("DELETE FROM traffic_hourly WHERE hour < ?", (cutoff,))
+    return removed
+
+visitor_retention = periodic.register(periodic.PeriodicJob("visitor_retention", purge_visitors, 3600, jitter=300))
+
 @app.post("/api/track-visitor")
 def api_track_visitor():
-    """Track page visitor with IP, country, user-agent."""
+    """Track page visitor with IP, country, user-agent (queued; written in batches)."""
     # Get client info
     client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
     if client_ip and ',' in client_ip:
@@ -1981,26 +2451,8 @@ def api_track_visitor():
     page = payload.get("page", "/")
     
     # Store visitor info
-    visitor_id = str(uuid.uuid4())
-    with db() as con:
-        # Create visitors table if not exists
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS visitors (
-                id TEXT PRIMARY KEY,
-                ip TEXT,
-                user_agent TEXT,
-                referer TEXT,
-                accept_language TEXT,
-                page TEXT,
-                country TEXT,
-                visited_at TEXT
-            )
-        """)
-        con.execute(
-            "INSERT INTO visitors (id, ip, user_agent, referer, accept_language, page, country, visited_at) VALUES (?,?,?,?,?,?,?,?)",
-            (visitor_id, client_ip, user_agent, referer, accept_language, page, "", utc_now_iso())
-        )
-        con.commit()
+    visitor_buffer.put((str(uuid.uuid4()), client_ip, user_agent, referer, accept_language,
+                        str(page)[:2000], "", utc_now_iso()))
     
     return jsonify({"ok": True}), 200
 
@@ -2013,20 +2465,8 @@ def admin_get_visitors():
     
     limit = int(request.args.get("limit", "100"))
     
+    visitor_buffer.flush(timeout=2.0)
     with db() as con:
-        # Ensure table exists
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS visitors (
-                id TEXT PRIMARY KEY,
-                ip TEXT,
-                user_agent TEXT,
-                referer TEXT,
-                accept_language TEXT,
-                page TEXT,
-                country TEXT,
-                visited_at TEXT
-            )
-        """)
         rows = con.execute(
             "SELECT * FROM visitors ORDER BY visited_at DESC LIMIT ?",
             (limit,)
@@ -2047,6 +2487,52 @@ def admin_get_visitors():
     return jsonify({"visitors": visitors, "total": len(visitors)}), 200
 
 
+@app.get("/admin/traffic")
+def admin_traffic():
+    """Page views per hour or day (bucket=hour|day) and top values per dimension.
+
+    Reads traffic_hourly / traffic_daily only. since / until are ISO dates or
+    timestamps (default: the last 7 days); top caps values per dimension.
+    """
+    if not _admin_ok(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    bucket = request.args.get("bucket", "day")
+    if bucket not in ("hour", "day"):
+        return jsonify({"error": "bucket must be hour or day"}), 400
+    table, column, width = db_migrations.TRAFFIC_ROLLUPS[0 if bucket == "hour" else 1]
+    since = request.args.get("since") or (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
+    until = request.args.get("until")
+    top = max(1, min(int(request.args.get("top", "10")), 100))
+    where, params = [f"{column} >= ?"], [since[:width]]
+    if until:
+        where.append(f"{column} < ?")
+        params.append(until[:width])
+    
+    visitor_buffer.flush(timeout=2.0)
+    with db() as con:
+        rows = con.execute(
+            f"SELECT {column} AS bucket, dimension, value, count FROM {table} WHERE {' AND '.join(where)}",
+            tuple(params)
+        ).fetchall()
+    series, totals = {}, {d: {} for d in visitor_traffic.DIMENSIONS if d != "total"}
+    for r in rows:
+        n = int(r["count"])
+        if r["dimension"] == "total":
+            series[r["bucket"]] = series.get(r["bucket"], 0) + n
+        elif r["dimension"] in totals:
+            values = totals[r["dimension"]]
+            values[r["value"]] = values.get(r["value"], 0) + n
+    return jsonify({
+        "bucket": bucket,
+        "since": since,
+        "until": until,
+        "series": [{"bucket": b, "views": series[b]} for b in sorted(series)],
+        "views": sum(series.values()),
+        "top": {d: [{"value": v, "views": n} for v, n in sorted(vals.items(), key=lambda kv: -kv[1])[:top]]
+                for d, vals in totals.items()}
+    }), 200
+
+
 @app.post("/api/upgrade-to-user")
 def api_upgrade_to_user():
     """Self-upgrade from demo account to full user account."""
@@ -2080,15 +2566,10 @@ def api_upgrade_to_user():
             return jsonify({"error": "Account is already a full user"}), 400
         
         # Check if email is already used
-        rows = con.execute("SELECT user_id, profile_json FROM users").fetchall()
-        for r in rows:
-            if r["user_id"] != user_id:
-                try:
-                    p = json.loads(r["profile_json"])
-                    if p.get("email", "").lower() == email.lower():
-                        return jsonify({"error": "Email already in use"}), 409
-                except:
-                    pass
+        taken = con.execute("SELECT 1 FROM users WHERE email = ? AND user_id <> ? LIMIT 1",
+                            (email.strip().lower(), user_id)).fetchone()
+        if taken:
+            return jsonify({"error": "Email already in use"}), 409
         
         # Upgrade account
         profile["user_type"] = "user"
@@ -2103,8 +2584,7 @@ def api_upgrade_to_user():
             "upgraded_at": utc_now_iso()
         }
         
-        con.execute("UPDATE users SET profile_json = ? WHERE user_id = ?",
-                   (json.dumps(profile, ensure_ascii=False), user_id))
+        save_user_profile(con, user_id, profile)
         con.commit()
     
     # Send verification email
@@ -2139,7 +2619,10 @@ def api_chat():
         return jsonify({"error": "Unauthorized"}), 401
 
     payload = request.get_json(silent=True) or {}
-    user_id = payload.get("userId") or "anon"
+    # Limits and tokens are charged to the signed session (else the client IP at the default tier),
+    # never to the body's userId; a session also owns the conversation
+    budget_id = budget_identity()
+    user_id = g.get("session_user") or payload.get("userId") or "anon"
     session_id = payload.get("sessionId") or "web"
     text = (payload.get("text") or "").strip()
     if not text:
@@ -2152,50 +2635,50 @@ def api_chat():
         "Elite": 999999
     }
 
-    def get_user_tier(user_id: str) -> str:
-        with db() as con:
-            row = con.execute("SELECT profile_json FROM users WHERE user_id = ?", (user_id,)).fetchone()
-        if not row:
-            return "Starter"
-        try:
-            profile = json.loads(row["profile_json"])
-            return profile.get("tier", "Starter")
-        except:
-            return "Starter"
-
     def check_rate_limit(user_id: str) -> bool:
-        tier = get_user_tier(user_id)
+        tier = user_tier(user_id)
         limit = SUBSCRIPTION_LIMITS.get(tier, 50)
-        today = utc_now_iso().split("T")[0]
-        
-        with db() as con:
-            row = con.execute(
-                "SELECT COUNT(*) c FROM messages WHERE user_id = ? AND role = 'user' AND created_at LIKE ?", 
-                (user_id, f"{today}%")
-            ).fetchone()
-        
-        count = row["c"] if row else 0
-        return count < limit
+        today = utc_now_iso()[:10]
+        return get_usage(user_id, today)[1] < limit
 
-    upsert_user(user_id, profile={"language": DEFAULT_LANGUAGE, "persona": PERSONA_STYLE})
+    profile = {"language": DEFAULT_LANGUAGE, "persona": PERSONA_STYLE}
+    upsert_user(user_id, profile=profile)
     
-    if not check_rate_limit(user_id):
+    if not check_rate_limit(budget_id):
          return jsonify({"error": "Daily message limit reached for your plan. Upgrade to chat more."}), 403
+    if user_id == "demo":
+        # Demo minutes accrue per client IP while it keeps chatting
+        client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
+        if client_ip and ',' in client_ip:
+            client_ip = client_ip.split(',')[0].strip()
+        demo_limit_result = check_demo_limits(client_ip)
+        if not demo_limit_result['allowed']:
+            return jsonify({"error": demo_limit_result['reason'], "demo_exhausted": True, "upgrade_required": True}), 403
+        track_demo_session(client_ip, "activity")
+    # Out of tokens: answer 429 before the message is stored (the provider call re-checks with the full prompt)
+    token_ledger.check(budget_id, estimate_tokens(text))
 
     log_audit("user_input", {"text": text}, user_id=user_id, session_id=session_id)
     add_message(user_id, session_id, "user", text, meta={"via": "text"})
+    if budget_id != user_id:
+        # Anonymous: the daily message count is the IP's
+        with db() as con:
+            _bump_usage(con, budget_id, utc_now_iso()[:10], "user")
 
     ctx = get_recent_context(user_id, session_id, limit=14)
     try:
         # Use DeepSeek by default (free), fallback to OpenAI
         if AI_PROVIDER == "deepseek" and DEEPSEEK_API_KEY:
-            ai = call_deepseek_chat(user_id, text, context=ctx)
+            ai = call_deepseek_chat(user_id, text, context=ctx, budget_id=budget_id)
         elif OPENAI_API_KEY:
-            ai = call_openai_chat(user_id, text, context=ctx)
+            ai = call_openai_chat(user_id, text, context=ctx, budget_id=budget_id)
         else:
             raise RuntimeError("No AI provider configured")
+    except TokenBudgetExceeded:
+        raise
     except Exception as e:
-        log_audit("ai_error", {"error": str(e), "provider": AI_PROVIDER}, user_id=user_id, session_id=session_id)
+        # Durable: the failure is recorded even if the request fails later (its transaction is already split)
+        log_audit("ai_error", {"error": str(e), "provider": AI_PROVIDER}, user_id=user_id, session_id=session_id, durable=True)
         ai = {"text": "I'm having trouble reaching my AI service right now. Please try again in a moment.", "sources": [], "emotion": "empathetic"}
 
     add_message(user_id, session_id, "assistant", ai["text"], meta={"emotion": ai.get("emotion"), "sources": ai.get("sources")})
@@ -2262,6 +2745,7 @@ def api_contact():
     with db() as con:
         con.execute("INSERT INTO leads (id, ts, name, email, message) VALUES (?,?,?,?,?)",
                     (lid, utc_now_iso(), name, email, message))
+        bump_stat(con, "leads")
         con.commit()
     log_audit("contact_submit", {"id": lid, "email": email})
     return jsonify({"ok": True, "id": lid}), 200
@@ -2295,7 +2779,7 @@ def api_narrate():
             "instructions": "Speak in a deep, cinematic, dramatic narrator voice. Slow pace, building atmosphere. Like an epic movie trailer."
         }
         logger.info(f"Narrate request: voice={narrator_voice}, text_len={len(text)}")
-        r = requests.post(f"{OPENAI_BASE_URL}/audio/speech", headers=openai_headers_json(), json=payload_tts, timeout=90)
+        r = provider_http.post(f"{OPENAI_BASE_URL}/audio/speech", headers=openai_headers_json(), json=payload_tts, timeout=90)
         r.raise_for_status()
         with open(out_path, "wb") as f:
             f.write(r.content)
@@ -2335,7 +2819,7 @@ def api_voice_tts():
             "instructions": "Speak in a friendly, conversational tone." if not cinematic else "Speak in a deep, cinematic, dramatic narrator voice."
         }
         
-        r = requests.post(f"{OPENAI_BASE_URL}/audio/speech", headers=openai_headers_json(), json=payload_tts, timeout=60)
+        r = provider_http.post(f"{OPENAI_BASE_URL}/audio/speech", headers=openai_headers_json(), json=payload_tts, timeout=60)
         r.raise_for_status()
         
         audio_b64 = base64.b64encode(r.content).decode("utf-8")
@@ -2352,6 +2836,137 @@ def api_voice_tts():
         return jsonify({"ok": False, "error": str(e)}), 500
 
 
+# --- Server-sent events (see event_hub.py) ---
+def publish_event(con, channel: str, event_type: str, data: dict):
+    """Queue an event on `con` (caller's transaction); streams receive it once committed.
+
+    Channels: "all" (every stream) and "user:<id>" (streams opened with that user_id).
+    """
+    con.execute("INSERT INTO events (ts, channel, type, data_json) VALUES (?,?,?,?)",
+                (utc_now_iso(), channel, event_type, json.dumps(data, ensure_ascii=False, default=str)))
+
+def _event_rows(rows) -> list:
+    return [(int(r["id"]), r["channel"], r["type"], json.loads(r["data_json"])) for r in rows]
+
+def _events_after(cursor: int, limit: int) -> list:
+    with db() as con:
+        return _event_rows(con.execute(
+            "SELECT id, channel, type, data_json FROM events WHERE id > ? ORDER BY id LIMIT ?", (cursor, limit)
+        ).fetchall())
+
+def _events_replay(channels: list, after_id: int, limit: int) -> list:
+    with db() as con:
+        return _event_rows(con.execute(
+            f"SELECT id, channel, type, data_json FROM events WHERE channel IN ({','.join('?' * len(channels))}) "
+            "AND id > ? ORDER BY id LIMIT ?", (*channels, after_id, limit)
+        ).fetchall())
+
+def _events_bound(fn: str):
+    def load():
+        with db() as con:
+            row = con.execute(f"SELECT {fn}(id) AS id FROM events").fetchone()
+        return int(row["id"]) if row and row["id"] is not None else None
+    return load
+
+_events_latest = _events_bound("MAX")
+
+events_hub = EventHub(
+    _events_after, _events_replay,
+    latest_id=lambda: _events_latest() or 0,
+    oldest_id=_events_bound("MIN"),
+    poll_interval=EVENTS_POLL_MS / 1000.0,
+    # sequence values can commit out of order on PostgreSQL; SQLite has one writer
+    reorder_window=100 if USE_POSTGRES else 0,
+    max_subscribers=EVENTS_MAX_STREAMS
+)
+
+def _stream_user() -> str | None:
+    # EventSource can't set headers: the session token may come as ?session_token= here
+    return g.get("session_user") or session_tokens.verify(request.args.get("session_token", ""))
+
+@app.get("/api/events")
+def api_events():
+    """Server-sent events for the caller: broadcasts, presence and live user counts.
+
+    The caller's private channel (user:<id>) needs a session token, in
+    X-Session-Token or ?session_token=; without one only the public channel
+    is streamed. A reconnecting EventSource sends Last-Event-ID (or
+    ?lastEventId=) and gets the events it missed; if they were already
+    purged it gets a `reset` event instead.
+    """
+    user_id = _stream_user()
+    channels = ["all"] + ([f"user:{user_id}"] if user_id else [])
+    sub = events_hub.subscribe(channels)
+    if sub is None:
+        resp = jsonify({"error": "Too many event streams, retry later"})
+        resp.headers["Retry-After"] = "5"
+        return resp, 503
+    try:
+        last_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId") or ""
+        backlog, reset = events_hub.missed(channels, int(last_id)) if last_id.isdigit() else ([], False)
+        # The stream outlives the request: give the connection back now (it wrote nothing)
+        db_checkpoint()
+    except Exception:
+        events_hub.unsubscribe(sub)
+        raise
+    resp = Response(sse_stream(events_hub, sub, backlog, reset, heartbeat=EVENTS_HEARTBEAT_SECONDS,
+                               max_duration=EVENTS_STREAM_SECONDS),
+                    mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"   # nginx/Railway proxies: don't buffer the stream
+    return resp
+
+def _live_users_window() -> int:
+    return int(time.time() - 3 * LIVE_USERS_INTERVAL)
+
+def live_users_count(con) -> int:
+    row = con.execute("SELECT SUM(users) AS n FROM live_workers WHERE updated_at >= ?", (_live_users_window(),)).fetchone()
+    return int(row["n"] or 0) if row else 0
+
+def refresh_live_users():
+    """Record this worker's connected users; publish `live_users` when the total changed."""
+    local = set()
+    for sub in events_hub.subscribers():
+        users = sorted(c for c in sub.channels if c.startswith("user:"))
+        local.add(users[0] if users else id(sub))
+    with db() as con:
+        con.execute(
+            """INSERT INTO live_workers (worker, users, updated_at) VALUES (?,?,?)
+               ON CONFLICT(worker) DO UPDATE SET users = excluded.users, updated_at = excluded.updated_at""",
+            (f"{socket.gethostname()}:{os.getpid()}", len(local), int(time.time()))
+        )
+        con.execute("DELETE FROM live_workers WHERE updated_at < ?", (int(time.time()) - 86400,))
+        total = live_users_count(con)
+        last = con.execute(
+            "SELECT data_json FROM events WHERE channel = 'all' AND type = 'live_users' ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        if last is None or json.loads(last["data_json"]).get("count") != total:
+            publish_event(con, "all", "live_users", {"count": total})
+        con.commit()
+    return total
+
+def purge_events(batch: int = 5000) -> int:
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=EVENTS_RETENTION_SECONDS)).isoformat()
+    removed = 0
+    while True:
+        with _raw_db() as con:
+            n = con.execute("DELETE FROM events WHERE id IN (SELECT id FROM events WHERE ts < ? LIMIT ?)",
+                            (cutoff, batch)).rowcount
+        removed += max(n, 0)
+        if n < batch:
+            return removed
+
+live_users_job = periodic.register(periodic.PeriodicJob("live_users", refresh_live_users, LIVE_USERS_INTERVAL,
+                                                        run_at_start=True))
+events_retention = periodic.register(periodic.PeriodicJob("events_retention", purge_events, 600, jitter=60))
+
+@app.get("/api/live-users")
+def api_live_users():
+    """Users with an open event stream, across workers (initial value; updates arrive as live_users events)."""
+    with db() as con:
+        return jsonify({"count": live_users_count(con)}), 200
+
+
 # --- Presence API (hologram state tracking) ---
 @app.get("/api/presence")
 def get_presence():
@@ -2402,6 +3017,7 @@ def post_presence():
                ON CONFLICT(user_id, session_id) DO UPDATE SET updated_at=excluded.updated_at, state_json=excluded.state_json""",
             (user_id, session_id, int(time.time()), json.dumps(state_obj))
         )
+        publish_event(con, f"user:{user_id}", "presence", dict(state_obj, userId=user_id, sessionId=session_id))
         con.commit()
     
     state_obj.update({"userId": user_id, "sessionId": session_id})
@@ -2411,18 +3027,11 @@ def post_presence():
 
 @app.get("/api/pricing")
 def api_pricing():
-    return jsonify({
-        "currency": "USD",
-        "tiers": [
-            {"name": "Starter", "price": 19, "features": ["Web hologram", "AI chat", "Basic support"]},
-            {"name": "Pro", "price": 59, "features": ["Voice (TTS/STT)", "Persistent memory", "Admin audit"]},
-            {"name": "Enterprise", "price": 199, "features": ["Custom workflows", "Legal-grade audit", "SLA"]},
-        ]
-    }), 200
+    return pricing_response()
 
 @app.get("/api/plans")
 def api_plans():
-    return api_pricing()
+    return pricing_response()
 
 @app.post("/api/subscribe")
 def api_subscribe():
@@ -2524,17 +3133,16 @@ def stripe_webhook():
         customer_id = data.get("customer")
         # Find user by customer ID and downgrade
         with db() as con:
-            rows = con.execute("SELECT user_id, profile_json FROM users").fetchall()
-            for row in rows:
-                try:
-                    profile = json.loads(row["profile_json"])
-                    if profile.get("stripe_customer") == customer_id:
-                        profile["tier"] = "Starter"
-                        upsert_user(row["user_id"], profile=profile)
-                        log_audit("subscription_cancelled", {"customer": customer_id}, user_id=row["user_id"])
-                        break
-                except:
-                    pass
+            row = con.execute("SELECT user_id, profile_json FROM users WHERE stripe_customer = ? LIMIT 1",
+                              (customer_id,)).fetchone() if customer_id else None
+        if row:
+            try:
+                profile = json.loads(row["profile_json"])
+                profile["tier"] = "Starter"
+                upsert_user(row["user_id"], profile=profile)
+                log_audit("subscription_cancelled", {"customer": customer_id}, user_id=row["user_id"])
+            except ValueError:
+                pass
     
     return jsonify({"received": True}), 200
 
@@ -2543,20 +3151,40 @@ def stripe_webhook():
 # GDPR ENDPOINTS (Real Data Export/Delete)
 # ============================================
 
+gdpr_export_jobs = ExportJobs(GDPR_EXPORT_DIR, _raw_db, _db_dialect(), ttl=GDPR_EXPORT_TTL_HOURS * 3600,
+                              batch_size=GDPR_EXPORT_BATCH)
+
 @app.get("/api/gdpr/export")
 def gdpr_export():
-    """Export all user data as JSON (GDPR Article 20 - Right to Data Portability)."""
+    """Export all user data as JSON (GDPR Article 20 - Right to Data Portability).
+
+    ?format=ndjson or ?format=zip streams the export in constant memory
+    instead of building it in one JSON document.
+    """
     user_id = request.args.get("userId") or request.headers.get("X-User-Id")
     
     if not user_id:
         return jsonify({"error": "userId required"}), 400
     
-    # Verify user or admin
-    if not _admin_ok(request):
-        # User can only export their own data
-        auth_user = request.headers.get("X-User-Id")
-        if auth_user != user_id:
-            return jsonify({"error": "Unauthorized - can only export own data"}), 403
+    denied = _gdpr_export_denied(user_id)
+    if denied:
+        return denied
+    
+    fmt = (request.args.get("format") or "json").lower()
+    if fmt in ("ndjson", "zip"):
+        log_audit("gdpr_export", {"user_id": user_id, "format": fmt}, user_id=user_id)
+        exported_at = utc_now_iso()
+        if fmt == "ndjson":
+            body = ndjson_stream(_raw_db, _db_dialect(), user_id, exported_at, GDPR_EXPORT_BATCH)
+            mimetype, ext = "application/x-ndjson", "ndjson"
+        else:
+            body = zip_stream(_raw_db, _db_dialect(), user_id, exported_at, GDPR_EXPORT_BATCH)
+            mimetype, ext = "application/zip", "zip"
+        return Response(body, mimetype=mimetype, headers={
+            "Content-Disposition": f'attachment; filename="kelion-export-{user_id}.{ext}"',
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no"
+        })
     
     export_data = {
         "exported_at": utc_now_iso(),
@@ -2582,7 +3210,8 @@ def gdpr_export():
             export_data["user"] = user_dict
         
         # Messages
-        messages = con.execute("SELECT * FROM messages WHERE user_id = ? ORDER BY created_at", (user_id,)).fetchall()
+        messages = con.execute("SELECT id, user_id, session_id, role, content, created_at, meta_json FROM messages "
+                               "WHERE user_id = ? ORDER BY created_at", (user_id,)).fetchall()
         export_data["messages"] = [dict(m) for m in messages]
         
         # Feedback
@@ -2599,6 +3228,54 @@ def gdpr_export():
     return jsonify(export_data), 200
 
 
+def _gdpr_export_denied(user_id: str):
+    """403 response unless the caller is admin or the user themselves."""
+    if _admin_ok(request):
+        return None
+    # User can only export their own data
+    if request.headers.get("X-User-Id") != user_id:
+        return jsonify({"error": "Unauthorized - can only export own data"}), 403
+    return None
+
+
+@app.post("/api/gdpr/export/async")
+def gdpr_export_async():
+    """Write the export zip to disk in the background; returns a download token."""
+    payload = request.get_json(silent=True) or {}
+    user_id = payload.get("userId") or request.args.get("userId") or request.headers.get("X-User-Id")
+    if not user_id:
+        return jsonify({"error": "userId required"}), 400
+    denied = _gdpr_export_denied(user_id)
+    if denied:
+        return denied
+    
+    token = gdpr_export_jobs.submit(user_id, utc_now_iso())
+    log_audit("gdpr_export", {"user_id": user_id, "format": "zip", "async": True}, user_id=user_id)
+    return jsonify({
+        "ok": True,
+        "token": token,
+        "download_url": f"/api/gdpr/export/download/{token}",
+        "expires_in": int(GDPR_EXPORT_TTL_HOURS * 3600)
+    }), 202
+
+
+@app.get("/api/gdpr/export/download/<token>")
+def gdpr_export_download(token):
+    """202 while the async export runs, then the zip archive."""
+    job = gdpr_export_jobs.status(token)
+    if not job:
+        return jsonify({"error": "Export not found or expired"}), 404
+    denied = _gdpr_export_denied(job["user_id"])
+    if denied:
+        return denied
+    if job["status"] == "pending":
+        return jsonify({"status": "pending"}), 202
+    if job["status"] != "ready":
+        return jsonify({"status": job["status"], "error": job.get("error", "")}), 500
+    return send_file(gdpr_export_jobs.archive_path(token), mimetype="application/zip", as_attachment=True,
+                     download_name=f"kelion-export-{job['user_id']}.zip", max_age=0)
+
+
 @app.delete("/api/gdpr/delete")
 def gdpr_delete():
     """Delete all user data (GDPR Article 17 - Right to Erasure)."""
@@ -2622,17 +3299,21 @@ def gdpr_delete():
     deleted_counts = {}
     
     with db() as con:
-        # Count before delete
-        deleted_counts["messages"] = con.execute("SELECT COUNT(*) c FROM messages WHERE user_id = ?", (user_id,)).fetchone()["c"]
-        deleted_counts["feedback"] = con.execute("SELECT COUNT(*) c FROM feedback WHERE user_id = ?", (user_id,)).fetchone()["c"]
-        
-        # Delete from all tables
-        con.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
-        con.execute("DELETE FROM feedback WHERE user_id = ?", (user_id,))
+        # Delete from all tables (rowcount = rows deleted)
+        deleted_counts["messages"] = con.execute("DELETE FROM messages WHERE user_id = ?", (user_id,)).rowcount
+        deleted_counts["feedback"] = con.execute("DELETE FROM feedback WHERE user_id = ?", (user_id,)).rowcount
         con.execute("DELETE FROM summaries WHERE user_id = ?", (user_id,))
         con.execute("DELETE FROM presence WHERE user_id = ?", (user_id,))
-        con.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+        con.execute("DELETE FROM usage_counters WHERE user_id = ?", (user_id,))
+        con.execute("DELETE FROM token_usage WHERE user_id = ?", (user_id,))
+        _delete_broadcast_receipts(con, user_id)
+        removed_users = con.execute("DELETE FROM users WHERE user_id = ?", (user_id,)).rowcount
+        bump_stat(con, "messages", -deleted_counts["messages"])
+        bump_stat(con, "users", -removed_users)
         con.commit()
+    forget_usage(user_id)
+    token_ledger.forget(user_id)
+    prompt_builder.invalidate_summary(user_id)
     
     log_audit("gdpr_deletion", {"user_id": user_id, "deleted": deleted_counts})
     
@@ -2660,6 +3341,7 @@ def gdpr_request():
             "INSERT INTO leads (id, ts, name, email, message) VALUES (?,?,?,?,?)",
             (str(uuid.uuid4()), utc_now_iso(), f"GDPR {request_type.upper()} Request", email, f"User: {user_id}")
         )
+        bump_stat(con, "leads")
         con.commit()
     
     log_audit(f"gdpr_{request_type}_request", {"user_id": user_id, "email": email}, user_id=user_id)
@@ -2685,31 +3367,178 @@ def gdpr_request():
 
 @app.get("/api/dashboard")
 def api_dashboard():
-    # Minimal dashboard data (admin can expand)
-    with db() as con:
-        u = con.execute("SELECT COUNT(*) c FROM users").fetchone()["c"]
-        m = con.execute("SELECT COUNT(*) c FROM messages").fetchone()["c"]
-        l = con.execute("SELECT COUNT(*) c FROM leads").fetchone()["c"]
-    return jsonify({"users": u, "messages": m, "leads": l, "version": "k1.1.0"}), 200
+    # Minimal dashboard data (admin can expand); totals come from the stats counters
+    stats = get_stats()
+    return jsonify({"users": stats["users"], "messages": stats["messages"], "leads": stats["leads"],
+                    "version": "k1.1.0"}), 200
+
+@app.post("/admin/stats/reconcile")
+def admin_stats_reconcile():
+    """Recount the dashboard counters now; returns the drift that was corrected."""
+    if not _admin_ok(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    # reconcile_stats takes the write lock on its own connection: release ours first (nothing written yet)
+    db_checkpoint()
+    drift = reconcile_stats()
+    return jsonify({"ok": True, "drift": drift, "stats": get_stats()}), 200
 
 # Admin endpoints (audit + messages)
 @app.get("/admin/audit")
 def admin_audit():
+    """Newest-first audit events.
+
+    Filters: action, user_id, session_id, since / until (ISO timestamps).
+    Paging: pass the returned next_cursor as ?cursor= (keyset on ts, id).
+    """
     if not _admin_ok(request):
         return jsonify({"error": "Unauthorized"}), 401
-    limit = int(request.args.get("limit", "100"))
+    limit = max(1, min(int(request.args.get("limit", "100")), AUDIT_PAGE_MAX))
+    where, params = [], []
+    for column in ("action", "user_id", "session_id"):
+        value = request.args.get(column)
+        if value:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if request.args.get("since"):
+        where.append("ts >= ?")
+        params.append(request.args["since"])
+    if request.args.get("until"):
+        where.append("ts < ?")
+        params.append(request.args["until"])
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            cursor_ts, cursor_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except Exception:
+            return jsonify({"error": "Invalid cursor"}), 400
+        where.append("(ts, id) < (?, ?)")
+        params += [cursor_ts, cursor_id]
+    
+    audit_buffer.flush(timeout=2.0)  # show events still waiting in the write-behind buffer
+    sql = "SELECT id, ts, user_id, session_id, action, detail_json FROM audit"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY ts DESC, id DESC LIMIT ?"
     with db() as con:
-        rows = con.execute("SELECT ts, user_id, session_id, action, detail_json FROM audit ORDER BY ts DESC LIMIT ?", (limit,)).fetchall()
+        rows = con.execute(sql, (*params, limit + 1)).fetchall()
     items = []
-    for r in rows:
+    for r in rows[:limit]:
         items.append({
+            "id": r["id"],
             "ts": r["ts"],
             "user_id": r["user_id"],
             "session_id": r["session_id"],
             "action": r["action"],
             "detail": json.loads(r["detail_json"])
         })
-    return jsonify({"items": items}), 200
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = base64.urlsafe_b64encode(json.dumps([last["ts"], last["id"]]).encode()).decode()
+    return jsonify({"items": items, "next_cursor": next_cursor}), 200
+
+@app.get("/admin/audit/rollup")
+def admin_audit_rollup():
+    """Event counts per hour or day (bucket=hour|day) and action, from audit_hourly.
+
+    since / until are ISO timestamps or dates (default: the last 30 days);
+    action filters to one action.
+    """
+    if not _admin_ok(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    bucket = request.args.get("bucket", "day")
+    if bucket not in ("hour", "day"):
+        return jsonify({"error": "bucket must be hour or day"}), 400
+    since = request.args.get("since") or (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
+    until = request.args.get("until")
+    width = 13 if bucket == "hour" else 10
+    where, params = ["hour >= ?"], [since[:13]]
+    if until:
+        where.append("hour < ?")
+        params.append(until[:13])
+    if request.args.get("action"):
+        where.append("action = ?")
+        params.append(request.args["action"])
+    
+    audit_buffer.flush(timeout=2.0)
+    with db() as con:
+        rows = con.execute(
+            f"SELECT substr(hour, 1, {width}) AS bucket, action, SUM(count) AS n FROM audit_hourly "
+            f"WHERE {' AND '.join(where)} GROUP BY substr(hour, 1, {width}), action ORDER BY bucket",
+            tuple(params)
+        ).fetchall()
+    series, totals = {}, {}
+    for r in rows:
+        series.setdefault(r["bucket"], {})[r["action"]] = int(r["n"])
+        totals[r["action"]] = totals.get(r["action"], 0) + int(r["n"])
+    return jsonify({
+        "bucket": bucket,
+        "since": since,
+        "until": until,
+        "series": [{"bucket": b, "counts": c, "total": sum(c.values())} for b, c in series.items()],
+        "totals": totals
+    }), 200
+
+@app.get("/admin/token-usage")
+def admin_token_usage():
+    """LLM spend per user for one period (YYYY-MM or YYYY-MM-DD; default: this month), top spenders first."""
+    if not _admin_ok(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    period = request.args.get("period") or utc_now_iso()[:7]
+    if not re.fullmatch(r"\d{4}-\d{2}(-\d{2})?", period):
+        return jsonify({"error": "period must be YYYY-MM or YYYY-MM-DD"}), 400
+    limit = max(1, min(int(request.args.get("limit", "50")), 500))
+    with db() as con:
+        rows = con.execute(
+            "SELECT user_id, input_tokens, output_tokens, cost_usd, requests FROM token_usage "
+            "WHERE period = ? ORDER BY cost_usd DESC LIMIT ?", (period, limit)
+        ).fetchall()
+        totals = con.execute(
+            "SELECT COUNT(*) AS users, COALESCE(SUM(input_tokens), 0) AS input_tokens, "
+            "COALESCE(SUM(output_tokens), 0) AS output_tokens, COALESCE(SUM(cost_usd), 0) AS cost_usd, "
+            "COALESCE(SUM(requests), 0) AS requests FROM token_usage WHERE period = ?", (period,)
+        ).fetchone()
+    users = [{
+        "user_id": r["user_id"],
+        "tier": user_tier(r["user_id"]),
+        "input_tokens": int(r["input_tokens"]),
+        "output_tokens": int(r["output_tokens"]),
+        "cost_usd": round(float(r["cost_usd"]), 4),
+        "requests": int(r["requests"]),
+    } for r in rows]
+    return jsonify({
+        "period": period,
+        "users": users,
+        "totals": {
+            "users": int(totals["users"]),
+            "input_tokens": int(totals["input_tokens"]),
+            "output_tokens": int(totals["output_tokens"]),
+            "cost_usd": round(float(totals["cost_usd"]), 4),
+            "requests": int(totals["requests"]),
+        }
+    }), 200
+
+@app.get("/admin/token-usage/<user_id>")
+def admin_user_token_usage(user_id):
+    """One user's budget status, daily usage for the last `days` days and monthly usage."""
+    if not _admin_ok(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    days = max(1, min(int(request.args.get("days", "30")), 366))
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    with db() as con:
+        rows = con.execute(
+            "SELECT period, input_tokens, output_tokens, cost_usd, requests FROM token_usage "
+            "WHERE user_id = ? ORDER BY period", (user_id,)
+        ).fetchall()
+    daily, monthly = [], []
+    for r in rows:
+        entry = {"period": r["period"], "input_tokens": int(r["input_tokens"]), "output_tokens": int(r["output_tokens"]),
+                 "cost_usd": round(float(r["cost_usd"]), 4), "requests": int(r["requests"])}
+        if len(r["period"]) == 7:
+            monthly.append(entry)
+        elif r["period"] >= since:
+            daily.append(entry)
+    return jsonify({"user_id": user_id, "status": token_ledger.status(user_id), "daily": daily, "monthly": monthly}), 200
 
 @app.get("/admin/messages")
 def admin_messages():
@@ -2733,6 +3562,32 @@ def admin_messages():
         })
     return jsonify({"user_id": user_id, "items": items}), 200
 
+@app.get("/admin/messages/search")
+def admin_messages_search():
+    """Full-text search over conversation history, best matches first.
+
+    q is required; optional filters: user_id, session_id, role, since / until
+    (ISO timestamps on created_at). Page with limit / offset.
+    """
+    if not _admin_ok(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"error": "Missing q"}), 400
+    limit = max(1, min(int(request.args.get("limit", "50")), 200))
+    offset = max(0, int(request.args.get("offset", "0")))
+    with db() as con:
+        items = search_messages(
+            con, _db_dialect(), q,
+            user_id=request.args.get("user_id"),
+            session_id=request.args.get("session_id"),
+            role=request.args.get("role"),
+            since=request.args.get("since"),
+            until=request.args.get("until"),
+            limit=limit, offset=offset
+        )
+    return jsonify({"q": q, "items": items, "limit": limit, "offset": offset}), 200
+
 @app.post("/api/feedback")
 def api_feedback():
     if not _auth_ok(request):
@@ -2768,6 +3623,8 @@ def admin_rules_upsert():
         con.execute("INSERT INTO rules (id, ts, title, body, enabled) VALUES (?,?,?,?,?)",
                     (rid, utc_now_iso(), title, body, enabled))
         con.commit()
+    # Once committed, so other requests can't re-render the rules block from the old rows
+    on_request_commit(prompt_builder.invalidate_rules)
     return jsonify({"ok": True, "id": rid}), 200
 
 @app.post("/admin/sources")
@@ -2877,35 +3734,101 @@ def _get_all_tiers():
             })
         return tiers
 
+def _delete_broadcast_receipts(con, user_id: str):
+    """Remove a user's receipts and watermark, keeping confirmed_count in step."""
+    con.execute(
+        """UPDATE broadcasts SET confirmed_count = confirmed_count - 1
+           WHERE id IN (SELECT broadcast_id FROM broadcast_receipts WHERE user_id = ?)""",
+        (user_id,)
+    )
+    con.execute("DELETE FROM broadcast_receipts WHERE user_id = ?", (user_id,))
+    con.execute("DELETE FROM broadcast_watermarks WHERE user_id = ?", (user_id,))
+
+_BROADCAST_COLUMNS = "id, title, body, priority, require_confirmation, target, target_user_id, created_at, confirmed_count"
+
+def _broadcast_dict(r) -> dict:
+    return {
+        "id": r["id"],
+        "title": r["title"],
+        "body": r["body"],
+        "priority": r["priority"],
+        "require_confirmation": bool(r["require_confirmation"]),
+        "target": r["target"],
+        "user_id": r["target_user_id"],
+        "created_at": r["created_at"],
+        "confirmed_count": int(r["confirmed_count"] or 0)
+    }
+
 def _get_broadcasts(limit=50):
     """Get broadcasts from database."""
     with db() as con:
-        rows = con.execute("SELECT * FROM broadcasts ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
-        broadcasts = []
-        for r in rows:
-            confirmations = json.loads(r["confirmations_json"]) if r["confirmations_json"] else []
-            broadcasts.append({
-                "id": r["id"],
-                "title": r["title"],
-                "body": r["body"],
-                "priority": r["priority"],
-                "require_confirmation": bool(r["require_confirmation"]),
-                "target": r["target"],
-                "user_id": r["target_user_id"],
-                "created_at": r["created_at"],
-                "confirmations": confirmations,
-                "confirmed_count": len(confirmations)
-            })
-        return broadcasts
+        rows = con.execute(f"SELECT {_BROADCAST_COLUMNS} FROM broadcasts ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [_broadcast_dict(r) for r in rows]
+
+# A broadcast may commit slightly after a later-stamped one: the watermark stays this far behind now
+BROADCAST_WATERMARK_LAG = timedelta(minutes=1)
+# ...and only moves in steps of at least this much, so polling doesn't write on every call
+BROADCAST_WATERMARK_STEP = timedelta(hours=1)
+
+def pending_broadcasts(user_id: str, limit: int = 100) -> list:
+    """Unconfirmed broadcasts addressed to `user_id`, newest first.
+
+    One indexed scan of broadcasts created since the user's watermark,
+    anti-joined against broadcast_receipts (primary key probe per row).
+    """
+    with db() as con:
+        wm = con.execute("SELECT seen_before FROM broadcast_watermarks WHERE user_id = ?", (user_id,)).fetchone()
+        seen_before = wm["seen_before"] if wm else ""
+        rows = con.execute(
+            f"""SELECT {", ".join("b." + c for c in _BROADCAST_COLUMNS.split(", "))} FROM broadcasts b
+            WHERE b.created_at >= ? AND b.require_confirmation = 1
+              AND (b.target = 'all' OR (b.target = 'user' AND b.target_user_id = ?))
+              AND NOT EXISTS (SELECT 1 FROM broadcast_receipts r WHERE r.broadcast_id = b.id AND r.user_id = ?)
+            ORDER BY b.created_at DESC LIMIT ?""",
+            (seen_before, user_id, user_id, limit)
+        ).fetchall()
+        if len(rows) < limit:
+            # Everything older than the oldest pending broadcast (or the lag horizon) is resolved
+            now = datetime.now(timezone.utc)
+            candidate = (now - BROADCAST_WATERMARK_LAG).isoformat()
+            if rows:
+                candidate = min(candidate, rows[-1]["created_at"])
+            due = not seen_before or candidate >= (datetime.fromisoformat(seen_before) + BROADCAST_WATERMARK_STEP).isoformat()
+            if due and candidate > seen_before:
+                con.execute(
+                    """INSERT INTO broadcast_watermarks (user_id, seen_before) VALUES (?, ?)
+                       ON CONFLICT(user_id) DO UPDATE SET seen_before = excluded.seen_before
+                       WHERE excluded.seen_before > broadcast_watermarks.seen_before""",
+                    (user_id, candidate)
+                )
+    return [_broadcast_dict(r) for r in rows]
+
+def _load_pricing() -> dict:
+    _init_default_tiers()
+    return {"currency": "USD", "tiers": _get_all_tiers()}
+
+pricing_snapshot = PricingSnapshot(_load_pricing, ttl=PRICING_CACHE_TTL)
+
+def invalidate_pricing():
+    """After a tier change: invalidate once it commits, so a concurrent rebuild can't cache the old rows."""
+    on_request_commit(pricing_snapshot.invalidate)
+
+def pricing_response():
+    """The pricing snapshot with a strong ETag; 304 when the client already has it."""
+    snap = pricing_snapshot.get()
+    if etag_matches(request.headers.get("If-None-Match"), snap.etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(snap.body, status=200, mimetype="application/json")
+    resp.headers["ETag"] = snap.etag
+    resp.headers["Cache-Control"] = f"public, max-age={PRICING_MAX_AGE}"
+    resp.headers["Vary"] = "Origin"   # add_security_headers picks Access-Control-Allow-Origin per Origin
+    return resp
 
 @app.get("/pricing")
 def get_pricing():
     """Public pricing endpoint."""
-    _init_default_tiers()
-    return jsonify({
-        "currency": "USD",
-        "tiers": _get_all_tiers()
-    }), 200
+    return pricing_response()
 
 @app.post("/admin/broadcast")
 def admin_broadcast():
@@ -2929,17 +3852,17 @@ def admin_broadcast():
     # Count recipients
     total_count = 1
     if target == "all":
-        with db() as con:
-            rows = con.execute("SELECT COUNT(*) as cnt FROM users").fetchone()
-            total_count = rows["cnt"] if isinstance(rows, dict) else rows[0]
+        total_count = get_stats()["users"]
     
     # Save to database
     with db() as con:
         con.execute(
-            """INSERT INTO broadcasts (id, title, body, priority, require_confirmation, target, target_user_id, created_at, confirmations_json)
-            VALUES (?,?,?,?,?,?,?,?,?)""",
-            (broadcast_id, title, body, priority, 1 if require_confirmation else 0, target, target_user_id if target == "user" else None, utc_now_iso(), "[]")
+            """INSERT INTO broadcasts (id, title, body, priority, require_confirmation, target, target_user_id, created_at, confirmed_count)
+            VALUES (?,?,?,?,?,?,?,?,0)""",
+            (broadcast_id, title, body, priority, 1 if require_confirmation else 0, target, target_user_id if target == "user" else None, utc_now_iso())
         )
+        publish_event(con, f"user:{target_user_id}" if target == "user" else "all", "broadcast",
+                      {"id": broadcast_id, "title": title, "priority": priority, "target": target})
         con.commit()
     
     log_audit("broadcast_sent", {"id": broadcast_id, "target": target, "title": title})
@@ -2958,6 +3881,27 @@ def get_broadcasts_endpoint():
     
     return jsonify({"broadcasts": _get_broadcasts(50)}), 200
 
+@app.get("/admin/broadcasts/<broadcast_id>/receipts")
+def get_broadcast_receipts(broadcast_id):
+    """Who confirmed a broadcast, oldest first (?limit, ?offset)."""
+    if not _admin_ok(request):
+        return jsonify({"error": "Admin token required"}), 401
+    limit = max(1, min(int(request.args.get("limit", "100")), 1000))
+    offset = max(0, int(request.args.get("offset", "0")))
+    with db() as con:
+        bc = con.execute("SELECT confirmed_count FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        if not bc:
+            return jsonify({"error": "Broadcast not found"}), 404
+        rows = con.execute(
+            "SELECT user_id, confirmed_at FROM broadcast_receipts WHERE broadcast_id = ? ORDER BY confirmed_at, user_id LIMIT ? OFFSET ?",
+            (broadcast_id, limit, offset)
+        ).fetchall()
+    return jsonify({
+        "broadcast_id": broadcast_id,
+        "confirmed_count": int(bc["confirmed_count"] or 0),
+        "receipts": [{"user_id": r["user_id"], "confirmed_at": r["confirmed_at"]} for r in rows]
+    }), 200
+
 @app.post("/api/broadcast/confirm")
 def confirm_broadcast():
     """User confirms they received a broadcast message (DB-backed)."""
@@ -2969,16 +3913,21 @@ def confirm_broadcast():
         return jsonify({"error": "broadcast_id and user_id required"}), 400
     
     with db() as con:
-        row = con.execute("SELECT confirmations_json FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        row = con.execute("SELECT id FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
         if not row:
             return jsonify({"error": "Broadcast not found"}), 404
         
-        confirmations = json.loads(row["confirmations_json"]) if row["confirmations_json"] else []
-        if user_id not in confirmations:
-            confirmations.append(user_id)
-            con.execute("UPDATE broadcasts SET confirmations_json = ? WHERE id = ?", (json.dumps(confirmations), broadcast_id))
+        # The primary key makes a repeated or concurrent confirm a no-op
+        inserted = con.execute(
+            """INSERT INTO broadcast_receipts (broadcast_id, user_id, confirmed_at) VALUES (?,?,?)
+               ON CONFLICT(broadcast_id, user_id) DO NOTHING""",
+            (broadcast_id, user_id, utc_now_iso())
+        ).rowcount
+        if inserted:
+            con.execute("UPDATE broadcasts SET confirmed_count = confirmed_count + 1 WHERE id = ?", (broadcast_id,))
             con.commit()
-            log_audit("broadcast_confirmed", {"broadcast_id": broadcast_id, "user_id": user_id})
+    if inserted:
+        log_audit("broadcast_confirmed", {"broadcast_id": broadcast_id, "user_id": user_id})
     
     return jsonify({"ok": True, "confirmed": True}), 200
 
@@ -2989,15 +3938,7 @@ def get_pending_broadcasts():
     if not user_id:
         return jsonify({"broadcasts": []}), 200
     
-    pending = []
-    for bc in _get_broadcasts(100):
-        if bc["require_confirmation"]:
-            if bc["target"] == "all" and user_id not in bc["confirmations"]:
-                pending.append(bc)
-            elif bc["target"] == "user" and bc["user_id"] == user_id and user_id not in bc["confirmations"]:
-                pending.append(bc)
-    
-    return jsonify({"broadcasts": pending}), 200
+    return jsonify({"broadcasts": pending_broadcasts(user_id)}), 200
 
 # --- Subscription Tier Management (DB-backed) ---
 
@@ -3029,6 +3970,7 @@ def create_tier():
         )
         con.commit()
     
+    invalidate_pricing()
     log_audit("tier_created", {"tier_id": tier_id, "price": price})
     
     return jsonify({"ok": True, "tier": {"id": tier_id, "name": name, "price": price, "features": features}}), 201
@@ -3061,6 +4003,7 @@ def update_tier():
         )
         con.commit()
     
+    invalidate_pricing()
     log_audit("tier_updated", {"tier_id": tier_id})
     return jsonify({"ok": True, "tier": {"id": tier_id, "name": name, "price": price, "features": features}}), 200
 
@@ -3076,6 +4019,7 @@ def delete_tier(tier_id: str):
         if result.rowcount == 0:
             return jsonify({"error": "Tier not found"}), 404
     
+    invalidate_pricing()
     log_audit("tier_deleted", {"tier_id": tier_id})
     return jsonify({"ok": True}), 200
 
@@ -3116,6 +4060,10 @@ def admin_send_broadcast():
     }
     
     _broadcasts.append(broadcast)
+    with db() as con:
+        publish_event(con, f"user:{user_id}" if target == "specific" else "all", "broadcast",
+                      {"id": broadcast["id"], "priority": priority, "target": target})
+        con.commit()
     log_audit("broadcast_sent", {"target": target, "priority": priority})
     
     return jsonify({"success": True, "broadcast_id": broadcast["id"]})
@@ -3199,33 +4147,19 @@ def api_admin_day_zero():
     deleted = {"visitors": 0, "demo_usage": 0, "visits": 0}
     
     try:
+        # Queued rows would land after the delete
+        visitor_buffer.flush(timeout=2.0)
+        demo_usage.flush(timeout=2.0)
         with db() as con:
-            # Șterge preferințe vizitatori (face toți să fie "first visit")
-            try:
-                cur = con.execute("DELETE FROM visitor_prefs")
-                deleted["visitors"] = cur.rowcount if hasattr(cur, 'rowcount') else -1
-            except Exception as e:
-                logger.warning(f"visitor_prefs delete error: {e}")
-            
+            # Șterge vizitatorii (face toți să fie "first visit")
+            deleted["visitors"] = con.execute("DELETE FROM visitors").rowcount
             # Șterge usage demo
-            try:
-                cur = con.execute("DELETE FROM demo_usage")
-                deleted["demo_usage"] = cur.rowcount if hasattr(cur, 'rowcount') else -1
-            except Exception as e:
-                logger.warning(f"demo_usage delete error: {e}")
-            
-            # Șterge vizite (trafic)
-            try:
-                cur = con.execute("DELETE FROM visits")
-                deleted["visits"] = cur.rowcount if hasattr(cur, 'rowcount') else -1
-            except Exception as e:
-                logger.warning(f"visits delete error: {e}")
-            
-            con.commit()
-        
-        # Clear in-memory caches
-        global DEMO_USAGE_CACHE
-        DEMO_USAGE_CACHE.clear()
+            deleted["demo_usage"] = con.execute("DELETE FROM demo_usage").rowcount
+            # Șterge vizite (trafic agregat)
+            deleted["visits"] = (con.execute("DELETE FROM traffic_hourly").rowcount
+                                 + con.execute("DELETE FROM traffic_daily").rowcount)
+        # Clear in-memory caches once the deletes are committed
+        on_request_commit(demo_usage.reset)
         
         log_audit("DAY_ZERO_RESET", {"deleted": deleted})
         
@@ -3248,8 +4182,46 @@ try:
 except ImportError as e:
     logger.warning(f"⚠️ Voice Credits module not available: {e}")
 
+# ============================================================================
+# WORKER LIFECYCLE (hooks in gunicorn.conf.py; `python app.py` calls start_worker too)
+# ============================================================================
+def start_worker():
+    """Start this process's background work, once per worker after the fork.
+    Under K1_PREFORK nothing starts at import, so the preloading master forks
+    without threads."""
+    # First, while this worker has no threads of its own yet: starts the hashing forkserver
+    try:
+        password_hasher.warm()
+    except Exception as e:
+        logger.warning(f"Password hasher warm-up failed: {e}")
+    if SUPER_AI_LOADED:
+        from super_ai_routes import start_background
+        start_background()
+    periodic.ensure_all_running()
+    if HTTP_PREWARM_CONNECTIONS > 0:
+        # TLS handshakes to the providers happen now instead of in the first users' calls
+        threading.Thread(target=provider_http.warm, args=(provider_warm_urls(), HTTP_PREWARM_CONNECTIONS),
+                         name="http-warm", daemon=True).start()
+
+def begin_drain():
+    """Shutdown began (SIGTERM): fail health checks, refuse new chats and event
+    streams and end the open streams; in-flight requests run to completion."""
+    _draining.set()
+    events_hub.close()
+
+def stop_worker(timeout: float = 10.0):
+    """After the last request: stop background jobs and write out buffered rows."""
+    begin_drain()
+    periodic.stop_all()
+    if SUPER_AI_LOADED:
+        from super_ai_routes import stop_background
+        stop_background()
+    write_behind.close_all(timeout)   # audit, visitors, demo usage: flushed, then stopped
+    password_hasher.close()
+    provider_http.close()
+
 init_db()
 
 if __name__ == "__main__":
-
+    start_worker()
     app.run(host="0.0.0.0", port=PORT)
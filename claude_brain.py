@@ -8,14 +8,22 @@ ADAPTED FOR OPENAI GPT-4 via 'claude_brain' interface.
 import os
 import json
 import hashlib
-import requests
 import threading
 import logging
 from datetime import datetime, timezone
 from typing import Optional, List, Dict, Any
 from functools import wraps
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:  # Windows: thread locks only
+    fcntl = None
+
+from token_budget import TokenBudgetExceeded, estimate_tokens, get_token_ledger, usage_tokens
+from provider_client import get_provider_client
+
 load_dotenv()
 
 # Setup logging
@@ -50,6 +58,9 @@ CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-20250514")
 # OPENAI (Fallback + STT + DALL-E)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+# Conexiuni keep-alive reutilizate per furnizor, comune cu app.py (vezi provider_client.py)
+provider_http = get_provider_client()
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
 
 # SERPER (Web Search)
@@ -121,6 +132,27 @@ class FileLock:
             if filepath not in cls._locks:
                 cls._locks[filepath] = threading.RLock()
             return cls._locks[filepath]
+    
+    @classmethod
+    def reset_after_fork(cls):
+        """Fresh locks in a forked worker (a parent thread may have held one at fork time)."""
+        cls._locks = {}
+        cls._global_lock = threading.Lock()
+
+
+@contextmanager
+def interprocess_lock(filepath: str):
+    """Exclusive lock across worker processes (flock on `<file>.lock`) for read-modify-write."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath + ".lock", "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
 
 
 def safe_read_json(filepath: str, default: Any = None) -> Any:
@@ -144,7 +176,7 @@ def safe_write_json(filepath: str, data: Any) -> bool:
         try:
             os.makedirs(os.path.dirname(filepath), exist_ok=True)
             # Write to temp file first, then rename (atomic operation)
-            temp_path = filepath + ".tmp"
+            temp_path = f"{filepath}.{os.getpid()}.tmp"  # workers may write the same file
             with open(temp_path, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
             os.replace(temp_path, filepath)
@@ -249,6 +281,12 @@ class KelionMemory:
         self._current_user_id = "default"
         self._load_global()
     
+    def reset_after_fork(self):
+        """Worker nou (fork): lock nou, memoria se recitește din fișiere."""
+        self._lock = threading.RLock()
+        self._users = {}
+        self._load_global()
+    
     def _load_global(self):
         """Încarcă datele globale (keywords)."""
         self.semantic_keywords = safe_read_json(KEYWORDS_FILE, {})
@@ -370,9 +408,15 @@ class UsageTracker:
                 "last_updated": datetime.now(timezone.utc).isoformat()
             })
     
+    def reset_after_fork(self):
+        """Worker nou (fork): lock nou și totalurile recitite din fișier."""
+        self._lock = threading.RLock()
+        self._load()
+    
     def track_usage(self, input_tokens: int, output_tokens: int) -> float:
-        """Înregistrează utilizarea."""
-        with self._lock:
+        """Înregistrează utilizarea (fișierul e comun tuturor workerilor: citire-modificare-scriere sub lock)."""
+        with self._lock, interprocess_lock(USAGE_FILE):
+            self._load()
             self.total_input_tokens += input_tokens
             self.total_output_tokens += output_tokens
             
@@ -395,7 +439,8 @@ class UsageTracker:
     def set_credit(self, amount: float) -> bool:
         """Setează creditul."""
         amount = validate_positive_number(amount, "credit amount")
-        with self._lock:
+        with self._lock, interprocess_lock(USAGE_FILE):
+            self._load()
             self.initial_credit = amount + self.total_cost
             self._alert_sent = False  # Reset alert
             brain_logger.info(f"Credit set to: {self.initial_credit}")
@@ -456,10 +501,15 @@ REGULI:
 
 
 @require_active_system
-def call_claude(user_message: str, include_context: bool = True) -> Dict:
+def call_claude(user_message: str, include_context: bool = True, user_id: Optional[str] = None) -> Dict:
     """
     Apelează Brain API (acum OpenAI) dar păstrând numele funcției 'call_claude'
     pentru compatibilitate cu 'vechiul AI'.
+    
+    Tokenii intră în registrul per utilizator (token_budget.py): cu `user_id`
+    se aplică bugetul tier-ului; fără, consumul se contabilizează pe "super"
+    fără limită, deci doar pentru apeluri interne. Rutele HTTP trimit mereu o
+    identitate (sesiunea sau "ip:<adresă>" pentru anonimi).
     """
     # Validate input
     try:
@@ -517,8 +567,20 @@ def call_claude(user_message: str, include_context: bool = True) -> Dict:
         "max_tokens": 4096,
     }
     
+    # Buget de tokeni: rezervare înainte de apel, decontare cu `usage` raportat
+    ledger = get_token_ledger()
+    reservation = None
+    if ledger is not None:
+        try:
+            reservation = ledger.reserve(user_id or "super",
+                                         estimate_tokens(*(m["content"] for m in messages)) + 1024,
+                                         enforce=user_id is not None)
+        except TokenBudgetExceeded as e:
+            return {"error": "Bugetul de tokeni al planului a fost epuizat.", "emotion": "error",
+                    "budget_exceeded": True, "budget": e.to_dict()}
+    
     try:
-        response = requests.post(
+        response = provider_http.post(
             f"{OPENAI_BASE_URL}/chat/completions",
             headers=headers,
             json=payload,
@@ -537,6 +599,9 @@ def call_claude(user_message: str, include_context: bool = True) -> Dict:
         input_tokens = usage.get("prompt_tokens", 0)
         output_tokens = usage.get("completion_tokens", 0)
         cost = _usage_tracker.track_usage(input_tokens, output_tokens)
+        if reservation is not None:
+            ledger.settle(reservation, data.get("model") or OPENAI_MODEL, *usage_tokens(usage))
+            reservation = None
         
         # Save to memory
         _memory.add_message("user", user_message)
@@ -556,6 +621,9 @@ def call_claude(user_message: str, include_context: bool = True) -> Dict:
     except Exception as e:
         brain_logger.error(f"API error: {e}")
         return {"error": f"Eroare comunicare: {str(e)}", "emotion": "error"}
+    finally:
+        if reservation is not None:
+            ledger.release(reservation)
 
 
 def _handle_keyword_learning(message: str) -> Dict:
@@ -665,10 +733,17 @@ def get_memory() -> KelionMemory:
 def get_usage_tracker() -> UsageTracker:
     return _usage_tracker
 
+def reset_after_fork():
+    """Apelat în fiecare worker după fork (gunicorn preload_app): lock-uri noi și stare recitită."""
+    FileLock.reset_after_fork()
+    _memory.reset_after_fork()
+    _usage_tracker.reset_after_fork()
+
 __all__ = [
     'call_claude',
     'get_memory',
     'get_usage_tracker',
+    'reset_after_fork',
     'analyze_own_code',
     'register_voiceprint',
     'verify_voiceprint'
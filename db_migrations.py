@@ -0,0 +1,776 @@
+"""
+KELION AI - Schema Migrations
+=============================
+Numbered, versioned schema migrations for SQLite and PostgreSQL.
+
+Applied migrations are recorded in `schema_version` (version, name,
+checksum, applied_at). Each migration runs in its own transaction under a
+database-wide lock (BEGIN IMMEDIATE on SQLite, an advisory lock on
+PostgreSQL), so several workers starting at once apply it exactly once.
+
+CLI (run before the app starts serving):
+    python db_migrations.py migrate   # apply pending migrations
+    python db_migrations.py status    # list applied / pending
+    python db_migrations.py verify    # exit 1 unless schema is at head and intact
+"""
+
+import os
+import sys
+import hashlib
+import inspect
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Union
+
+migrations_logger = logging.getLogger("kelion.migrations")
+
+# Arbitrary constant identifying the migration lock (pg_advisory_xact_lock)
+PG_MIGRATION_LOCK_ID = 0x4B31_0001
+
+SQLITE = "sqlite"
+POSTGRES = "postgres"
+
+Step = Union[str, Callable]
+
+
+class MigrationError(RuntimeError):
+    """Raised when migrations cannot be applied or the schema does not verify."""
+
+
+class Migration:
+    """
+    One schema change.
+
+    `up` is a list of SQL statements run on both dialects, or a dict
+    {"sqlite": [...], "postgres": [...]}. A step may also be a callable
+    `fn(cur, dialect)` for data backfills.
+    """
+
+    def __init__(self, version: int, name: str, up: Union[List[Step], Dict[str, List[Step]]],
+                 indexes: Union[List[str], Dict[str, List[str]], None] = None,
+                 dropped_indexes: Optional[List[str]] = None):
+        self.version = version
+        self.name = name
+        self._up = up
+        self._indexes = indexes or []  # index names `verify` expects to exist (list, or per dialect)
+        self.dropped_indexes = dropped_indexes or []  # earlier migrations' indexes this one replaces
+
+    def steps(self, dialect: str) -> List[Step]:
+        if isinstance(self._up, dict):
+            return list(self._up.get(dialect, []))
+        return list(self._up)
+
+    def indexes(self, dialect: str) -> List[str]:
+        if isinstance(self._indexes, dict):
+            return list(self._indexes.get(dialect, []))
+        return list(self._indexes)
+
+    @property
+    def checksum(self) -> str:
+        h = hashlib.sha256()
+        for dialect in (SQLITE, POSTGRES):
+            for step in self.steps(dialect):
+                if callable(step):
+                    try:
+                        step = inspect.getsource(step)
+                    except (OSError, TypeError):
+                        step = getattr(step, "__name__", repr(step))
+                h.update(" ".join(step.split()).encode("utf-8"))
+                h.update(b"\0")
+        return h.hexdigest()[:16]
+
+
+# ============================================================================
+# DATA HELPERS (shared with app.py)
+# ============================================================================
+
+USER_INDEX_COLUMNS = ("user_key", "email", "tier", "user_type", "stripe_customer")
+
+
+def user_columns_from_profile(user_id: str, profile: Dict) -> Dict[str, Optional[str]]:
+    """Indexed `users` columns derived from a profile (kept in sync by app.upsert_user)."""
+    profile = profile or {}
+    email = (profile.get("email") or "").strip().lower()
+    return {
+        "user_key": (user_id or "").strip().lower(),
+        "email": email or None,
+        "tier": profile.get("tier") or None,
+        "user_type": profile.get("user_type") or None,
+        "stripe_customer": profile.get("stripe_customer") or None,
+    }
+
+
+def _backfill_user_columns(cur, dialect):
+    import json
+    cur.execute("SELECT user_id, profile_json FROM users")
+    rows = cur.fetchall()
+    updates = []
+    for row in rows:
+        user_id = _row_value(row, "user_id", 0)
+        try:
+            profile = json.loads(_row_value(row, "profile_json", 1) or "{}")
+        except ValueError:
+            profile = {}
+        cols = user_columns_from_profile(user_id, profile if isinstance(profile, dict) else {})
+        updates.append(tuple(cols[c] for c in USER_INDEX_COLUMNS) + (user_id,))
+    if updates:
+        sets = ", ".join(f"{c} = {_ph(dialect)}" for c in USER_INDEX_COLUMNS)
+        cur.executemany(f"UPDATE users SET {sets} WHERE user_id = {_ph(dialect)}", updates)
+
+
+TRAFFIC_ROLLUPS = (("traffic_hourly", "hour", 13), ("traffic_daily", "day", 10))
+
+
+def _backfill_traffic_rollups(cur, dialect):
+    from visitor_traffic import hit_dimensions, rollup_counts
+    cur.execute("SELECT visited_at, page, referer, user_agent, accept_language FROM visitors")
+    hits = [(_row_value(r, "visited_at", 0) or "",
+             hit_dimensions(_row_value(r, "page", 1), _row_value(r, "referer", 2),
+                            _row_value(r, "user_agent", 3), _row_value(r, "accept_language", 4)))
+            for r in cur.fetchall()]
+    p = _ph(dialect)
+    for table, column, width in TRAFFIC_ROLLUPS:
+        rows = [(b, d, v, n) for (b, d, v), n in rollup_counts(hits, width).items()]
+        if rows:
+            cur.executemany(f"INSERT INTO {table} ({column}, dimension, value, count) VALUES ({p},{p},{p},{p})", rows)
+
+
+def _backfill_broadcast_receipts(cur, dialect):
+    import json
+    cur.execute("SELECT id, created_at, confirmations_json FROM broadcasts")
+    receipts, counts = [], []
+    for row in cur.fetchall():
+        try:
+            users = json.loads(_row_value(row, "confirmations_json", 2) or "[]")
+        except ValueError:
+            users = []
+        users = sorted({str(u) for u in users if u}) if isinstance(users, list) else []
+        bid = _row_value(row, "id", 0)
+        # Confirmation times were never recorded: use the broadcast's own timestamp
+        receipts.extend((bid, u, _row_value(row, "created_at", 1)) for u in users)
+        counts.append((len(users), bid))
+    p = _ph(dialect)
+    if receipts:
+        cur.executemany(f"INSERT INTO broadcast_receipts (broadcast_id, user_id, confirmed_at) VALUES ({p},{p},{p})", receipts)
+    if counts:
+        cur.executemany(f"UPDATE broadcasts SET confirmed_count = {p} WHERE id = {p}", counts)
+
+
+# ============================================================================
+# MIGRATIONS (append only - never edit an applied migration)
+# ============================================================================
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline_schema", [
+        """CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            last_seen_at TEXT NOT NULL,
+            profile_json TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS messages (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            meta_json TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS audit (
+            id TEXT PRIMARY KEY,
+            ts TEXT NOT NULL,
+            user_id TEXT,
+            session_id TEXT,
+            action TEXT NOT NULL,
+            detail_json TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS leads (
+            id TEXT PRIMARY KEY,
+            ts TEXT NOT NULL,
+            name TEXT,
+            email TEXT,
+            message TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS summaries (
+            user_id TEXT PRIMARY KEY,
+            updated_at TEXT NOT NULL,
+            summary TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS feedback (
+            id TEXT PRIMARY KEY,
+            ts TEXT NOT NULL,
+            user_id TEXT,
+            session_id TEXT,
+            message_id TEXT,
+            rating INTEGER,
+            correction TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS rules (
+            id TEXT PRIMARY KEY,
+            ts TEXT NOT NULL,
+            title TEXT NOT NULL,
+            body TEXT NOT NULL,
+            enabled INTEGER NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS sources (
+            domain TEXT PRIMARY KEY,
+            trust INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS presence (
+            user_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            updated_at INTEGER NOT NULL,
+            state_json TEXT NOT NULL,
+            PRIMARY KEY (user_id, session_id)
+        )""",
+        # Token table for password reset, email verification, etc.
+        """CREATE TABLE IF NOT EXISTS tokens (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            token_type TEXT NOT NULL,
+            token_hash TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            used INTEGER DEFAULT 0
+        )""",
+        # 2FA backup codes table
+        """CREATE TABLE IF NOT EXISTS backup_codes (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            code_hash TEXT NOT NULL,
+            used INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL
+        )""",
+        # Broadcasts table for admin messages
+        """CREATE TABLE IF NOT EXISTS broadcasts (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            body TEXT NOT NULL,
+            priority TEXT DEFAULT 'info',
+            require_confirmation INTEGER DEFAULT 1,
+            target TEXT DEFAULT 'all',
+            target_user_id TEXT,
+            created_at TEXT NOT NULL,
+            confirmations_json TEXT DEFAULT '[]'
+        )""",
+        # Subscription tiers table
+        """CREATE TABLE IF NOT EXISTS subscription_tiers (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            price REAL DEFAULT 0,
+            features_json TEXT DEFAULT '[]',
+            msg_limit INTEGER DEFAULT 0,
+            active INTEGER DEFAULT 1,
+            popular INTEGER DEFAULT 0
+        )""",
+        # Visitor tracking (previously created lazily by /api/track-visitor)
+        """CREATE TABLE IF NOT EXISTS visitors (
+            id TEXT PRIMARY KEY,
+            ip TEXT,
+            user_agent TEXT,
+            referer TEXT,
+            accept_language TEXT,
+            page TEXT,
+            country TEXT,
+            visited_at TEXT
+        )""",
+    ]),
+    Migration(2, "hot_path_indexes", [
+        # get_recent_context / admin messages: WHERE user_id, session_id ORDER BY created_at
+        "CREATE INDEX IF NOT EXISTS idx_messages_user_session_created ON messages (user_id, session_id, created_at)",
+        # /admin/audit: ORDER BY ts DESC
+        "CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit (ts)",
+        # verify_token: WHERE user_id, token_type, used
+        "CREATE INDEX IF NOT EXISTS idx_tokens_user_type_used ON tokens (user_id, token_type, used)",
+        # /admin/visitors: ORDER BY visited_at DESC
+        "CREATE INDEX IF NOT EXISTS idx_visitors_visited_at ON visitors (visited_at)",
+        # _get_broadcasts: ORDER BY created_at DESC
+        "CREATE INDEX IF NOT EXISTS idx_broadcasts_created_at ON broadcasts (created_at)",
+    ], indexes=[
+        "idx_messages_user_session_created",
+        "idx_audit_ts",
+        "idx_tokens_user_type_used",
+        "idx_visitors_visited_at",
+        "idx_broadcasts_created_at",
+    ]),
+    Migration(3, "users_indexed_profile_columns", [
+        # Hot profile_json fields promoted to columns (see user_columns_from_profile)
+        "ALTER TABLE users ADD COLUMN user_key TEXT",
+        "ALTER TABLE users ADD COLUMN email TEXT",
+        "ALTER TABLE users ADD COLUMN tier TEXT",
+        "ALTER TABLE users ADD COLUMN user_type TEXT",
+        "ALTER TABLE users ADD COLUMN stripe_customer TEXT",
+        _backfill_user_columns,
+        # api_check_user / admin login: LOWER(user_id) = ?
+        "CREATE INDEX IF NOT EXISTS idx_users_user_key ON users (user_key)",
+        # forgot-password, resend-verification, upgrade-to-user email uniqueness
+        "CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)",
+        "CREATE INDEX IF NOT EXISTS idx_users_tier ON users (tier)",
+        "CREATE INDEX IF NOT EXISTS idx_users_user_type ON users (user_type)",
+        # stripe_webhook customer.subscription.deleted
+        "CREATE INDEX IF NOT EXISTS idx_users_stripe_customer ON users (stripe_customer)",
+    ], indexes=[
+        "idx_users_user_key",
+        "idx_users_email",
+        "idx_users_tier",
+        "idx_users_user_type",
+        "idx_users_stripe_customer",
+    ]),
+    Migration(4, "usage_counters", [
+        # Per-user message counters, bumped by app.add_message in the same transaction.
+        # day is the UTC date (YYYY-MM-DD); day = '*' holds the lifetime totals.
+        """CREATE TABLE IF NOT EXISTS usage_counters (
+            user_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            messages INTEGER NOT NULL DEFAULT 0,
+            user_messages INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        )""",
+        """INSERT INTO usage_counters (user_id, day, messages, user_messages)
+           SELECT user_id, substr(created_at, 1, 10), COUNT(*),
+                  SUM(CASE WHEN role = 'user' THEN 1 ELSE 0 END)
+           FROM messages GROUP BY user_id, substr(created_at, 1, 10)""",
+        """INSERT INTO usage_counters (user_id, day, messages, user_messages)
+           SELECT user_id, '*', COUNT(*), SUM(CASE WHEN role = 'user' THEN 1 ELSE 0 END)
+           FROM messages GROUP BY user_id""",
+    ]),
+    Migration(5, "audit_keyset_and_hourly_rollup", [
+        # Keyset pagination on (ts, id), optionally filtered by action / user / session
+        "CREATE INDEX IF NOT EXISTS idx_audit_ts_id ON audit (ts, id)",
+        "CREATE INDEX IF NOT EXISTS idx_audit_action_ts_id ON audit (action, ts, id)",
+        "CREATE INDEX IF NOT EXISTS idx_audit_user_ts_id ON audit (user_id, ts, id)",
+        "CREATE INDEX IF NOT EXISTS idx_audit_session_ts_id ON audit (session_id, ts, id)",
+        "DROP INDEX IF EXISTS idx_audit_ts",
+        # Event counts per UTC hour ('YYYY-MM-DDTHH') and action, maintained by app._insert_audit_rows
+        """CREATE TABLE IF NOT EXISTS audit_hourly (
+            hour TEXT NOT NULL,
+            action TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, action)
+        )""",
+        """INSERT INTO audit_hourly (hour, action, count)
+           SELECT substr(ts, 1, 13), action, COUNT(*) FROM audit GROUP BY substr(ts, 1, 13), action""",
+    ], indexes=[
+        "idx_audit_ts_id",
+        "idx_audit_action_ts_id",
+        "idx_audit_user_ts_id",
+        "idx_audit_session_ts_id",
+    ], dropped_indexes=["idx_audit_ts"]),
+    Migration(6, "messages_full_text_search", {
+        # External-content FTS5 index over messages.content, kept in sync by triggers (so
+        # add_message's transaction updates it). Keyed by messages.rowid here; migration 14
+        # re-keys it on the stable messages.seq column.
+        SQLITE: [
+            """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content, content='messages', content_rowid='rowid',
+                tokenize='unicode61 remove_diacritics 2'
+            )""",
+            """CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+                INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+            END""",
+            "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+        ],
+        # Generated tsvector column: computed by the INSERT itself, indexed with GIN.
+        # 'simple' config: conversations mix languages, so no language-specific stemming.
+        POSTGRES: [
+            """ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector
+               GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED""",
+            "CREATE INDEX IF NOT EXISTS idx_messages_content_tsv ON messages USING GIN (content_tsv)",
+        ],
+    }, indexes={POSTGRES: ["idx_messages_content_tsv"]}),
+    Migration(7, "stats_counters", [
+        # Global row counters for the dashboard, bumped by app.bump_stat in the writer's
+        # transaction. A counter is the SUM over its shards: writers pick a random shard so
+        # concurrent transactions don't queue on one row lock. app.reconcile_stats folds
+        # the shards back into shard 0 with the true COUNT(*).
+        """CREATE TABLE IF NOT EXISTS stats (
+            name TEXT NOT NULL,
+            shard INTEGER NOT NULL DEFAULT 0,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, shard)
+        )""",
+        "INSERT INTO stats (name, shard, value) SELECT 'users', 0, COUNT(*) FROM users",
+        "INSERT INTO stats (name, shard, value) SELECT 'messages', 0, COUNT(*) FROM messages",
+        "INSERT INTO stats (name, shard, value) SELECT 'leads', 0, COUNT(*) FROM leads",
+    ]),
+    Migration(8, "traffic_rollups", [
+        # Page views per UTC hour / day and dimension (total, page, referrer, browser,
+        # language; see visitor_traffic.py), maintained by app._write_visitor_rows.
+        # Raw visitors rows expire after K1_VISITOR_RETENTION_DAYS; these stay.
+        """CREATE TABLE IF NOT EXISTS traffic_hourly (
+            hour TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            value TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, dimension, value)
+        )""",
+        """CREATE TABLE IF NOT EXISTS traffic_daily (
+            day TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            value TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, dimension, value)
+        )""",
+        _backfill_traffic_rollups,
+    ]),
+    Migration(9, "broadcast_receipts", [
+        # One row per confirmation (replaces broadcasts.confirmations_json, no longer written)
+        """CREATE TABLE IF NOT EXISTS broadcast_receipts (
+            broadcast_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            confirmed_at TEXT NOT NULL,
+            PRIMARY KEY (broadcast_id, user_id)
+        )""",
+        # Per-user lookups and GDPR deletes
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_broadcast_receipts_user ON broadcast_receipts (user_id, broadcast_id)",
+        # Maintained by app.confirm_broadcast alongside the receipt insert
+        "ALTER TABLE broadcasts ADD COLUMN confirmed_count INTEGER NOT NULL DEFAULT 0",
+        # Every broadcast created before seen_before is confirmed by (or not addressed to) the
+        # user, so /api/broadcasts/pending only scans broadcasts created since.
+        """CREATE TABLE IF NOT EXISTS broadcast_watermarks (
+            user_id TEXT PRIMARY KEY,
+            seen_before TEXT NOT NULL
+        )""",
+        _backfill_broadcast_receipts,
+    ], indexes=["idx_broadcast_receipts_user"]),
+    Migration(10, "events_outbox", {
+        # Server-sent events (see event_hub.py): rows are written in the publisher's
+        # transaction and tailed by every worker; ids double as SSE Last-Event-IDs.
+        SQLITE: [
+            """CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                type TEXT NOT NULL,
+                data_json TEXT NOT NULL
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_events_channel_id ON events (channel, id)",
+            "CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts)",
+            # Connected event-stream users per worker, summed for the live users count
+            """CREATE TABLE IF NOT EXISTS live_workers (
+                worker TEXT PRIMARY KEY,
+                users INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL
+            )""",
+        ],
+        POSTGRES: [
+            """CREATE TABLE IF NOT EXISTS events (
+                id BIGSERIAL PRIMARY KEY,
+                ts TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                type TEXT NOT NULL,
+                data_json TEXT NOT NULL
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_events_channel_id ON events (channel, id)",
+            "CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts)",
+            """CREATE TABLE IF NOT EXISTS live_workers (
+                worker TEXT PRIMARY KEY,
+                users INTEGER NOT NULL,
+                updated_at BIGINT NOT NULL
+            )""",
+        ],
+    }, indexes=["idx_events_channel_id", "idx_events_ts"]),
+    Migration(11, "tokens_hmac_digest", [
+        # HMAC-SHA256 of the token (app.token_digest): verify is one indexed lookup instead of
+        # bcrypt per candidate row. token_hash keeps the bcrypt hash of tokens issued before
+        # this migration until they expire.
+        "ALTER TABLE tokens ADD COLUMN token_digest TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_tokens_digest ON tokens (token_digest)",
+        # Background purge of expired tokens
+        "CREATE INDEX IF NOT EXISTS idx_tokens_expires_at ON tokens (expires_at)",
+    ], indexes=["idx_tokens_digest", "idx_tokens_expires_at"]),
+    Migration(12, "token_usage", [
+        # LLM token ledger (see token_budget.py), written after every provider call.
+        # period is the UTC day (YYYY-MM-DD) or month (YYYY-MM); both rows are bumped per call.
+        """CREATE TABLE IF NOT EXISTS token_usage (
+            user_id TEXT NOT NULL,
+            period TEXT NOT NULL,
+            input_tokens BIGINT NOT NULL DEFAULT 0,
+            output_tokens BIGINT NOT NULL DEFAULT 0,
+            cost_usd DOUBLE PRECISION NOT NULL DEFAULT 0,
+            requests INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, period)
+        )""",
+        # Admin cost report: top spenders of one period
+        "CREATE INDEX IF NOT EXISTS idx_token_usage_period_cost ON token_usage (period, cost_usd)",
+    ], indexes=["idx_token_usage_period_cost"]),
+    Migration(13, "demo_usage", [
+        # Demo minutes per client IP and UTC day (see demo_usage.py), written in batches by
+        # each worker; an IP's demo days are its rows. last_activity is epoch seconds.
+        """CREATE TABLE IF NOT EXISTS demo_usage (
+            ip TEXT NOT NULL,
+            day TEXT NOT NULL,
+            seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            last_activity DOUBLE PRECISION NOT NULL DEFAULT 0,
+            PRIMARY KEY (ip, day)
+        )""",
+        # Retention purge
+        "CREATE INDEX IF NOT EXISTS idx_demo_usage_day ON demo_usage (day)",
+    ], indexes=["idx_demo_usage_day"]),
+    Migration(14, "messages_stable_fts_rowid", {
+        # messages has a TEXT primary key, so its implicit rowid (the FTS key of migration 6)
+        # may be renumbered by VACUUM, silently pointing index entries at other messages.
+        # Rebuild it with `seq INTEGER PRIMARY KEY` (a rowid alias VACUUM keeps; existing rows
+        # keep their current rowid) and `id` UNIQUE, and key the FTS content on seq.
+        # PostgreSQL indexes a generated column of the row itself: nothing to change.
+        SQLITE: [
+            "DROP TRIGGER IF EXISTS messages_fts_ai",
+            "DROP TRIGGER IF EXISTS messages_fts_ad",
+            "DROP TRIGGER IF EXISTS messages_fts_au",
+            "DROP TABLE IF EXISTS messages_fts",
+            """CREATE TABLE messages_v14 (
+                seq INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                meta_json TEXT NOT NULL
+            )""",
+            """INSERT INTO messages_v14 (seq, id, user_id, session_id, role, content, created_at, meta_json)
+               SELECT rowid, id, user_id, session_id, role, content, created_at, meta_json FROM messages""",
+            "DROP TABLE messages",
+            "ALTER TABLE messages_v14 RENAME TO messages",
+            "CREATE INDEX IF NOT EXISTS idx_messages_user_session_created ON messages (user_id, session_id, created_at)",
+            """CREATE VIRTUAL TABLE messages_fts USING fts5(
+                content, content='messages', content_rowid='seq',
+                tokenize='unicode61 remove_diacritics 2'
+            )""",
+            """CREATE TRIGGER messages_fts_ai AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, content) VALUES (new.seq, new.content);
+            END""",
+            """CREATE TRIGGER messages_fts_ad AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.seq, old.content);
+            END""",
+            """CREATE TRIGGER messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.seq, old.content);
+                INSERT INTO messages_fts (rowid, content) VALUES (new.seq, new.content);
+            END""",
+            "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+        ],
+    }),
+]
+
+
+# ============================================================================
+# ENGINE
+# ============================================================================
+
+def _ph(dialect: str) -> str:
+    return "%s" if dialect == POSTGRES else "?"
+
+
+def _utc_now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _row_value(row, key: str, idx: int):
+    if isinstance(row, dict):
+        return row[key]
+    try:
+        return row[key]
+    except (IndexError, KeyError, TypeError):
+        return row[idx]
+
+
+def _ensure_version_table(con, dialect: str):
+    cur = con.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    con.commit()
+
+
+def applied_versions(con, dialect: str) -> Dict[int, Dict]:
+    """Return {version: {"name", "checksum", "applied_at"}} for applied migrations."""
+    _ensure_version_table(con, dialect)
+    cur = con.cursor()
+    cur.execute("SELECT version, name, checksum, applied_at FROM schema_version ORDER BY version")
+    out = {}
+    for row in cur.fetchall():
+        out[int(_row_value(row, "version", 0))] = {
+            "name": _row_value(row, "name", 1),
+            "checksum": _row_value(row, "checksum", 2),
+            "applied_at": _row_value(row, "applied_at", 3),
+        }
+    con.commit()
+    return out
+
+
+def _begin_locked(con, cur, dialect: str):
+    if dialect == SQLITE:
+        if getattr(con, "in_transaction", False):
+            con.commit()
+        cur.execute("BEGIN IMMEDIATE")
+    else:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (PG_MIGRATION_LOCK_ID,))
+
+
+def _apply(con, dialect: str, migration: Migration) -> bool:
+    """Apply one migration in its own locked transaction. False if already applied."""
+    cur = con.cursor()
+    _begin_locked(con, cur, dialect)
+    try:
+        cur.execute(f"SELECT version FROM schema_version WHERE version = {_ph(dialect)}", (migration.version,))
+        if cur.fetchone():
+            con.rollback()
+            return False
+        for step in migration.steps(dialect):
+            if callable(step):
+                step(cur, dialect)
+            else:
+                cur.execute(step)
+        cur.execute(
+            f"INSERT INTO schema_version (version, name, checksum, applied_at) VALUES ({', '.join([_ph(dialect)] * 4)})",
+            (migration.version, migration.name, migration.checksum, _utc_now_iso())
+        )
+        con.commit()
+        return True
+    except Exception:
+        con.rollback()
+        raise
+
+
+def head_version(migrations: Optional[List[Migration]] = None) -> int:
+    migrations = MIGRATIONS if migrations is None else migrations
+    return max((m.version for m in migrations), default=0)
+
+
+def migrate(con, dialect: str, migrations: Optional[List[Migration]] = None) -> List[int]:
+    """Apply all pending migrations in order. Returns the versions applied."""
+    migrations = sorted(MIGRATIONS if migrations is None else migrations, key=lambda m: m.version)
+    done = applied_versions(con, dialect)
+    unknown = [v for v in done if v > head_version(migrations)]
+    if unknown:
+        raise MigrationError(f"Database has migrations newer than this code: {unknown}")
+
+    applied = []
+    for m in migrations:
+        if m.version in done:
+            continue
+        try:
+            if _apply(con, dialect, m):
+                applied.append(m.version)
+                migrations_logger.info(f"Applied migration {m.version:04d}_{m.name}")
+        except Exception as e:
+            raise MigrationError(f"Migration {m.version:04d}_{m.name} failed: {e}") from e
+    return applied
+
+
+def _existing_indexes(con, dialect: str) -> set:
+    cur = con.cursor()
+    if dialect == SQLITE:
+        cur.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    else:
+        cur.execute("SELECT indexname AS name FROM pg_indexes WHERE schemaname = current_schema()")
+    names = {_row_value(r, "name", 0) for r in cur.fetchall()}
+    con.commit()
+    return names
+
+
+def verify(con, dialect: str, migrations: Optional[List[Migration]] = None) -> Dict:
+    """Check the schema is at head, checksums match and expected indexes exist."""
+    migrations = MIGRATIONS if migrations is None else migrations
+    done = applied_versions(con, dialect)
+    known = {m.version: m for m in migrations}
+
+    pending = [v for v in sorted(known) if v not in done]
+    unknown = [v for v in sorted(done) if v not in known]
+    modified = [v for v, m in known.items() if v in done and done[v]["checksum"] != m.checksum]
+    indexes = _existing_indexes(con, dialect)
+    dropped = {ix for v, m in known.items() if v in done for ix in m.dropped_indexes}
+    missing_indexes = [ix for v, m in known.items() if v in done for ix in m.indexes(dialect)
+                       if ix not in indexes and ix not in dropped]
+
+    return {
+        "ok": not (pending or unknown or modified or missing_indexes),
+        "dialect": dialect,
+        "current": max(done, default=0),
+        "head": head_version(migrations),
+        "pending": pending,
+        "unknown": unknown,
+        "modified": modified,
+        "missing_indexes": missing_indexes,
+    }
+
+
+def status(con, dialect: str, migrations: Optional[List[Migration]] = None) -> List[Dict]:
+    migrations = MIGRATIONS if migrations is None else migrations
+    done = applied_versions(con, dialect)
+    return [{
+        "version": m.version,
+        "name": m.name,
+        "applied_at": done.get(m.version, {}).get("applied_at"),
+    } for m in sorted(migrations, key=lambda m: m.version)]
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def _connect_from_env():
+    """Open a connection the same way app.py chooses its backend."""
+    from dotenv import load_dotenv
+    load_dotenv()
+    url = os.getenv("DATABASE_URL", "")
+    if url:
+        from urllib.parse import urlparse
+        host = urlparse(url).hostname
+        if host and host != "host" and len(host) >= 3:
+            try:
+                import psycopg2
+                return psycopg2.connect(url), POSTGRES
+            except ImportError:
+                migrations_logger.info("psycopg2 not installed, using SQLite")
+    import sqlite3
+    path = os.getenv("K1_DB_PATH", os.path.join("data", "k1.db"))
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return sqlite3.connect(path), SQLITE
+
+
+def main(argv: List[str]) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    command = argv[1] if len(argv) > 1 else "migrate"
+    con, dialect = _connect_from_env()
+    try:
+        if command == "migrate":
+            applied = migrate(con, dialect)
+            print(f"[{dialect}] applied: {applied or 'nothing'} (head={head_version()})")
+            report = verify(con, dialect)
+        elif command == "status":
+            for row in status(con, dialect):
+                print(f"{row['version']:04d}_{row['name']:<28} {row['applied_at'] or 'PENDING'}")
+            return 0
+        elif command == "verify":
+            report = verify(con, dialect)
+        else:
+            print(f"Unknown command: {command}. Use migrate | status | verify")
+            return 2
+    finally:
+        con.close()
+
+    if not report["ok"]:
+        print(f"Schema verification FAILED: {report}")
+        return 1
+    print(f"Schema OK at version {report['current']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
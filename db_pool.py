@@ -0,0 +1,599 @@
+"""
+KELION AI - Database Connection Pool
+====================================
+Bounded, thread-safe PostgreSQL pool and per-thread SQLite connections.
+
+- PostgreSQL: min/max size, pre-ping health checks for idle connections,
+  max-lifetime recycling, wait/occupancy metrics.
+- SQLite: one connection per thread, opened once with WAL, busy_timeout
+  and mmap pragmas instead of reopening the file on every helper call.
+
+Both are fork-aware: a child process never reuses connections opened by
+its parent (they are dropped and reopened lazily).
+
+UnitOfWork lets a whole HTTP request share one connection and commit once;
+each helper's `with` block is a savepoint, so a caught helper failure only
+undoes that helper's statements.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional
+
+db_logger = logging.getLogger("kelion.db")
+
+
+class PoolExhaustedError(RuntimeError):
+    """Raised when no connection becomes available within the acquire timeout."""
+
+
+# ============================================================================
+# POSTGRESQL POOL
+# ============================================================================
+
+class PooledConnection:
+    """
+    Connection checked out from a PGConnectionPool.
+
+    Behaves like the underlying driver connection (attribute access is
+    proxied) and, used as a context manager, commits or rolls back and
+    then returns the connection to the pool.
+    """
+
+    def __init__(self, pool: "PGConnectionPool", raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._raw.commit()
+            else:
+                self._raw.rollback()
+        except Exception as e:
+            db_logger.warning(f"Connection finalize failed, discarding: {e}")
+            self.release(discard=True)
+            return False
+        self.release()
+        return False
+
+    def release(self, discard: bool = False):
+        """Return the connection to the pool (idempotent)."""
+        if self._released:
+            return
+        self._released = True
+        self._pool.release(self._raw, discard=discard)
+
+    def close(self):
+        """Closing a pooled connection hands it back to the pool."""
+        self.release()
+
+
+class PGConnectionPool:
+    """Bounded, thread-safe PostgreSQL connection pool."""
+
+    def __init__(self, connect: Callable[[], object], minconn: int = 1, maxconn: int = 10,
+                 max_lifetime: float = 1800.0, acquire_timeout: float = 10.0,
+                 health_check_after: float = 30.0):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError("Invalid pool bounds: require 0 <= minconn <= maxconn, maxconn >= 1")
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle: deque = deque()          # (conn, created_at, last_used)
+        self._born: Dict[int, float] = {}    # id(conn) -> created_at, for every open conn
+        self._opening = 0                    # slots reserved by in-flight connects
+        self._in_use = 0
+        self._waiting = 0
+        self._pid = os.getpid()
+        self._closed = False
+
+        self._metrics = {
+            "acquired": 0,
+            "waited": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "discarded": 0,
+            "health_check_failures": 0,
+            "peak_in_use": 0,
+        }
+
+    # --- internals (caller holds self._cond unless noted) ---
+
+    def _check_fork(self):
+        """Forget connections inherited from a parent process."""
+        if self._pid != os.getpid():
+            self._idle.clear()
+            self._born.clear()
+            self._opening = 0
+            self._in_use = 0
+            self._waiting = 0
+            self._pid = os.getpid()
+            db_logger.info("DB pool reset after fork")
+
+    def _size(self) -> int:
+        return len(self._born) + self._opening
+
+    def _open(self):
+        """Open a new connection. Called WITHOUT the lock held."""
+        conn = self._connect()
+        return conn, time.monotonic()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, created_at: float) -> bool:
+        return bool(self.max_lifetime) and (time.monotonic() - created_at) > self.max_lifetime
+
+    def _healthy(self, conn) -> bool:
+        """Pre-ping a connection that sat idle for a while. Called WITHOUT the lock."""
+        if getattr(conn, "closed", 0):
+            return False
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    # --- public API ---
+
+    def acquire(self, timeout: Optional[float] = None):
+        """Check out a raw connection, waiting up to `timeout` seconds."""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+
+        while True:
+            candidate = None
+            must_open = False
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                self._check_fork()
+                while not self._idle and self._size() >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics["timeouts"] += 1
+                        raise PoolExhaustedError(
+                            f"No database connection available after {timeout:.1f}s "
+                            f"(max={self.maxconn}, in_use={self._in_use})"
+                        )
+                    waited = True
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    candidate = self._idle.pop()  # LIFO keeps a warm working set
+                else:
+                    must_open = True
+                    self._opening += 1
+                self._in_use += 1
+
+            if must_open:
+                try:
+                    conn, created_at = self._open()
+                except Exception:
+                    with self._cond:
+                        self._opening -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._opening -= 1
+                    self._born[id(conn)] = created_at
+                    self._metrics["created"] += 1
+                    self._record_acquire(start, waited)
+                return conn
+
+            conn, created_at, last_used = candidate
+            stale = self._expired(created_at)
+            if not stale and self.health_check_after is not None \
+                    and (time.monotonic() - last_used) > self.health_check_after \
+                    and not self._healthy(conn):
+                with self._cond:
+                    self._metrics["health_check_failures"] += 1
+                stale = True
+            if stale:
+                self._close_quietly(conn)
+                with self._cond:
+                    self._born.pop(id(conn), None)
+                    self._in_use -= 1
+                    self._metrics["recycled"] += 1
+                continue
+
+            with self._cond:
+                self._record_acquire(start, waited)
+            return conn
+
+    def _record_acquire(self, start: float, waited: bool):
+        wait_ms = (time.monotonic() - start) * 1000.0
+        m = self._metrics
+        m["acquired"] += 1
+        if waited:
+            m["waited"] += 1
+        m["wait_ms_total"] += wait_ms
+        m["wait_ms_max"] = max(m["wait_ms_max"], wait_ms)
+        m["peak_in_use"] = max(m["peak_in_use"], self._in_use)
+
+    def release(self, conn, discard: bool = False):
+        """Return a raw connection to the pool."""
+        if not discard:
+            try:
+                if getattr(conn, "closed", 0):
+                    discard = True
+                else:
+                    # Never hand out a connection with an open transaction
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            created_at = self._born.get(id(conn))
+            if created_at is None:
+                # Not ours (pool reset/closed meanwhile)
+                self._close_quietly(conn)
+                return
+            self._in_use = max(0, self._in_use - 1)
+            if discard or self._closed or self._expired(created_at):
+                self._born.pop(id(conn), None)
+                self._metrics["discarded" if discard else "recycled"] += 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def connection(self, timeout: Optional[float] = None) -> PooledConnection:
+        """Check out a connection wrapped for `with` usage."""
+        return PooledConnection(self, self.acquire(timeout))
+
+    def prefill(self):
+        """Open connections up to `minconn` (best effort)."""
+        opened = []
+        try:
+            while True:
+                with self._cond:
+                    self._check_fork()
+                    if self._size() + len(opened) >= self.minconn:
+                        break
+                conn, created_at = self._open()
+                opened.append((conn, created_at))
+        except Exception as e:
+            db_logger.warning(f"DB pool prefill stopped: {e}")
+        with self._cond:
+            for conn, created_at in opened:
+                self._born[id(conn)] = created_at
+                self._idle.append((conn, created_at, time.monotonic()))
+                self._metrics["created"] += 1
+            self._cond.notify_all()
+
+    def close_all(self):
+        """Close idle connections and refuse new checkouts."""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            for conn, _, _ in idle:
+                self._born.pop(id(conn), None)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> Dict:
+        """Pool occupancy and wait metrics."""
+        with self._cond:
+            m = dict(self._metrics)
+            size = self._size()
+            m.update({
+                "size": size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "min": self.minconn,
+                "max": self.maxconn,
+                "occupancy": round(self._in_use / self.maxconn, 3),
+                "wait_ms_avg": round(m["wait_ms_total"] / m["acquired"], 3) if m["acquired"] else 0.0,
+            })
+            m["wait_ms_total"] = round(m["wait_ms_total"], 3)
+            m["wait_ms_max"] = round(m["wait_ms_max"], 3)
+            return m
+
+
+# ============================================================================
+# SQLITE PER-THREAD CONNECTIONS
+# ============================================================================
+
+class SQLiteConnectionCache:
+    """
+    One SQLite connection per thread, opened once with tuned pragmas.
+
+    The returned object is a plain sqlite3.Connection, so `with con:`
+    keeps its usual commit/rollback semantics without closing it.
+    """
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000,
+                 mmap_size: int = 64 * 1024 * 1024, synchronous: str = "NORMAL"):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.synchronous = synchronous
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._reused = 0
+
+    def _open(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000.0)
+        con.row_factory = sqlite3.Row
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            con.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            con.execute(f"PRAGMA synchronous={self.synchronous}")
+        except sqlite3.DatabaseError as e:
+            db_logger.warning(f"SQLite pragma setup failed: {e}")
+        return con
+
+    def get(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        con = getattr(self._local, "con", None)
+        if con is not None and getattr(self._local, "pid", None) == os.getpid():
+            with self._lock:
+                self._reused += 1
+            return con
+        con = self._open()
+        self._local.con = con
+        self._local.pid = os.getpid()
+        with self._lock:
+            self._opened += 1
+        return con
+
+    def close_thread_connection(self):
+        """Close the calling thread's connection (e.g. at thread exit)."""
+        con = getattr(self._local, "con", None)
+        if con is not None and getattr(self._local, "pid", None) == os.getpid():
+            try:
+                con.close()
+            except Exception:
+                pass
+        self._local.con = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "opened": self._opened,
+                "reused": self._reused,
+                "busy_timeout_ms": self.busy_timeout_ms,
+                "mmap_size": self.mmap_size,
+            }
+
+
+# ============================================================================
+# UNIT OF WORK
+# ============================================================================
+
+class _UnitOfWorkConnection:
+    """
+    Connection handed to helpers while a unit of work is active.
+
+    `commit()` calls are deferred to the unit of work, so every helper in a
+    request shares one connection and one transaction. Each `with` block is
+    scoped by a SAVEPOINT: an exception escaping it (or `rollback()` inside
+    it) undoes only that block's statements, and on PostgreSQL leaves the
+    transaction usable for the rest of the request.
+    """
+
+    def __init__(self, uow: "UnitOfWork", raw):
+        self._uow = uow
+        self._raw = raw
+        self._scopes: list = []
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        self._scopes.append(self._uow._open_scope())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        scope = self._scopes.pop()
+        if exc_type is not None:
+            self._uow._rollback_scope(scope)
+        else:
+            self._uow._release_scope(scope)
+        return False
+
+    def commit(self):
+        self._uow.deferred_commits += 1
+
+    def after_commit(self, fn: Callable[[], None]):
+        """Run `fn` once this work is committed (dropped if it is rolled back)."""
+        self._uow.after_commit(fn)
+
+    def rollback(self):
+        """Undo the enclosing `with` block's work; outside of one, the request's."""
+        if self._scopes:
+            self._scopes[-1] = self._uow._restart_scope(self._scopes[-1])
+        else:
+            self._uow.failed = True
+
+    def close(self):
+        pass
+
+
+def _in_transaction(raw) -> bool:
+    return bool(getattr(raw, "in_transaction", False))
+
+
+class UnitOfWork:
+    """
+    One connection and one transaction shared by all helpers of a request.
+
+    `acquire` returns a raw connection, `release` gives it back (pool
+    checkout for PostgreSQL, per-thread request connection for SQLite).
+    The connection is acquired lazily on first use.
+    """
+
+    def __init__(self, acquire: Callable[[], object], release: Callable[[object], None]):
+        self._acquire = acquire
+        self._release = release
+        self._raw = None
+        self._generation = 0     # bumped whenever the transaction ends
+        self._savepoints = 0
+        self.failed = False
+        self.deferred_commits = 0
+        self.commits = 0
+        self.scope_rollbacks = 0
+        self._after_commit: list = []
+
+    def connection(self) -> _UnitOfWorkConnection:
+        if self._raw is None:
+            self._raw = self._acquire()
+        return _UnitOfWorkConnection(self, self._raw)
+
+    @property
+    def active(self) -> bool:
+        return self._raw is not None
+
+    @property
+    def pending(self) -> bool:
+        """A transaction with the request's work is open."""
+        return self._raw is not None and _in_transaction(self._raw)
+
+    # --- savepoint scopes (one per `with` block) ---
+    # A scope is (generation, savepoint name or None, after-commit callbacks before it). Without an open transaction
+    # no savepoint is needed: the block's own statements are all there is to undo.
+    # (On SQLite a SAVEPOINT outside BEGIN would commit on RELEASE, and an early
+    # BEGIN would turn later writes into snapshot upgrades that fail under load.)
+
+    def _open_scope(self):
+        if self._raw is None or not _in_transaction(self._raw):
+            return (self._generation, None, len(self._after_commit))
+        self._savepoints += 1
+        name = f"uow_{self._savepoints}"
+        self._raw.execute(f"SAVEPOINT {name}")
+        return (self._generation, name, len(self._after_commit))
+
+    def _release_scope(self, scope):
+        generation, name, _ = scope
+        if name is not None and generation == self._generation and self._raw is not None:
+            self._raw.execute(f"RELEASE SAVEPOINT {name}")
+
+    def _rollback_scope(self, scope):
+        generation, name, callbacks = scope
+        if generation != self._generation or self._raw is None:
+            return          # the transaction already ended (checkpoint / commit)
+        self.scope_rollbacks += 1
+        del self._after_commit[callbacks:]
+        if name is None:
+            self._raw.rollback()
+            self._generation += 1
+        else:
+            self._raw.execute(f"ROLLBACK TO SAVEPOINT {name}")
+            self._raw.execute(f"RELEASE SAVEPOINT {name}")
+
+    def _restart_scope(self, scope):
+        """rollback() inside a `with` block: undo it and keep going in a fresh scope."""
+        self._rollback_scope(scope)
+        return self._open_scope()
+
+    def after_commit(self, fn: Callable[[], None]):
+        """Run `fn` after the next successful commit (e.g. to update a cache)."""
+        self._after_commit.append(fn)
+
+    def commit(self):
+        """Commit pending work (rolls back instead if the request failed)."""
+        if self._raw is None:
+            return
+        if self.failed:
+            self.rollback()
+            return
+        try:
+            self._raw.commit()
+        finally:
+            self._generation += 1
+        self.commits += 1
+        callbacks, self._after_commit = self._after_commit, []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception as e:
+                db_logger.error(f"After-commit callback failed: {e}")
+
+    def rollback(self):
+        self._after_commit = []
+        if self._raw is None:
+            return
+        try:
+            self._raw.rollback()
+        finally:
+            self._generation += 1
+            self.failed = False
+
+    def checkpoint(self):
+        """Finish the current transaction and hand the connection back.
+
+        Used before slow upstream calls so the request neither holds a pooled
+        connection nor the SQLite write lock while it waits.
+        """
+        try:
+            self.commit()
+        finally:
+            self.close()
+
+    def close(self):
+        """Release the connection (any uncommitted work is rolled back)."""
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        self._generation += 1
+        self._after_commit = []
+        try:
+            raw.rollback()
+        except Exception:
+            pass
+        self._release(raw)
+
+
+__all__ = [
+    'PoolExhaustedError',
+    'PooledConnection',
+    'PGConnectionPool',
+    'SQLiteConnectionCache',
+    'UnitOfWork',
+]
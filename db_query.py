@@ -0,0 +1,331 @@
+"""
+KELION AI - Dialect-aware Query Layer
+=====================================
+Handlers write SQLite-style SQL (`?` placeholders, `con.execute(...)`)
+and it runs unchanged on PostgreSQL.
+
+- translate_sql(): rewrites `?` to `%s` (and escapes literal `%`) once per
+  distinct statement; results are cached.
+- Row: compact tuple-backed row with O(1) index and key access. The
+  column -> index map is built once per result set and shared by its rows.
+- PGConnection: wraps a psycopg2 connection with the sqlite3-style
+  `execute` / `executemany` API. Statements run at least
+  `prepare_threshold` times on a connection become server-side prepared
+  statements (PREPARE / EXECUTE), so the hot per-request queries skip
+  parsing and planning.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+query_logger = logging.getLogger("kelion.db.query")
+
+SQLITE = "sqlite"
+POSTGRES = "postgres"
+
+STATEMENT_CACHE_SIZE = 1024
+_PREPARABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+class Statement(NamedTuple):
+    """A `?`-style statement compiled for PostgreSQL."""
+    text: str            # psycopg2 form (`%s`, literal `%` escaped when params are bound)
+    prepare_text: str    # PREPARE body (`$1`, `$2`, ...)
+    nparams: int
+    preparable: bool
+
+
+def _rewrite(sql: str, placeholder) -> Tuple[str, int]:
+    """Replace `?` outside quoted literals/identifiers; `placeholder(n)` gives the n-th (1-based)."""
+    out = []
+    n = 0
+    quote = None
+    for ch in sql:
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == "?":
+            n += 1
+            out.append(placeholder(n))
+            continue
+        out.append(ch)
+    return "".join(out), n
+
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_statement(sql: str) -> Statement:
+    """Compile a `?`-style statement for psycopg2 (cached per distinct SQL string)."""
+    prepare_text, nparams = _rewrite(sql, lambda n: f"${n}")
+    if nparams:
+        # psycopg2 only interpolates (and unescapes `%%`) when parameters are passed
+        text, _ = _rewrite(sql.replace("%", "%%"), lambda n: "%s")
+    else:
+        text = sql
+    head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+    return Statement(text, prepare_text, nparams, head in _PREPARABLE)
+
+
+def translate_sql(sql: str, dialect: str) -> str:
+    """Return `sql` in the placeholder style of `dialect`."""
+    if dialect != POSTGRES:
+        return sql
+    return compile_statement(sql).text
+
+
+# ============================================================================
+# ROWS
+# ============================================================================
+
+class Row:
+    """
+    Result row compatible with sqlite3.Row: `row[0]`, `row["col"]`,
+    `row.keys()`, iteration over values and `dict(row)`.
+    """
+
+    __slots__ = ("_index", "_values")
+
+    def __init__(self, index: Dict[str, int], values: Sequence):
+        self._index = index
+        self._values = tuple(values)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, slice)):
+            return self._values[key]
+        try:
+            return self._values[self._index[key]]
+        except KeyError:
+            # sqlite3.Row matches column names case-insensitively
+            for name, i in self._index.items():
+                if name.lower() == str(key).lower():
+                    return self._values[i]
+            raise IndexError(f"No item with that key: {key!r}")
+
+    def keys(self):
+        return list(self._index)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            return self._index.keys() == other._index.keys() and self._values == other._values
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._values)
+
+    def __repr__(self):
+        return f"Row({dict(zip(self._index, self._values))!r})"
+
+
+class Cursor:
+    """psycopg2 cursor returning `Row` objects."""
+
+    __slots__ = ("_cur", "_index")
+
+    def __init__(self, cur):
+        self._cur = cur
+        self._index = None
+
+    def _columns(self) -> Dict[str, int]:
+        if self._index is None:
+            self._index = {d[0]: i for i, d in enumerate(self._cur.description or ())}
+        return self._index
+
+    def fetchone(self) -> Optional[Row]:
+        values = self._cur.fetchone()
+        return None if values is None else Row(self._columns(), values)
+
+    def fetchmany(self, size: Optional[int] = None):
+        values = self._cur.fetchmany(size) if size is not None else self._cur.fetchmany()
+        index = self._columns()
+        return [Row(index, v) for v in values]
+
+    def fetchall(self):
+        index = self._columns()
+        return [Row(index, v) for v in self._cur.fetchall()]
+
+    def __iter__(self):
+        index = self._columns()
+        for values in self._cur:
+            yield Row(index, values)
+
+    @property
+    def rowcount(self) -> int:
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    @property
+    def lastrowid(self):
+        return None
+
+    def close(self):
+        self._cur.close()
+
+
+# ============================================================================
+# POSTGRESQL CONNECTION
+# ============================================================================
+
+_stats_lock = threading.Lock()
+_stats = {"executed": 0, "prepared": 0, "prepared_executions": 0, "deallocated": 0}
+
+
+def _bump(key: str, n: int = 1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+class PGConnection:
+    """
+    psycopg2 connection with the sqlite3 `execute` API.
+
+    Other attributes (commit, rollback, cursor, closed, ...) are proxied to
+    the driver connection, so the pool and migrations keep using it as is.
+    `prepare_threshold=None` (or 0) disables server-side prepared statements.
+    """
+
+    MAX_TRACKED = 2048
+
+    def __init__(self, raw, prepare_threshold: Optional[int] = None, max_prepared: int = 64):
+        self._raw = raw
+        self.prepare_threshold = prepare_threshold or None
+        self.max_prepared = max_prepared
+        self._seen: Dict[str, int] = {}
+        self._prepared: "OrderedDict[str, str]" = OrderedDict()
+        self._next_id = 0
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    @property
+    def raw(self):
+        return self._raw
+
+    @property
+    def in_transaction(self) -> bool:
+        """Like sqlite3's: a transaction is open (psycopg2 begins one with the first statement)."""
+        return self._raw.get_transaction_status() != 0   # TRANSACTION_STATUS_IDLE
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._raw.commit()
+        else:
+            self._raw.rollback()
+        return False
+
+    def _prepared_name(self, sql: str, stmt: Statement) -> Optional[str]:
+        """Name of the prepared statement for `sql`, preparing it once it is hot."""
+        name = self._prepared.get(sql)
+        if name is not None:
+            self._prepared.move_to_end(sql)
+            return name
+        if not self.prepare_threshold or not stmt.preparable:
+            return None
+        if self._seen.get(sql, 0) < self.prepare_threshold:
+            return None
+
+        cur = self._raw.cursor()
+        try:
+            if len(self._prepared) >= self.max_prepared:
+                _, old = self._prepared.popitem(last=False)
+                cur.execute(f"DEALLOCATE {old}")
+                _bump("deallocated")
+            self._next_id += 1
+            name = f"k1_stmt_{self._next_id}"
+            cur.execute(f"PREPARE {name} AS {stmt.prepare_text}")
+        finally:
+            cur.close()
+        self._prepared[sql] = name
+        self._seen.pop(sql, None)
+        _bump("prepared")
+        return name
+
+    def _count(self, sql: str):
+        if not self.prepare_threshold:
+            return
+        if len(self._seen) >= self.MAX_TRACKED:
+            self._seen.clear()
+        self._seen[sql] = self._seen.get(sql, 0) + 1
+
+    def execute(self, sql: str, params: Sequence = ()) -> Cursor:
+        stmt = compile_statement(sql)
+        params = tuple(params or ())
+        cur = self._raw.cursor()
+        name = self._prepared_name(sql, stmt)
+        if name is not None:
+            args = f" ({', '.join(['%s'] * stmt.nparams)})" if stmt.nparams else ""
+            cur.execute(f"EXECUTE {name}{args}", params or None)
+            _bump("prepared_executions")
+        else:
+            cur.execute(stmt.text, params if stmt.nparams else None)
+            self._count(sql)
+        _bump("executed")
+        return Cursor(cur)
+
+    def executemany(self, sql: str, seq_of_params: Iterable[Sequence]) -> Cursor:
+        stmt = compile_statement(sql)
+        cur = self._raw.cursor()
+        cur.executemany(stmt.text, [tuple(p) for p in seq_of_params])
+        _bump("executed")
+        return Cursor(cur)
+
+    def stream(self, sql: str, params: Sequence = (), batch_size: int = 500):
+        """Yield lists of Rows from a server-side (named) cursor, `batch_size` at a time."""
+        stmt = compile_statement(sql)
+        self._next_id += 1
+        cur = self._raw.cursor(name=f"k1_stream_{self._next_id}")
+        cur.itersize = batch_size
+        try:
+            cur.execute(stmt.text, tuple(params) if stmt.nparams else None)
+            index = None
+            while True:
+                values = cur.fetchmany(batch_size)
+                if not values:
+                    return
+                if index is None:
+                    index = {d[0]: i for i, d in enumerate(cur.description)}
+                yield [Row(index, v) for v in values]
+        finally:
+            cur.close()
+
+    def prepared_statements(self) -> Dict[str, str]:
+        return dict(self._prepared)
+
+
+def stats() -> Dict:
+    """Statement cache and prepared-statement counters (for /health)."""
+    info = compile_statement.cache_info()
+    with _stats_lock:
+        out = dict(_stats)
+    out.update({
+        "statement_cache_hits": info.hits,
+        "statement_cache_misses": info.misses,
+        "statement_cache_size": info.currsize,
+    })
+    return out
+
+
+__all__ = [
+    'Row',
+    'Cursor',
+    'PGConnection',
+    'Statement',
+    'compile_statement',
+    'translate_sql',
+    'stats',
+]
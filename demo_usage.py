@@ -0,0 +1,188 @@
+"""
+KELION AI - Demo Usage Ledger
+=============================
+Demo limits per client IP (minutes per UTC day, days in total), shared by
+every worker through the demo_usage table (migration 13).
+
+- Reads: each worker caches an IP's state for `ttl` seconds, loaded in one
+  query (one row per demo day), then adds its own activity on top.
+- Writes: session starts and activity timestamps go through a write-behind
+  buffer and reach the database at most `flush_seconds` after they
+  happened, one UPSERT per timestamp in time order within a batch. The
+  UPSERT adds the gap to the row's shared last_activity, so workers taking
+  turns on one IP never count the same stretch twice (a worker's own
+  previous request may be older than another worker's). This worker's
+  estimate of the seconds not flushed yet is kept per IP, so a reload from
+  the database never loses them.
+- Memory: the cache is a TTLCache (`max_ips` entries), so idle IPs age out
+  and are reloaded from the database if they come back.
+
+Activity counts the time since the IP's previous request (on any worker,
+once flushed) when the gap is below `idle_gap` seconds; longer gaps start
+a new stretch of use. A session start counts no time.
+"""
+
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+from ttl_cache import TTLCache
+from write_behind import WriteBehindBuffer
+
+# The write() statement for a demo_usage table (migration 13), parameters (ip, day, timestamp, idle_gap)
+DEMO_USAGE_UPSERT = """INSERT INTO demo_usage (ip, day, seconds, last_activity) VALUES (?, ?, 0, ?)
+    ON CONFLICT(ip, day) DO UPDATE SET
+    seconds = demo_usage.seconds + CASE
+        WHEN excluded.last_activity > demo_usage.last_activity
+         AND excluded.last_activity - demo_usage.last_activity < ?
+        THEN excluded.last_activity - demo_usage.last_activity ELSE 0 END,
+    last_activity = CASE WHEN excluded.last_activity > demo_usage.last_activity
+                         THEN excluded.last_activity ELSE demo_usage.last_activity END"""
+
+
+class DemoState(NamedTuple):
+    days: frozenset         # UTC days with a demo session
+    day: str                # the UTC day `seconds` counts
+    seconds: float          # demo time used on `day`
+    last_activity: float    # epoch seconds of the latest start / activity
+
+
+def utc_day(now: float) -> str:
+    return datetime.fromtimestamp(now, timezone.utc).strftime("%Y-%m-%d")
+
+
+class DemoUsage:
+    """
+    load(ip) -> [(day, seconds, last_activity), ...] for that IP
+    write(rows) applies [(ip, day, timestamp, idle_gap), ...] in order, in one transaction: each row
+        adds `timestamp - last_activity` to the stored seconds when that is in (0, idle_gap) and
+        raises last_activity to `timestamp` (inserting the row with 0 seconds if missing)
+    """
+
+    def __init__(self, load: Callable[[str], List[Tuple]], write: Callable[[List[Tuple]], None],
+                 daily_limit_minutes: float = 30, max_days: int = 5, idle_gap: float = 300,
+                 ttl: float = 30.0, max_ips: int = 50000, flush_seconds: float = 5.0,
+                 clock: Callable[[], float] = time.time):
+        self._load = load
+        self._write = write
+        self.daily_limit_minutes = daily_limit_minutes
+        self.max_days = max_days
+        self.idle_gap = idle_gap
+        self._clock = clock
+        self._cache = TTLCache(maxsize=max_ips, ttl=ttl)
+        self._lock = threading.Lock()
+        # Queued but not yet written: {ip: {day: [seconds, last_activity]}}
+        self._unflushed: Dict[str, Dict[str, List[float]]] = {}
+        self._buffer = WriteBehindBuffer("demo_usage", self._write_batch, max_batch=1000,
+                                         max_latency=flush_seconds, max_queue=50000, overflow="drop_oldest")
+
+    # --- state ---
+
+    def _state(self, ip: str, now: float) -> DemoState:
+        today = utc_day(now)
+        state = self._cache.get(ip)
+        if state is None:
+            rows = self._load(ip)
+            with self._lock:
+                pending = {day: list(v) for day, v in self._unflushed.get(ip, {}).items()}
+            days = {r[0] for r in rows} | set(pending)
+            seconds = sum(float(r[1] or 0) for r in rows if r[0] == today) + pending.get(today, [0.0])[0]
+            last = max([float(r[2] or 0) for r in rows] + [v[1] for v in pending.values()] + [0.0])
+            state = DemoState(frozenset(days), today, seconds, last)
+            self._cache.set(ip, state)
+        if state.day != today:
+            state = state._replace(day=today, seconds=0.0)
+        return state
+
+    def _apply(self, ip: str, now: float, seconds: float, idle_gap: float):
+        today = utc_day(now)
+        with self._lock:
+            entry = self._unflushed.setdefault(ip, {}).setdefault(today, [0.0, 0.0])
+            entry[0] += seconds
+            entry[1] = max(entry[1], now)
+
+        def bump(state: DemoState) -> DemoState:
+            if state.day != today:
+                state = state._replace(day=today, seconds=0.0)
+            return DemoState(state.days | {today}, today, state.seconds + seconds, max(state.last_activity, now))
+
+        self._cache.update(ip, bump)
+        self._buffer.put((ip, today, seconds, now, idle_gap))
+
+    # --- API ---
+
+    def check(self, ip: str) -> Dict:
+        """Whether a demo session is allowed for this IP right now."""
+        now = self._clock()
+        state = self._state(ip, now)
+        days = state.days | {state.day}
+        if state.day not in state.days and len(state.days) >= self.max_days:
+            return {
+                "allowed": False,
+                "reason": f"Demo limit exceeded. Maximum {self.max_days} days reached. Please create an account to continue.",
+                "days_remaining": 0,
+                "minutes_remaining": 0
+            }
+        minutes = state.seconds / 60
+        if minutes >= self.daily_limit_minutes:
+            return {
+                "allowed": False,
+                "reason": f"Daily demo limit ({self.daily_limit_minutes:g} minutes) reached. Try again tomorrow or create an account.",
+                "days_remaining": max(0, self.max_days - len(days)),
+                "minutes_remaining": 0
+            }
+        return {
+            "allowed": True,
+            "days_remaining": max(0, self.max_days - len(days)),
+            "minutes_remaining": int(self.daily_limit_minutes - minutes)
+        }
+
+    def start(self, ip: str):
+        """A demo session starts: today counts as a demo day."""
+        now = self._clock()
+        self._state(ip, now)
+        self._apply(ip, now, 0.0, 0.0)
+
+    def activity(self, ip: str):
+        """A demo request: adds the time since the previous one unless the IP was idle.
+        Like start(), it makes today a demo day."""
+        now = self._clock()
+        state = self._state(ip, now)
+        elapsed = now - state.last_activity if state.last_activity else 0.0
+        # Local estimate; the database recounts against the shared last_activity
+        self._apply(ip, now, elapsed if 0 < elapsed < self.idle_gap else 0.0, self.idle_gap)
+
+    def _write_batch(self, items: List[Tuple]):
+        merged: Dict[Tuple[str, str], float] = {}
+        for ip, day, seconds, _, _ in items:
+            merged[(ip, day)] = merged.get((ip, day), 0.0) + seconds
+        self._write([(ip, day, ts, gap) for ip, day, _, ts, gap in sorted(items, key=lambda item: item[3])])
+        with self._lock:
+            for (ip, day), seconds in merged.items():
+                days = self._unflushed.get(ip)
+                if not days or day not in days:
+                    continue
+                days[day][0] -= seconds
+                if days[day][0] <= 1e-9:
+                    del days[day]
+                if not days:
+                    del self._unflushed[ip]
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        return self._buffer.flush(timeout)
+
+    def reset(self):
+        """Forget cached and unflushed usage; flush() before emptying the table, reset() after."""
+        with self._lock:
+            self._unflushed.clear()
+        self._cache.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending_ips = len(self._unflushed)
+        return {"cache": self._cache.stats(), "writer": self._buffer.stats(), "pending_ips": pending_ips,
+                "daily_limit_minutes": self.daily_limit_minutes, "max_days": self.max_days}
+
+
+__all__ = ['DEMO_USAGE_UPSERT', 'DemoUsage', 'DemoState', 'utc_day']
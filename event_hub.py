@@ -0,0 +1,268 @@
+"""
+KELION AI - Server-Sent Events Hub
+==================================
+Push channel replacing client polling (broadcasts, presence, live users).
+
+Events are written to the `events` table in the publisher's transaction
+(see migration 0010), so they are only delivered once committed and every
+worker sees them. Each worker runs one tail thread that reads new rows
+(`id > cursor`) while it has subscribers and fans them out to in-process
+subscriber queues; idle workers issue no queries.
+
+Event ids are the table ids, so a reconnecting EventSource resumes from
+its `Last-Event-ID` by replaying newer rows of its channels. A client
+whose id has already been purged gets a `reset` event and refetches.
+"""
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+hub_logger = logging.getLogger("kelion.events")
+
+# (id, channel, type, data) as read from the events table
+Event = Tuple[int, str, str, Dict]
+
+
+def format_sse(event_id: Optional[int], event_type: str, data) -> bytes:
+    """One SSE frame: `id:`, `event:` and a single-line JSON `data:`."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class Subscription:
+    """A client's channels and its bounded queue of pending events."""
+
+    def __init__(self, channels: Iterable[str], max_queue: int = 256):
+        self.channels = frozenset(channels)
+        self.queue: "queue.Queue[Event]" = queue.Queue(maxsize=max_queue)
+        self.lagged = False   # queue overflowed: the stream ends and the client resumes from the table
+        self.closed = False   # server shutting down: the stream ends and the client reconnects elsewhere
+
+    def offer(self, event: Event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.lagged = True
+
+    def close(self):
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)   # wake the stream now
+        except queue.Full:
+            pass   # it is busy draining events and checks `closed` between them
+
+
+class EventHub:
+    """
+    In-process fan-out fed by tailing the events table.
+
+    `fetch_after(cursor, limit)` returns events with id > cursor in id order;
+    `replay(channels, after_id, limit)` returns a client's missed events;
+    `latest_id()` returns the newest id (the starting cursor);
+    `oldest_id()` returns the oldest retained id (None if empty).
+
+    `reorder_window` re-reads that many ids below the cursor on every poll,
+    for databases whose ids can commit out of order (PostgreSQL sequences);
+    already delivered ids are skipped.
+    """
+
+    def __init__(self, fetch_after: Callable[[int, int], List[Event]],
+                 replay: Callable[[Sequence[str], int, int], List[Event]],
+                 latest_id: Callable[[], int], oldest_id: Callable[[], Optional[int]],
+                 poll_interval: float = 0.5, reorder_window: int = 0,
+                 max_subscribers: int = 100, queue_size: int = 256, batch: int = 500):
+        self._fetch_after = fetch_after
+        self._replay = replay
+        self._latest_id = latest_id
+        self._oldest_id = oldest_id
+        self.poll_interval = poll_interval
+        self.reorder_window = reorder_window
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.batch = batch
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()   # cursor and delivered ids
+        self._subs: List[Subscription] = []
+        self._closed = False
+        self._cursor: Optional[int] = None
+        self._floor: Optional[int] = None
+        self._delivered: Dict[int, None] = {}   # recent ids (insertion ordered), for reorder_window
+        self._thread = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._metrics = {"polls": 0, "delivered": 0, "rejected": 0, "lagged": 0, "replayed": 0, "errors": 0}
+
+    # --- subscribers ---
+
+    def subscribe(self, channels: Iterable[str]) -> Optional[Subscription]:
+        """Register a subscriber; None when the worker is at max_subscribers."""
+        sub = Subscription(channels, self.queue_size)
+        with self._lock:
+            if self._closed or len(self._subs) >= self.max_subscribers:
+                self._metrics["rejected"] += 1
+                return None
+            self._subs.append(sub)
+        self._ensure_tailer()
+        with self._poll_lock:
+            # Start the cursor before the caller replays the backlog, so nothing falls in between
+            if self._cursor is None:
+                self._reset_cursor(self._latest_id())
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            try:
+                self._subs.remove(sub)
+            except ValueError:
+                pass
+
+    def close(self):
+        """Graceful shutdown: end every open stream and refuse new ones. The
+        browsers reconnect (to another worker) with their Last-Event-ID."""
+        with self._lock:
+            self._closed = True
+            subs = list(self._subs)
+        for sub in subs:
+            sub.close()
+
+    def subscribers(self) -> List[Subscription]:
+        with self._lock:
+            return list(self._subs)
+
+    def missed(self, channels: Sequence[str], after_id: int, limit: int = 500) -> Tuple[List[Event], bool]:
+        """(events after `after_id` on `channels`, whether older events were already purged)."""
+        oldest = self._oldest_id()
+        purged = oldest is not None and after_id < oldest - 1
+        events = self._replay(list(channels), after_id, limit)
+        with self._lock:
+            self._metrics["replayed"] += len(events)
+        return events, purged
+
+    # --- tail thread ---
+
+    def _ensure_tailer(self):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="event-hub", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def wake(self):
+        """Poll now (e.g. right after this worker committed an event)."""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            with self._poll_lock:
+                if not self.subscribers():
+                    self._reset_cursor(None)   # restart from "now" when someone subscribes again
+                    continue
+            try:
+                self.poll()
+            except Exception as e:
+                with self._lock:
+                    self._metrics["errors"] += 1
+                hub_logger.error(f"Event tail failed: {e}")
+                time.sleep(self.poll_interval)
+
+    def poll(self) -> int:
+        """Read committed events past the cursor and fan them out; returns how many were delivered."""
+        with self._poll_lock:
+            if self._cursor is None:
+                self._reset_cursor(self._latest_id())
+                return 0
+            return self._poll_locked()
+
+    def _reset_cursor(self, cursor: Optional[int]):
+        self._cursor = cursor
+        self._floor = cursor   # ids up to here predate the subscribers: never delivered live
+        self._delivered = {}
+
+    def _poll_locked(self) -> int:
+        start = max(0, self._cursor - self.reorder_window)
+        events = self._fetch_after(start, self.batch)
+        with self._lock:
+            self._metrics["polls"] += 1
+        delivered = 0
+        for event in events:
+            event_id = event[0]
+            if event_id <= self._floor or event_id in self._delivered:
+                continue
+            self._delivered[event_id] = None
+            self._cursor = max(self._cursor, event_id)
+            self.publish_local(event)
+            delivered += 1
+        while len(self._delivered) > max(self.reorder_window * 2, self.batch):
+            self._delivered.pop(next(iter(self._delivered)))
+        return delivered
+
+    def publish_local(self, event: Event):
+        channel = event[1]
+        for sub in self.subscribers():
+            if channel in sub.channels:
+                was_lagged = sub.lagged
+                sub.offer(event)
+                with self._lock:
+                    self._metrics["delivered"] += 1
+                    if sub.lagged and not was_lagged:
+                        self._metrics["lagged"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._metrics, subscribers=len(self._subs), cursor=self._cursor, closed=self._closed,
+                        distinct_users=len({c for s in self._subs for c in s.channels if c.startswith("user:")}))
+
+
+def sse_stream(hub: EventHub, sub: Subscription, backlog: List[Event], reset: bool,
+               heartbeat: float = 15.0, max_duration: float = 300.0, retry_ms: int = 3000) -> Iterator[bytes]:
+    """
+    Response body for one EventSource connection.
+
+    Sends the replayed backlog, then live events and a comment line every
+    `heartbeat` seconds (keeps proxies from closing an idle stream). Ends
+    after `max_duration` or when the subscriber lagged; the browser then
+    reconnects with Last-Event-ID.
+    """
+    deadline = time.monotonic() + max_duration
+    sent = set()
+    try:
+        yield f"retry: {retry_ms}\n\n".encode("utf-8")
+        if reset:
+            yield format_sse(None, "reset", {})
+        for event_id, _, event_type, data in backlog:
+            sent.add(event_id)
+            yield format_sse(event_id, event_type, data)
+        while not sub.lagged and not sub.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = sub.queue.get(timeout=min(heartbeat, remaining))
+            except queue.Empty:
+                yield b": heartbeat\n\n"
+                continue
+            if event is None:   # closed
+                return
+            event_id, _, event_type, data = event
+            if event_id in sent:   # already replayed from the backlog
+                continue
+            yield format_sse(event_id, event_type, data)
+    finally:
+        hub.unsubscribe(sub)
+
+
+__all__ = ['EventHub', 'Subscription', 'format_sse', 'sse_stream']
@@ -15,15 +15,19 @@ Punctele 17-25 din todo_x.md:
 
 import os
 import json
-import requests
 from datetime import datetime, timezone
 from typing import Optional, Dict, List, Any
 from abc import ABC, abstractmethod
 
+from provider_client import get_provider_client
+
 # Base paths
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
 
+# Conexiuni keep-alive reutilizate per furnizor (vezi provider_client.py)
+provider_http = get_provider_client()
+
 
 # ============================================================================
 # 17. WEB SEARCH
@@ -64,7 +68,7 @@ class WebSearchEngine:
                 "no_html": 1,
                 "skip_disambig": 1
             }
-            response = requests.get(
+            response = provider_http.get(
                 "https://api.duckduckgo.com/",
                 params=params,
                 timeout=10
@@ -112,7 +116,7 @@ class WebSearchEngine:
                 "num": num_results
             }
             
-            response = requests.post(
+            response = provider_http.post(
                 "https://google.serper.dev/search",
                 headers=headers,
                 json=payload,
@@ -178,9 +182,10 @@ class IoTController:
     def _discover_hue_devices(self):
         """Descoperă lămpi Philips Hue."""
         try:
-            response = requests.get(
+            response = provider_http.get(
                 f"http://{self.hue_bridge_ip}/api/{self.hue_api_key}/lights",
-                timeout=5
+                timeout=5,
+                retries=0  # dispozitive din rețeaua locală: eșuează imediat
             )
             lights = response.json()
             
@@ -202,10 +207,11 @@ class IoTController:
                 "Authorization": f"Bearer {self.home_assistant_token}",
                 "Content-Type": "application/json"
             }
-            response = requests.get(
+            response = provider_http.get(
                 f"{self.home_assistant_url}/api/states",
                 headers=headers,
-                timeout=5
+                timeout=5,
+                retries=0  # dispozitive din rețeaua locală: eșuează imediat
             )
             states = response.json()
             
@@ -277,10 +283,11 @@ class IoTController:
                 state["sat"] = 254
         
         try:
-            response = requests.put(
+            response = provider_http.put(
                 f"http://{self.hue_bridge_ip}/api/{self.hue_api_key}/lights/{light_id}/state",
                 json=state,
-                timeout=5
+                timeout=5,
+                retries=0  # dispozitive din rețeaua locală: eșuează imediat
             )
             return {"success": True, "response": response.json()}
         except Exception as e:
@@ -299,11 +306,12 @@ class IoTController:
             payload = {"entity_id": entity_id}
             payload.update(params)
             
-            response = requests.post(
+            response = provider_http.post(
                 f"{self.home_assistant_url}/api/services/{domain}/{service}",
                 headers=headers,
                 json=payload,
-                timeout=5
+                timeout=5,
+                retries=0  # dispozitive din rețeaua locală: eșuează imediat
             )
             return {"success": True}
         except Exception as e:
@@ -397,7 +405,7 @@ class FinancialGuardian:
     def get_crypto_price(self, symbol: str) -> Dict:
         """Obține prețul unei criptomonede."""
         try:
-            response = requests.get(
+            response = provider_http.get(
                 f"https://api.coingecko.com/api/v3/simple/price",
                 params={
                     "ids": symbol.lower(),
@@ -691,7 +699,7 @@ Răspunde exact cum ar răspunde această persoană."""
         }
         
         try:
-            response = requests.post(
+            response = provider_http.post(
                 "https://api.anthropic.com/v1/messages",
                 headers=headers,
                 json=payload,
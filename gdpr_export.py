@@ -0,0 +1,259 @@
+"""
+KELION AI - Streaming GDPR Export
+=================================
+Exports a user's data (GDPR Article 20) in constant memory.
+
+Rows are read in fixed-size batches (a server-side cursor on PostgreSQL,
+incremental `fetchmany` on SQLite) inside one read snapshot and written
+out as they arrive:
+
+- ndjson_stream(): one JSON object per line, `{"table": ..., "row": {...}}`
+- zip_stream():    a zip with one NDJSON file per table, built on the fly
+- ExportJobs:      writes the zip to disk in the background and hands back
+                   a download token, for accounts too large to stream
+                   within a request timeout.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import secrets
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+export_logger = logging.getLogger("kelion.gdpr_export")
+
+SQLITE = "sqlite"
+POSTGRES = "postgres"
+
+# (table in the export, query); every query takes the user_id as its only parameter
+EXPORT_QUERIES = (
+    ("user", "SELECT * FROM users WHERE user_id = ?"),
+    ("summary", "SELECT * FROM summaries WHERE user_id = ?"),
+    ("feedback", "SELECT * FROM feedback WHERE user_id = ? ORDER BY ts"),
+    ("broadcast_receipts", "SELECT broadcast_id, confirmed_at FROM broadcast_receipts WHERE user_id = ? ORDER BY confirmed_at"),
+    ("token_usage", "SELECT period, input_tokens, output_tokens, cost_usd, requests FROM token_usage "
+                    "WHERE user_id = ? ORDER BY period"),
+    ("messages", "SELECT id, user_id, session_id, role, content, created_at, meta_json FROM messages "
+                 "WHERE user_id = ? ORDER BY created_at"),
+)
+
+
+def _stream_rows(con, sql: str, params: tuple, batch_size: int):
+    """Batches of rows: server-side cursor when the connection supports it."""
+    if hasattr(con, "stream"):
+        yield from con.stream(sql, params, batch_size=batch_size)
+        return
+    cur = con.execute(sql, params)
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def _clean(table: str, row: Dict) -> Dict:
+    if table == "user":
+        try:
+            profile = json.loads(row.get("profile_json") or "{}")
+            profile.pop("password_hash", None)
+            row["profile_json"] = json.dumps(profile)
+        except (TypeError, ValueError):
+            pass
+    return row
+
+
+def iter_export_records(connect: Callable, dialect: str, user_id: str,
+                        batch_size: int = 500) -> Iterator[Tuple[str, Dict]]:
+    """Yield (table, row) pairs for every exported row, from one read snapshot."""
+    with connect() as con:
+        if dialect == POSTGRES:
+            con.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        else:
+            if getattr(con, "in_transaction", False):
+                con.commit()
+            con.execute("BEGIN")
+        for table, sql in EXPORT_QUERIES:
+            for batch in _stream_rows(con, sql, (user_id,), batch_size):
+                for row in batch:
+                    yield table, _clean(table, dict(row))
+
+
+def _dumps(obj) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def ndjson_stream(connect: Callable, dialect: str, user_id: str, exported_at: str,
+                  batch_size: int = 500) -> Iterator[bytes]:
+    yield _dumps({"table": "export", "row": {"user_id": user_id, "exported_at": exported_at}})
+    chunk = []
+    for table, row in iter_export_records(connect, dialect, user_id, batch_size):
+        chunk.append(_dumps({"table": table, "row": row}))
+        if len(chunk) >= batch_size:
+            yield b"".join(chunk)
+            chunk = []
+    if chunk:
+        yield b"".join(chunk)
+
+
+class _Sink:
+    """Write-only, unseekable file object; zipfile then emits data descriptors."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def zip_stream(connect: Callable, dialect: str, user_id: str, exported_at: str,
+               batch_size: int = 500) -> Iterator[bytes]:
+    """Zip of `<table>.ndjson` files, yielded as it is compressed."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("export.json", json.dumps({"user_id": user_id, "exported_at": exported_at}))
+        current, member, pending = None, None, 0
+        for table, row in iter_export_records(connect, dialect, user_id, batch_size):
+            if table != current:
+                if member is not None:
+                    member.close()
+                member = zf.open(f"{table}.ndjson", mode="w", force_zip64=True)
+                current = table
+            member.write(_dumps(row))
+            pending += 1
+            if pending >= batch_size:
+                pending = 0
+                data = sink.drain()
+                if data:
+                    yield data
+        if member is not None:
+            member.close()
+    yield sink.drain()
+
+
+# ============================================================================
+# ASYNC EXPORT JOBS
+# ============================================================================
+
+class ExportJobs:
+    """
+    Background exports written to `directory` as `<token>.zip`.
+
+    Job state lives next to the archive (`<token>.json`), so any worker
+    sharing the directory can serve the download. Archives are removed
+    `ttl` seconds after creation.
+    """
+
+    def __init__(self, directory: str, connect: Callable, dialect: str,
+                 ttl: float = 24 * 3600, max_workers: int = 2, batch_size: int = 500):
+        self.directory = directory
+        self._connect = connect
+        self.dialect = dialect
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                    thread_name_prefix="gdpr-export")
+                self._pid = os.getpid()
+            return self._executor
+
+    def _meta_path(self, token: str) -> str:
+        return os.path.join(self.directory, f"{token}.json")
+
+    def archive_path(self, token: str) -> str:
+        return os.path.join(self.directory, f"{token}.zip")
+
+    def _write_meta(self, token: str, meta: Dict):
+        tmp = self._meta_path(token) + f".{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path(token))
+
+    def status(self, token: str) -> Optional[Dict]:
+        if not token or not token.replace("-", "").replace("_", "").isalnum():
+            return None
+        try:
+            with open(self._meta_path(token), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() > meta.get("expires_at", 0):
+            self._remove(token)
+            return None
+        return meta
+
+    def submit(self, user_id: str, exported_at: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        self.purge_expired()
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        self._write_meta(token, {"user_id": user_id, "status": "pending", "created_at": now,
+                                 "expires_at": now + self.ttl})
+        self._pool().submit(self._run, token, user_id, exported_at)
+        return token
+
+    def _run(self, token: str, user_id: str, exported_at: str):
+        meta = self.status(token) or {"user_id": user_id, "created_at": time.time(),
+                                      "expires_at": time.time() + self.ttl}
+        tmp = self.archive_path(token) + ".part"
+        try:
+            with open(tmp, "wb") as f:
+                for data in zip_stream(self._connect, self.dialect, user_id, exported_at, self.batch_size):
+                    f.write(data)
+            os.replace(tmp, self.archive_path(token))
+            meta.update(status="ready", size=os.path.getsize(self.archive_path(token)))
+        except Exception as e:
+            export_logger.error(f"GDPR export {token[:8]} failed: {e}")
+            meta.update(status="failed", error=str(e)[:200])
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        self._write_meta(token, meta)
+
+    def _remove(self, token: str):
+        for path in (self._meta_path(token), self.archive_path(token)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def purge_expired(self) -> int:
+        removed = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return 0
+        for name in names:
+            if name.endswith(".json") and self.status(name[:-5]) is None:
+                removed += 1
+        return removed
+
+
+__all__ = [
+    'EXPORT_QUERIES',
+    'iter_export_records',
+    'ndjson_stream',
+    'zip_stream',
+    'ExportJobs',
+]
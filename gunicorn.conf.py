@@ -0,0 +1,85 @@
+"""
+KELION AI - Gunicorn Configuration
+==================================
+Production entrypoint: `gunicorn app:app` (gunicorn reads this file from
+the working directory).
+
+gthread workers: a request spends most of its time waiting on LLM / TTS /
+STT upstreams (60-180 s), so threads absorb the concurrency inside each
+worker and worker processes scale with the cores. An /api/events stream
+holds a thread for its whole life (K1_EVENTS_STREAM_SECONDS), so the app
+lets at most half of a worker's threads stream (K1_EVENTS_MAX_STREAMS is
+capped to K1_WEB_THREADS / 2) and answers further streams with 503; raise
+K1_WEB_THREADS to serve more open tabs per worker.
+
+The app is imported once in the master (preload_app) and forked. With
+K1_PREFORK set nothing starts a thread at import; the hooks below drive the
+per-worker lifecycle instead:
+- post_worker_init: app.start_worker() (AutoPilot, periodic jobs, the
+  password pool; memory / usage files re-read after the fork).
+- SIGTERM: app.begin_drain() (health fails, new chats and event streams get
+  503, open streams end), then gunicorn's own graceful shutdown waits up to
+  graceful_timeout for the in-flight requests.
+- worker_exit: app.stop_worker() (jobs stopped, write-behind buffers flushed).
+
+Environment:
+  PORT                     listen port (default 8080)
+  K1_WEB_WORKERS           worker processes (default: CPU count)
+  K1_WEB_THREADS           threads per worker (default 16)
+  K1_WEB_TIMEOUT           seconds a silent worker lives before it is killed (default 240)
+  K1_WEB_GRACEFUL_TIMEOUT  seconds in-flight requests get on shutdown (default 120)
+  K1_WEB_KEEPALIVE         keep-alive seconds (default 5)
+  K1_WEB_MAX_REQUESTS      recycle a worker after this many requests (default 0 = never)
+  K1_WEB_PRELOAD           import the app once in the master (default true)
+"""
+
+import os
+import signal
+
+# Read by app.py / super_ai_routes.py at import: background threads start in post_worker_init
+os.environ.setdefault("K1_PREFORK", "true")
+# Per-process limits would multiply by the worker count (see rate_limiter.py)
+os.environ.setdefault("K1_RATE_LIMIT_BACKEND", "sqlite")
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+worker_class = "gthread"
+workers = int(os.getenv("K1_WEB_WORKERS", "0")) or (os.cpu_count() or 1)
+# The app sizes per-worker pools from it (password hashing: CPU count / workers)
+os.environ["K1_WEB_WORKERS"] = str(workers)
+threads = int(os.getenv("K1_WEB_THREADS", "16"))
+# The app caps its event streams per worker from it (half the threads, see app.py)
+os.environ["K1_WEB_THREADS"] = str(threads)
+timeout = int(os.getenv("K1_WEB_TIMEOUT", "240"))
+graceful_timeout = int(os.getenv("K1_WEB_GRACEFUL_TIMEOUT", "120"))
+keepalive = int(os.getenv("K1_WEB_KEEPALIVE", "5"))
+max_requests = int(os.getenv("K1_WEB_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+preload_app = os.getenv("K1_WEB_PRELOAD", "true").lower() == "true"
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("K1_WEB_LOG_LEVEL", "info")
+
+
+def _kelion():
+    # Imported by the master with preload_app, else by the worker before post_worker_init
+    import app
+    return app
+
+
+def post_worker_init(worker):
+    kelion = _kelion()
+    kelion.start_worker()
+
+    # The worker's SIGTERM handler only stops the accept loop; start the app's drain with it
+    stop_accepting = signal.getsignal(signal.SIGTERM)
+
+    def drain(signum, frame):
+        kelion.begin_drain()
+        if callable(stop_accepting):
+            stop_accepting(signum, frame)
+
+    signal.signal(signal.SIGTERM, drain)
+
+
+def worker_exit(server, worker):
+    _kelion().stop_worker()
@@ -0,0 +1,104 @@
+"""
+KELION AI - Conversation Search
+===============================
+Ranked full-text search over messages.content (see migrations 0006, 0014):
+
+- SQLite: FTS5 `messages_fts` keyed on messages.seq (bm25 rank, snippet()).
+- PostgreSQL: GIN-indexed `content_tsv` (ts_rank_cd, ts_headline),
+  queried with websearch_to_tsquery.
+
+Both accept the same filters (user, session, role, created_at range) and
+return the same result shape. Matches are marked with SNIPPET_START /
+SNIPPET_END in the snippet.
+"""
+
+import re
+from typing import Dict, List, Optional
+
+SQLITE = "sqlite"
+POSTGRES = "postgres"
+
+SNIPPET_START = "["
+SNIPPET_END = "]"
+SNIPPET_TOKENS = 16
+
+_TOKEN = re.compile(r"[\w']+\*?", re.UNICODE)
+
+
+def fts5_query(text: str) -> str:
+    """User text -> FTS5 MATCH expression: every word must appear, `word*` is a prefix match.
+
+    Words are quoted, so FTS5 operators and punctuation in user input can't
+    cause syntax errors.
+    """
+    terms = []
+    for token in _TOKEN.findall(text or ""):
+        prefix = token.endswith("*")
+        word = token.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def _filters(user_id, session_id, role, since, until, alias: str):
+    where, params = [], []
+    for column, value in (("user_id", user_id), ("session_id", session_id), ("role", role)):
+        if value:
+            where.append(f"{alias}{column} = ?")
+            params.append(value)
+    if since:
+        where.append(f"{alias}created_at >= ?")
+        params.append(since)
+    if until:
+        where.append(f"{alias}created_at < ?")
+        params.append(until)
+    return where, params
+
+
+def search_messages(con, dialect: str, query: str, user_id: Optional[str] = None,
+                    session_id: Optional[str] = None, role: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None,
+                    limit: int = 50, offset: int = 0) -> List[Dict]:
+    """Best matches first: [{id, user_id, session_id, role, created_at, snippet, rank}]."""
+    if dialect == POSTGRES:
+        if not (query or "").strip():
+            return []
+        where, params = _filters(user_id, session_id, role, since, until, "m.")
+        sql = (
+            "SELECT m.id, m.user_id, m.session_id, m.role, m.created_at, "
+            "ts_headline('simple', m.content, q, ?) AS snippet, ts_rank_cd(m.content_tsv, q) AS rank "
+            "FROM messages m, websearch_to_tsquery('simple', ?) q "
+            "WHERE m.content_tsv @@ q" + "".join(f" AND {w}" for w in where) +
+            " ORDER BY rank DESC, m.created_at DESC LIMIT ? OFFSET ?"
+        )
+        options = f"StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxWords={SNIPPET_TOKENS}, MinWords=5"
+        rows = con.execute(sql, (options, query, *params, limit, offset)).fetchall()
+        rank_sign = 1.0
+    else:
+        match = fts5_query(query)
+        if not match:
+            return []
+        where, params = _filters(user_id, session_id, role, since, until, "m.")
+        sql = (
+            "SELECT m.id, m.user_id, m.session_id, m.role, m.created_at, "
+            f"snippet(messages_fts, 0, ?, ?, '...', {SNIPPET_TOKENS}) AS snippet, "
+            "bm25(messages_fts) AS rank "
+            "FROM messages_fts JOIN messages m ON m.seq = messages_fts.rowid "
+            "WHERE messages_fts MATCH ?" + "".join(f" AND {w}" for w in where) +
+            " ORDER BY rank, m.created_at DESC LIMIT ? OFFSET ?"
+        )
+        rows = con.execute(sql, (SNIPPET_START, SNIPPET_END, match, *params, limit, offset)).fetchall()
+        rank_sign = -1.0  # bm25: lower is better; report higher-is-better like ts_rank
+
+    return [{
+        "id": r["id"],
+        "user_id": r["user_id"],
+        "session_id": r["session_id"],
+        "role": r["role"],
+        "created_at": r["created_at"],
+        "snippet": r["snippet"],
+        "rank": round(rank_sign * float(r["rank"]), 6),
+    } for r in rows]
+
+
+__all__ = ['search_messages', 'fts5_query', 'SNIPPET_START', 'SNIPPET_END']
@@ -0,0 +1,262 @@
+"""
+KELION AI - Password Hashing Pool
+=================================
+bcrypt work off the request threads.
+
+Hashes and verifications run in a process pool (a 12-round bcrypt is
+~250 ms of CPU, and the legacy pbkdf2 / stretched sha256 checks hold the
+GIL), by default the host's CPU count divided among the web workers. Pool
+processes come from a forkserver, so they are safe to (re)start while the
+worker runs threads. At most `workers + max_queue` operations are admitted;
+past that `PasswordHasherBusy` is raised at once, so a login burst gets
+fast 503s instead of pinning every request thread.
+
+Stored formats understood by `check_password`:
+- bcrypt:            `$2b$...` (app.py) or `bcrypt$$2b$...` (security_core)
+- pbkdf2:            `pbkdf2$<salt>$<hex>` (security_core, 100k iterations)
+- sha256_stretched:  `sha256_stretched$<salt>$<hex>` (security_core)
+- sha256:            `sha256$<salt>$<hex>` (app.py: sha256(password + salt);
+                     security_core: sha256(salt + ":" + password))
+Anything but bcrypt at the current cost reports `needs_rehash`.
+"""
+
+import os
+import sys
+import time
+import types
+import hashlib
+import logging
+import secrets
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+
+try:
+    import bcrypt
+    HAVE_BCRYPT = True
+except ImportError:
+    HAVE_BCRYPT = False
+
+hashing_logger = logging.getLogger("kelion.passwords")
+
+DEFAULT_ROUNDS = 12
+PBKDF2_ITERATIONS = 100000
+STRETCH_ROUNDS = 10000
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Raised when the hashing pool is saturated; callers answer 503."""
+
+
+# ============================================================================
+# PURE FUNCTIONS (run inside the pool processes)
+# ============================================================================
+
+def hash_password_sync(password: str, rounds: int = DEFAULT_ROUNDS) -> str:
+    if HAVE_BCRYPT:
+        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), PBKDF2_ITERATIONS)
+    return f"pbkdf2${salt}${digest.hex()}"
+
+
+def _bcrypt_rounds(hashed: str) -> int:
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+def check_password(password: str, stored: str, rounds: int = DEFAULT_ROUNDS) -> Tuple[bool, bool]:
+    """(matches, needs_rehash) for any supported stored format."""
+    if not password or not stored:
+        return False, False
+    try:
+        if stored.startswith("bcrypt$"):
+            stored, legacy_prefix = stored[len("bcrypt$"):], True
+        else:
+            legacy_prefix = False
+        if stored.startswith("$2"):
+            if not HAVE_BCRYPT:
+                return False, False
+            ok = bcrypt.checkpw(password.encode("utf-8"), stored.encode("utf-8"))
+            return ok, ok and (legacy_prefix or _bcrypt_rounds(stored) < rounds)
+
+        method, _, rest = stored.partition("$")
+        salt, _, expected = rest.partition("$")
+        if not salt or not expected:
+            return False, False
+        if method == "pbkdf2":
+            computed = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"),
+                                           PBKDF2_ITERATIONS).hex()
+            ok = secrets.compare_digest(computed, expected)
+        elif method == "sha256_stretched":
+            computed = hashlib.sha256(password.encode("utf-8") + salt.encode("utf-8")).hexdigest()
+            for _ in range(STRETCH_ROUNDS):
+                computed = hashlib.sha256(computed.encode("utf-8")).hexdigest()
+            ok = secrets.compare_digest(computed, expected)
+        elif method == "sha256":
+            ok = any(secrets.compare_digest(hashlib.sha256(candidate.encode("utf-8")).hexdigest(), expected)
+                     for candidate in (password + salt, f"{salt}:{password}"))
+        else:
+            return False, False
+        # Always upgrade non-bcrypt hashes (when bcrypt is available to upgrade to)
+        return ok, ok and HAVE_BCRYPT
+    except Exception as e:
+        hashing_logger.error(f"Password verification error: {e}")
+        return False, False
+
+
+# ============================================================================
+# POOL
+# ============================================================================
+
+def _pool_context():
+    """forkserver where available: pool processes fork from a single-threaded
+    server process, never from a worker whose other threads (periodic jobs,
+    AutoPilot, request threads) may hold locks the child would inherit held.
+    The server preloads only this module. Elsewhere (Windows) spawn."""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+# Stand-in `__main__` while pool processes start: a forkserver / spawn child
+# re-imports the parent's main module, which under `python app.py` is the
+# whole app (database migration, background threads). With this empty entry
+# module the child imports nothing but what the pickled calls need.
+_ENTRY_MODULE = types.ModuleType("__main__")
+_ENTRY_MODULE.__spec__ = None
+
+
+class _HashingPoolExecutor(ProcessPoolExecutor):
+    def _spawn_process(self):
+        # Called with the executor's lock held, from submit() or the pool's manager thread
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = _ENTRY_MODULE
+        try:
+            super()._spawn_process()
+        finally:
+            sys.modules["__main__"] = main
+
+
+def default_pool_size() -> int:
+    """CPU count shared by the web workers on the host (K1_WEB_WORKERS), at least 1."""
+    web_workers = max(1, int(os.getenv("K1_WEB_WORKERS", "0") or 0) or 1)
+    return max(1, (os.cpu_count() or 1) // web_workers)
+
+
+def _noop():
+    return None
+
+
+class PasswordHasher:
+    """
+    Bounded pool for hash / verify.
+
+    `workers=0` runs the work on the calling thread (still bounded by the
+    same admission limit), e.g. where processes can't be spawned.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue: int = 32,
+                 timeout: float = 10.0, rounds: int = DEFAULT_ROUNDS):
+        self.workers = default_pool_size() if workers is None else workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1) + max_queue)
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid = None
+        self._in_flight = 0
+        self._latency = {"hash": deque(maxlen=512), "verify": deque(maxlen=512)}
+        self._metrics = {"hash": 0, "verify": 0, "rehash": 0, "rejected": 0, "errors": 0, "peak_in_flight": 0}
+
+    def _pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # A pool inherited through fork has no live processes in this worker
+                self._executor = _HashingPoolExecutor(max_workers=self.workers, mp_context=_pool_context())
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, op: str, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._metrics["rejected"] += 1
+            raise PasswordHasherBusy("Password hashing is saturated")
+        start = time.perf_counter()
+        with self._lock:
+            self._in_flight += 1
+            self._metrics["peak_in_flight"] = max(self._metrics["peak_in_flight"], self._in_flight)
+        try:
+            pool = self._pool()
+            if pool is None:
+                return fn(*args)
+            return pool.submit(fn, *args).result(timeout=self.timeout)
+        except Exception as e:
+            with self._lock:
+                self._metrics["errors"] += 1
+                if isinstance(e, BrokenProcessPool) and self._executor is pool:
+                    self._executor = None   # a child died: start a fresh pool next time
+            raise
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._in_flight -= 1
+                self._metrics[op] += 1
+                self._latency[op].append(elapsed)
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        return self._run("hash", hash_password_sync, password, self.rounds)
+
+    def check(self, password: str, stored: str) -> Tuple[bool, bool]:
+        """(matches, needs_rehash); see check_password."""
+        return self._run("verify", check_password, password, stored, self.rounds)
+
+    def verify(self, password: str, stored: str) -> bool:
+        return self.check(password, stored)[0]
+
+    def warm(self):
+        """Start the pool processes now instead of on the first logins."""
+        pool = self._pool()
+        if pool is not None:
+            for future in [pool.submit(_noop) for _ in range(self.workers)]:
+                future.result(timeout=self.timeout)
+
+    def record_rehash(self):
+        with self._lock:
+            self._metrics["rehash"] += 1
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            out = dict(self._metrics, workers=self.workers, max_queue=self.max_queue,
+                       in_flight=self._in_flight, queued=max(0, self._in_flight - max(self.workers, 1)))
+            for op, samples in self._latency.items():
+                ordered = sorted(samples)
+                out[f"{op}_ms_avg"] = round(sum(ordered) / len(ordered), 1) if ordered else None
+                out[f"{op}_ms_p95"] = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1) if ordered else None
+        return out
+
+
+__all__ = [
+    'PasswordHasher',
+    'PasswordHasherBusy',
+    'hash_password_sync',
+    'check_password',
+    'default_pool_size',
+]
@@ -0,0 +1,116 @@
+"""
+KELION AI - Periodic Background Jobs
+====================================
+Small interval scheduler for maintenance work (counter reconciliation,
+retention purges, ...). Each job runs on its own daemon thread.
+
+Jobs are fork-aware: `ensure_running()` is cheap (a pid comparison) and
+restarts the thread in a forked worker, whose copy of the parent's thread
+does not exist.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from typing import Callable, Dict, List
+
+periodic_logger = logging.getLogger("kelion.periodic")
+
+
+class PeriodicJob:
+    """Run `fn()` every `interval` seconds (plus up to `jitter` seconds) on a daemon thread."""
+
+    def __init__(self, name: str, fn: Callable[[], object], interval: float,
+                 jitter: float = 0.0, run_at_start: bool = False):
+        self.name = name
+        self._fn = fn
+        self.interval = interval
+        self.jitter = jitter
+        self.run_at_start = run_at_start
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._metrics = {"runs": 0, "failures": 0, "last_run": None, "last_error": None, "last_duration_ms": None}
+
+    def _delay(self) -> float:
+        return self.interval + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _loop(self):
+        if not self.run_at_start:
+            self._wake.wait(self._delay())
+        while not self._stop.is_set():
+            self._wake.clear()
+            self.run_now()
+            self._wake.wait(self._delay())
+
+    def run_now(self):
+        """Run the job on the calling thread (errors are logged, not raised)."""
+        start = time.monotonic()
+        try:
+            result = self._fn()
+            ok, error = True, None
+        except Exception as e:
+            result, ok, error = None, False, str(e)[:200]
+            periodic_logger.error(f"[{self.name}] failed: {e}")
+        with self._lock:
+            m = self._metrics
+            m["runs"] += 1
+            if not ok:
+                m["failures"] += 1
+            m["last_error"] = error
+            m["last_run"] = time.time()
+            m["last_duration_ms"] = round((time.monotonic() - start) * 1000, 1)
+        return result
+
+    def ensure_running(self):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name=f"job-{self.name}", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def wake(self):
+        """Run as soon as possible instead of waiting for the interval."""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._metrics, interval=self.interval,
+                        running=self._thread is not None and self._thread.is_alive() and self._pid == os.getpid())
+
+
+_jobs: List[PeriodicJob] = []
+
+
+def register(job: PeriodicJob) -> PeriodicJob:
+    _jobs.append(job)
+    return job
+
+
+def ensure_all_running():
+    for job in _jobs:
+        job.ensure_running()
+
+
+def stop_all():
+    for job in _jobs:
+        job.stop()
+
+
+def all_stats() -> Dict[str, Dict]:
+    return {job.name: job.stats() for job in _jobs}
+
+
+__all__ = ['PeriodicJob', 'register', 'ensure_all_running', 'stop_all', 'all_stats']
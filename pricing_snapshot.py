@@ -0,0 +1,93 @@
+"""
+KELION AI - Pricing Snapshot
+============================
+Public pricing (/pricing, /api/pricing, /api/plans) served from memory.
+
+The tiers are loaded once, serialized once and hashed into a strong ETag.
+create_tier / update_tier / delete_tier bump the version, so the next
+request rebuilds; the snapshot also expires after `ttl` seconds, so other
+worker processes pick up changes they did not see invalidated. Landing-page
+loads in between cost no database work, and a client revalidating with
+If-None-Match gets a 304 without a body.
+"""
+
+import json
+import time
+import hashlib
+import threading
+from typing import Callable, Dict, NamedTuple, Optional
+
+
+class Snapshot(NamedTuple):
+    body: bytes
+    etag: str       # quoted strong validator: content hash, identical across workers
+    version: int
+
+
+def etag_for(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses the weak comparison: W/ prefixes are ignored."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+class PricingSnapshot:
+    """Versioned, TTL-bounded cache of one serialized pricing payload."""
+
+    def __init__(self, load: Callable[[], Dict], ttl: float = 60.0):
+        self._load = load
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._version = 0
+        self._snapshot: Optional[Snapshot] = None
+        self._expires_at = 0.0
+        self._metrics = {"hits": 0, "builds": 0}
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self):
+        """Bump the version; the next get() rebuilds. Call after the tier change committed."""
+        with self._lock:
+            self._version += 1
+            self._snapshot = None
+
+    def get(self) -> Snapshot:
+        snap = self._snapshot
+        if snap is not None and snap.version == self._version and time.monotonic() < self._expires_at:
+            self._metrics["hits"] += 1
+            return snap
+        # One rebuild at a time: concurrent misses wait and reuse it
+        with self._lock:
+            snap = self._snapshot
+            if snap is not None and snap.version == self._version and time.monotonic() < self._expires_at:
+                self._metrics["hits"] += 1
+                return snap
+            version = self._version
+            body = json.dumps(self._load(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            snap = Snapshot(body, etag_for(body), version)
+            self._snapshot = snap
+            self._expires_at = time.monotonic() + self.ttl
+            self._metrics["builds"] += 1
+            return snap
+
+    def stats(self) -> Dict:
+        snap = self._snapshot
+        return dict(self._metrics, version=self._version, etag=snap.etag if snap else None)
+
+
+__all__ = ['PricingSnapshot', 'Snapshot', 'etag_for', 'etag_matches']
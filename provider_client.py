@@ -0,0 +1,305 @@
+"""
+KELION AI - Provider HTTP Client
+================================
+One pooled HTTP client for every upstream provider (OpenAI, DeepSeek,
+Anthropic, ElevenLabs, Deepgram, search, prices, IoT bridges).
+
+- Keep-alive: one requests.Session per host (scheme://host:port), each with
+  a connection pool of `pool_size` connections, so calls reuse warm TCP+TLS
+  connections instead of handshaking every time. Size the pool to the
+  worker's thread count; callers beyond it open a one-off connection.
+- Pre-warming: `warm(urls)` opens connections to the given hosts ahead of
+  the first request (app.start_worker does it in the background).
+- Timeouts: a short connect timeout and the caller's read timeout, so an
+  unreachable host fails in seconds while a slow answer may take minutes.
+- Retries: up to `retries` more attempts on 429 / 5xx answers and on
+  connection failures, waiting a full-jitter exponential backoff
+  (random 0..backoff * 2**attempt, capped) or the server's Retry-After.
+  A Retry-After above `backoff_max` is not waited for: the answer is
+  returned as is. Read timeouts are not retried (the provider may still
+  be working on, and billing, the call). After the last attempt the
+  response is returned, so callers keep using raise_for_status().
+- Metrics per host: requests, attempts, retries, errors, status classes,
+  connections opened and latency (mean, p50 / p95 / max of the recent calls).
+- Fork-aware: a child process starts with its own sessions and metrics,
+  never the parent's sockets.
+
+Configuration (read on first use of get_provider_client):
+  K1_HTTP_POOL_SIZE        connections kept per host (default: K1_WEB_THREADS or 16)
+  K1_HTTP_CONNECT_TIMEOUT  seconds (default 5)
+  K1_HTTP_READ_TIMEOUT     seconds when the caller gives none (default 60)
+  K1_HTTP_RETRIES          extra attempts on 429 / 5xx / connection errors (default 2)
+  K1_HTTP_BACKOFF          base backoff seconds (default 0.5)
+  K1_HTTP_BACKOFF_MAX      longest single wait, also the Retry-After cap (default 8)
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from http.cookiejar import DefaultCookiePolicy
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+http_logger = logging.getLogger("kelion.http")
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+LATENCY_SAMPLES = 200
+
+Timeout = Union[None, float, Tuple[float, float]]
+
+
+def host_key(url: str) -> str:
+    """'https://api.openai.com/v1/x' -> 'https://api.openai.com'; the unit of pooling and metrics."""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Retry-After in seconds, if the header is given as seconds."""
+    value = response.headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _HostStats:
+    def __init__(self):
+        self.counts = {"requests": 0, "attempts": 0, "retries": 0, "errors": 0,
+                       "2xx": 0, "3xx": 0, "4xx": 0, "5xx": 0}
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.recent = deque(maxlen=LATENCY_SAMPLES)
+
+    def snapshot(self) -> Dict:
+        out = dict(self.counts)
+        ordered = sorted(self.recent)
+        done = self.counts["requests"]
+        out["latency_ms"] = {
+            "mean": round(self.latency_total / done * 1000, 1) if done else None,
+            "p50": round(ordered[len(ordered) // 2] * 1000, 1) if ordered else None,
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1) if ordered else None,
+            "max": round(self.latency_max * 1000, 1),
+        }
+        return out
+
+
+class ProviderClient:
+    """Per-host keep-alive sessions with timeouts, retries and metrics."""
+
+    def __init__(self, pool_size: int = 16, connect_timeout: float = 5.0, read_timeout: float = 60.0,
+                 retries: int = 2, backoff: float = 0.5, backoff_max: float = 8.0,
+                 sleep: Callable[[float], None] = time.sleep):
+        if pool_size < 1 or retries < 0:
+            raise ValueError("pool_size must be >= 1 and retries >= 0")
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, requests.Session] = {}
+        self._stats: Dict[str, _HostStats] = {}
+        self._pid = os.getpid()
+
+    # --- sessions ---
+
+    def _check_fork(self):
+        # Caller holds self._lock. The parent's pooled sockets are not ours to use
+        if self._pid != os.getpid():
+            self._sessions = {}
+            self._stats = {}
+            self._pid = os.getpid()
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        # Shared by every user's calls: keep no cookies between them
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        return session
+
+    def session(self, url: str) -> requests.Session:
+        """The keep-alive session for the host of `url`."""
+        key = host_key(url)
+        with self._lock:
+            self._check_fork()
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = self._new_session()
+                self._stats[key] = _HostStats()
+            return session
+
+    def _timeout(self, timeout: Timeout) -> Tuple[float, float]:
+        if isinstance(timeout, tuple):
+            return timeout
+        read = self.read_timeout if timeout is None else float(timeout)
+        return (min(self.connect_timeout, read), read)
+
+    def _delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+
+    def _count(self, key: str, **increments):
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is not None:
+                for name, n in increments.items():
+                    stats.counts[name] += n
+
+    # --- requests ---
+
+    def request(self, method: str, url: str, timeout: Timeout = None, retries: Optional[int] = None,
+                **kwargs) -> requests.Response:
+        """
+        Like requests.request over the host's pooled session. `timeout` is the
+        read timeout in seconds (or a (connect, read) tuple); `retries`
+        overrides the client default for this call.
+        """
+        session = self.session(url)
+        key = host_key(url)
+        timeout = self._timeout(timeout)
+        retries = self.retries if retries is None else retries
+        started = time.monotonic()
+        attempt = 0
+        try:
+            while True:
+                self._count(key, attempts=1)
+                try:
+                    response = session.request(method, url, timeout=timeout, **kwargs)
+                except requests.ConnectionError as e:
+                    # Includes connect timeouts and a stale keep-alive connection closed under us;
+                    # read timeouts are a different class and end the call
+                    if attempt >= retries:
+                        raise
+                    wait = self._delay(attempt)
+                    http_logger.info(f"{method} {key} failed ({type(e).__name__}), retry in {wait:.2f}s")
+                else:
+                    if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                        self._count(key, **{f"{min(response.status_code // 100, 5)}xx": 1})
+                        return response
+                    wait = retry_after_seconds(response)
+                    if wait is None:
+                        wait = self._delay(attempt)
+                    elif wait > self.backoff_max:
+                        self._count(key, **{f"{response.status_code // 100}xx": 1})
+                        return response
+                    http_logger.info(f"{method} {key} answered {response.status_code}, retry in {wait:.2f}s")
+                    response.close()
+                self._count(key, retries=1)
+                attempt += 1
+                self._sleep(wait)
+        except Exception:
+            self._count(key, errors=1)
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                stats = self._stats.get(key)
+                if stats is not None:
+                    stats.counts["requests"] += 1
+                    stats.latency_total += elapsed
+                    stats.latency_max = max(stats.latency_max, elapsed)
+                    stats.recent.append(elapsed)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def warm(self, urls: Iterable[str], connections: int = 1, timeout: float = 5.0) -> Dict[str, bool]:
+        """Open `connections` keep-alive connections to each URL's host (HEAD, any
+        status will do); returns {host: reached}. Hosts are warmed concurrently."""
+        results: Dict[str, bool] = {}
+        threads = []
+        hosts = {host_key(u): u for u in urls if u}
+
+        def open_one(url: str):
+            try:
+                self.session(url).head(url, timeout=(min(self.connect_timeout, timeout), timeout),
+                                       allow_redirects=False).close()
+                ok = True
+            except requests.RequestException as e:
+                http_logger.debug(f"Warm-up of {host_key(url)} failed: {e}")
+                ok = False
+            with self._lock:
+                key = host_key(url)
+                results[key] = results.get(key, False) or ok
+
+        for url in hosts.values():
+            for _ in range(max(1, min(connections, self.pool_size))):
+                t = threading.Thread(target=open_one, args=(url,), name="http-warm", daemon=True)
+                t.start()
+                threads.append(t)
+        for t in threads:
+            t.join()
+        return results
+
+    # --- introspection ---
+
+    def _connections_opened(self, session: requests.Session) -> int:
+        opened = 0
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            try:
+                pools = adapter.poolmanager.pools
+                opened += sum(pools[k].num_connections for k in pools.keys())
+            except (AttributeError, KeyError):
+                continue
+        return opened
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._check_fork()
+            hosts = {key: dict(s.snapshot(), connections_opened=self._connections_opened(self._sessions[key]))
+                     for key, s in self._stats.items()}
+        return {"pool_size": self.pool_size, "connect_timeout": self.connect_timeout,
+                "read_timeout": self.read_timeout, "retries": self.retries, "hosts": hosts}
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+            self._stats = {}
+        for session in sessions.values():
+            session.close()
+
+
+_client: Optional[ProviderClient] = None
+_client_lock = threading.Lock()
+
+
+def get_provider_client() -> ProviderClient:
+    """The process-wide client, configured from K1_HTTP_* on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ProviderClient(
+                    pool_size=int(os.getenv("K1_HTTP_POOL_SIZE", "0")) or int(os.getenv("K1_WEB_THREADS", "16")),
+                    connect_timeout=float(os.getenv("K1_HTTP_CONNECT_TIMEOUT", "5")),
+                    read_timeout=float(os.getenv("K1_HTTP_READ_TIMEOUT", "60")),
+                    retries=int(os.getenv("K1_HTTP_RETRIES", "2")),
+                    backoff=float(os.getenv("K1_HTTP_BACKOFF", "0.5")),
+                    backoff_max=float(os.getenv("K1_HTTP_BACKOFF_MAX", "8")),
+                )
+    return _client
+
+
+__all__ = [
+    'ProviderClient',
+    'RETRY_STATUSES',
+    'get_provider_client',
+    'host_key',
+    'retry_after_seconds',
+]
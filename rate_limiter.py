@@ -0,0 +1,312 @@
+"""
+KELION AI - Rate Limiter
+========================
+One rate-limiting engine for app.limit_check and the Super AI blueprint.
+
+GCRA (generic cell rate algorithm): each key stores a single number, its
+theoretical arrival time (TAT). A request costs `period / limit` seconds
+of TAT and is allowed while TAT stays within `period` of now, which is a
+sliding window allowing bursts of up to `limit`. A check is O(1) and a key
+is one float, dropped once its TAT has passed.
+
+Backends:
+- MemoryBackend: per process, LRU-bounded dict.
+- SQLiteBackend: a small local SQLite file shared by every worker process
+  on the host; one UPSERT ... RETURNING per check.
+
+Policies are named (`global`, a route's endpoint name, ...) and may
+override their limit per subscription tier. Configuration:
+  K1_RATE_LIMIT_BACKEND  memory | sqlite (default memory)
+  K1_RATE_LIMIT_DB       SQLite file (default data/rate_limits.db)
+  K1_RATE_LIMITS         overrides, e.g. "global=300/60,api_chat=20/60,api_chat@Pro=60/60"
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from db_pool import SQLiteConnectionCache
+
+limiter_logger = logging.getLogger("kelion.ratelimit")
+
+
+class RateLimit(NamedTuple):
+    limit: int          # requests allowed per period (also the burst size)
+    period: float       # seconds
+
+    @property
+    def interval(self) -> float:
+        return self.period / self.limit
+
+    def __str__(self):
+        return f"{self.limit}/{self.period:g}"
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float   # seconds until the next request would be allowed (0 when allowed)
+    reset_after: float   # seconds until the full burst is available again
+
+
+def parse_rate(text: str) -> RateLimit:
+    """'30/60' -> RateLimit(30, 60.0)."""
+    limit, _, period = text.strip().partition("/")
+    rate = RateLimit(int(limit), float(period or 60))
+    if rate.limit < 1 or rate.period <= 0:
+        raise ValueError(f"Invalid rate limit: {text!r}")
+    return rate
+
+
+def _decide(rate: RateLimit, now: float, tat: Optional[float], new_tat: Optional[float]) -> Decision:
+    """Decision from the stored TAT (None: new key) and the TAT written (None: rejected)."""
+    if new_tat is not None:
+        remaining = int((now + rate.period - new_tat) / rate.interval + 1e-9)
+        return Decision(True, rate.limit, max(0, remaining), 0.0, max(0.0, new_tat - now))
+    tat = max(tat or now, now)
+    retry_after = tat + rate.interval - rate.period - now
+    return Decision(False, rate.limit, 0, max(0.0, retry_after), max(0.0, tat - now))
+
+
+# ============================================================================
+# BACKENDS
+# ============================================================================
+
+class MemoryBackend:
+    """Per-process TATs; beyond `max_keys` the least recently used key is dropped
+    (which only forgets a limit, never tightens one)."""
+
+    name = "memory"
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._tats: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._evicted = 0
+
+    def acquire(self, key: str, rate: RateLimit, now: float, cost: int = 1) -> Decision:
+        with self._lock:
+            tat = self._tats.get(key)
+            new_tat = max(tat or now, now) + rate.interval * cost
+            if new_tat - now > rate.period:
+                return _decide(rate, now, tat, None)
+            self._tats[key] = new_tat
+            self._tats.move_to_end(key)
+            # Amortized expiry: drop a couple of stale keys from the cold end per write
+            for _ in range(2):
+                if not self._tats:
+                    break
+                oldest_key, oldest_tat = next(iter(self._tats.items()))
+                if oldest_tat > now and len(self._tats) <= self.max_keys:
+                    break
+                del self._tats[oldest_key]
+                if oldest_tat > now:
+                    self._evicted += 1
+            return _decide(rate, now, tat, new_tat)
+
+    def reset(self, key: str):
+        with self._lock:
+            self._tats.pop(key, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"backend": self.name, "keys": len(self._tats), "max_keys": self.max_keys, "evicted": self._evicted}
+
+
+class SQLiteBackend:
+    """TATs in a local SQLite file shared by all worker processes on the host.
+
+    The state is disposable (losing it only forgets limits), so the file runs
+    with synchronous=OFF and is kept apart from the application database.
+    """
+
+    name = "sqlite"
+    PURGE_EVERY = 1000      # checks between deletions of passed TATs
+
+    def __init__(self, path: str, busy_timeout_ms: int = 2000):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connections = SQLiteConnectionCache(path, busy_timeout_ms=busy_timeout_ms, mmap_size=0, synchronous="OFF")
+        self._returning = sqlite3.sqlite_version_info >= (3, 35, 0)
+        self._checks = 0
+        self._lock = threading.Lock()
+        con = self._con()
+        con.execute("CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_rate_limits_tat ON rate_limits(tat)")
+
+    def _con(self) -> sqlite3.Connection:
+        con = self._connections.get()
+        con.isolation_level = None   # autocommit: each statement is its own atomic transaction
+        return con
+
+    def acquire(self, key: str, rate: RateLimit, now: float, cost: int = 1) -> Decision:
+        con = self._con()
+        step = rate.interval * cost
+        if self._returning:
+            row = con.execute(
+                """INSERT INTO rate_limits (key, tat) VALUES (?1, ?2 + ?3)
+                   ON CONFLICT(key) DO UPDATE SET tat = max(tat, ?2) + ?3
+                   WHERE max(tat, ?2) + ?3 - ?2 <= ?4
+                   RETURNING tat""",
+                (key, now, step, rate.period)
+            ).fetchone()
+            new_tat = row[0] if row else None
+            tat = None
+            if new_tat is None:
+                found = con.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+                tat = found[0] if found else None
+        else:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                found = con.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+                tat = found[0] if found else None
+                new_tat = max(tat or now, now) + step
+                if new_tat - now > rate.period:
+                    new_tat = None
+                else:
+                    con.execute("INSERT INTO rate_limits (key, tat) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET tat = excluded.tat",
+                                (key, new_tat))
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+        with self._lock:
+            self._checks += 1
+            purge = self._checks % self.PURGE_EVERY == 0
+        if purge:
+            con.execute("DELETE FROM rate_limits WHERE tat < ?", (now,))
+        return _decide(rate, now, tat, new_tat)
+
+    def reset(self, key: str):
+        self._con().execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+    def stats(self) -> Dict:
+        keys = self._con().execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+        return {"backend": self.name, "path": self.path, "keys": keys}
+
+
+# ============================================================================
+# POLICIES
+# ============================================================================
+
+class Policy:
+    """A named limit with optional per-tier overrides."""
+
+    def __init__(self, name: str, default: RateLimit, tiers: Optional[Dict[str, RateLimit]] = None):
+        self.name = name
+        self.default = default
+        self.tiers = dict(tiers or {})
+
+    def rate_for(self, tier: Optional[str] = None) -> RateLimit:
+        return self.tiers.get(tier, self.default) if tier else self.default
+
+
+class RateLimiter:
+    """Named policies over one backend, with allowed / rejected counters per policy."""
+
+    def __init__(self, backend, overrides: str = ""):
+        self.backend = backend
+        self.policies: Dict[str, Policy] = {}
+        self._overrides = self._parse_overrides(overrides)
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def _parse_overrides(spec: str) -> Dict[str, Dict[Optional[str], RateLimit]]:
+        overrides: Dict[str, Dict[Optional[str], RateLimit]] = {}
+        for item in (spec or "").split(","):
+            if not item.strip():
+                continue
+            try:
+                target, _, rate = item.partition("=")
+                name, _, tier = target.strip().partition("@")
+                overrides.setdefault(name, {})[tier or None] = parse_rate(rate)
+            except ValueError as e:
+                limiter_logger.warning(f"Ignoring rate limit override {item!r}: {e}")
+        return overrides
+
+    def define(self, name: str, default: RateLimit, tiers: Optional[Dict[str, RateLimit]] = None) -> Policy:
+        """Register (or replace) a policy; K1_RATE_LIMITS overrides win over the code defaults."""
+        tiers = dict(tiers or {})
+        override = self._overrides.get(name, {})
+        default = override.get(None, default)
+        tiers.update({tier: rate for tier, rate in override.items() if tier})
+        policy = Policy(name, default, tiers)
+        with self._lock:
+            self.policies[name] = policy
+            self._counters.setdefault(name, {"allowed": 0, "rejected": 0})
+        return policy
+
+    def has_tiers(self, name: str) -> bool:
+        policy = self.policies.get(name)
+        return bool(policy and policy.tiers)
+
+    def check(self, name: str, key: str, tier: Optional[str] = None, cost: int = 1,
+              rate: Optional[RateLimit] = None) -> Decision:
+        """Count one request of `key` against policy `name` (or an ad-hoc `rate`)."""
+        if rate is None:
+            policy = self.policies.get(name)
+            if policy is None:
+                raise KeyError(f"Unknown rate limit policy: {name}")
+            rate = policy.rate_for(tier)
+        try:
+            decision = self.backend.acquire(f"{name}:{key}", rate, time.time(), cost)
+        except sqlite3.Error as e:
+            # A broken shared store must not take the site down: fail open
+            limiter_logger.error(f"Rate limit backend failed: {e}")
+            decision = Decision(True, rate.limit, rate.limit, 0.0, 0.0)
+        with self._lock:
+            counters = self._counters.setdefault(name, {"allowed": 0, "rejected": 0})
+            counters["allowed" if decision.allowed else "rejected"] += 1
+        return decision
+
+    def reset(self, name: str, key: str):
+        self.backend.reset(f"{name}:{key}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = {name: dict(c) for name, c in self._counters.items()}
+        policies = {
+            name: {"limit": str(p.default), "tiers": {t: str(r) for t, r in p.tiers.items()}, **counters.get(name, {})}
+            for name, p in self.policies.items()
+        }
+        for name, c in counters.items():
+            policies.setdefault(name, c)   # ad-hoc limits (APIRateLimiter.is_allowed)
+        return {"backend": self.backend.stats(), "policies": policies}
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """The process-wide limiter, configured from K1_RATE_LIMIT_* on first use."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                kind = os.getenv("K1_RATE_LIMIT_BACKEND", "memory").lower()
+                if kind == "sqlite":
+                    backend = SQLiteBackend(os.getenv("K1_RATE_LIMIT_DB", os.path.join("data", "rate_limits.db")))
+                else:
+                    backend = MemoryBackend(int(os.getenv("K1_RATE_LIMIT_MAX_KEYS", "100000")))
+                _limiter = RateLimiter(backend, os.getenv("K1_RATE_LIMITS", ""))
+    return _limiter
+
+
+__all__ = [
+    'RateLimit',
+    'Decision',
+    'Policy',
+    'RateLimiter',
+    'MemoryBackend',
+    'SQLiteBackend',
+    'parse_rate',
+    'get_rate_limiter',
+]
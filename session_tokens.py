@@ -0,0 +1,52 @@
+"""
+KELION AI - Session Tokens
+==========================
+Stateless login session tokens, "<user>.<expiry>.<signature>": /api/login
+issues one, the client sends it back in the X-Session-Token header (or
+?session_token= where it cannot set headers, e.g. EventSource), and the
+app takes the user from it for rate limits, token budgets and private
+event channels instead of trusting a userId in the request.
+
+- Signature: HMAC-SHA256 over b"session\\x00<user>.<expiry>" with a key of
+  its own, so it can never be mistaken for (or replayed as) the stored
+  reset / verify token digests.
+- Nothing is stored: checking a token is one HMAC, no database read.
+- Limits: a token is valid until it expires. Logout, a password change or
+  a deleted account do not revoke it; only changing the key does, and
+  that signs everyone out. Keep `hours` short.
+"""
+
+import hmac
+import time
+import hashlib
+from typing import Callable, Optional
+
+_CONTEXT = b"session\x00"
+
+
+class SessionTokens:
+    """issue(user_id) -> token; verify(token) -> user_id, or None if forged, malformed or expired."""
+
+    def __init__(self, key: str, hours: float = 24, clock: Callable[[], float] = time.time):
+        if not key:
+            raise ValueError("session tokens need a secret key")
+        self._key = key.encode("utf-8")
+        self.hours = hours
+        self._clock = clock
+
+    def _sign(self, body: str) -> str:
+        return hmac.new(self._key, _CONTEXT + body.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def issue(self, user_id: str) -> str:
+        body = f"{user_id}.{int(self._clock() + self.hours * 3600)}"
+        return f"{body}.{self._sign(body)}"
+
+    def verify(self, token: str) -> Optional[str]:
+        body, _, signature = (token or "").rpartition(".")
+        user_id, _, expires = body.rpartition(".")
+        if not user_id or not expires.isdigit() or not hmac.compare_digest(signature, self._sign(body)):
+            return None
+        return user_id if int(expires) > self._clock() else None
+
+
+__all__ = ['SessionTokens']
@@ -0,0 +1,132 @@
+"""
+KELION AI - Source Trust & Allowlist
+====================================
+Web-search source filtering without per-source database round trips.
+
+- SuffixTrie: allowlist compiled once into a trie of reversed domain
+  labels; `matches()` is O(labels) instead of scanning every entry.
+- SourceTrustMap: the `sources` table held in memory. Loaded once,
+  refreshed after `set_source_trust` writes and every `ttl` seconds (for
+  writes made by other workers). Domains missing from a partial load are
+  fetched with one batched `WHERE domain IN (...)` query per lookup.
+"""
+
+import time
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+DEFAULT_TRUST = 50
+
+
+class SuffixTrie:
+    """Matches a domain equal to, or a subdomain of, any allowlisted domain."""
+
+    _END = object()
+
+    def __init__(self, domains: Iterable[str] = ()):
+        self._root: Dict = {}
+        self._size = 0
+        for d in domains:
+            self.add(d)
+
+    @classmethod
+    def from_csv(cls, csv: str) -> "SuffixTrie":
+        return cls(d for d in csv.split(","))
+
+    def add(self, domain: str):
+        domain = domain.strip().lower().strip(".")
+        if not domain:
+            return
+        node = self._root
+        for label in reversed(domain.split(".")):
+            node = node.setdefault(label, {})
+        if self._END not in node:
+            node[self._END] = True
+            self._size += 1
+
+    def matches(self, domain: str) -> bool:
+        node = self._root
+        for label in reversed((domain or "").lower().split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if self._END in node:
+                return True
+        return False
+
+    def __len__(self):
+        return self._size
+
+
+class SourceTrustMap:
+    """
+    In-memory `sources.trust` by domain.
+
+    `load_all(limit)` returns up to `limit` {domain: trust} rows;
+    `load_some(domains)` returns {domain: trust} for the given domains.
+    """
+
+    def __init__(self, load_all: Callable[[int], Dict[str, int]],
+                 load_some: Callable[[List[str]], Dict[str, int]],
+                 ttl: float = 300.0, full_load_limit: int = 10000, default: int = DEFAULT_TRUST):
+        self._load_all = load_all
+        self._load_some = load_some
+        self.ttl = ttl
+        self.full_load_limit = full_load_limit
+        self.default = default
+        self._lock = threading.Lock()
+        self._trust: Dict[str, int] = {}
+        self._absent: set = set()     # looked up, not in the table
+        self._complete = False        # the whole table fits in memory
+        self._loaded_at: Optional[float] = None
+        self._metrics = {"loads": 0, "batch_queries": 0, "lookups": 0}
+
+    def _ensure_loaded(self):
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < self.ttl:
+            return
+        rows = self._load_all(self.full_load_limit)
+        with self._lock:
+            self._trust = dict(rows)
+            self._absent = set()
+            self._complete = len(rows) < self.full_load_limit
+            self._loaded_at = now
+            self._metrics["loads"] += 1
+
+    def lookup_many(self, domains: Iterable[str]) -> Dict[str, int]:
+        """Trust for each domain (default for unknown ones); at most one query."""
+        self._ensure_loaded()
+        wanted = {d for d in domains if d}
+        with self._lock:
+            self._metrics["lookups"] += len(wanted)
+            missing = [] if self._complete else sorted(d for d in wanted if d not in self._trust and d not in self._absent)
+        if missing:
+            found = self._load_some(missing)
+            with self._lock:
+                self._metrics["batch_queries"] += 1
+                self._trust.update(found)
+                self._absent.update(d for d in missing if d not in found)
+        with self._lock:
+            return {d: int(self._trust.get(d, self.default)) for d in wanted}
+
+    def get(self, domain: str) -> int:
+        if not domain:
+            return self.default
+        return self.lookup_many([domain])[domain]
+
+    def set(self, domain: str, trust: int):
+        """Record a committed write (keeps this worker's map current without a reload)."""
+        with self._lock:
+            self._trust[domain] = int(trust)
+            self._absent.discard(domain)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._metrics, size=len(self._trust), complete=self._complete)
+
+
+__all__ = ['SuffixTrie', 'SourceTrustMap', 'DEFAULT_TRUST']
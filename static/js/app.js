@@ -80,5 +80,12 @@ function updateLiveUsersCount() {
         })
         .catch(() => {});
 }
-setInterval(updateLiveUsersCount, 10000);
+// Initial value, then pushed over /api/events (no polling)
 setTimeout(updateLiveUsersCount, 1000);
+if (window.K1Events) {
+    K1Events.on('live_users', data => {
+        const el = document.getElementById('liveUsersCount');
+        if (el && data.count !== undefined) el.textContent = data.count;
+    });
+    K1Events.on('reset', updateLiveUsersCount);
+}
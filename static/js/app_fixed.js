@@ -502,7 +502,7 @@ async function login() {
   // Add logout button to dashboard
   addLogoutButton();
 
-  // Start polling for broadcast messages (checks every 5 min)
+  // Broadcast messages: pushed over /api/events
   startBroadcastPolling();
 
   const k1ContactBtn = document.getElementById("k1ContactBtn");
@@ -516,7 +516,7 @@ async function login() {
 // ============================================
 // BROADCAST BANNER SYSTEM
 // ============================================
-let broadcastPollInterval = null;
+let broadcastSubscribed = false;
 
 async function checkPendingBroadcasts() {
   const userId = localStorage.getItem('k1_user');
@@ -535,25 +535,21 @@ async function checkPendingBroadcasts() {
   }
 }
 
-// Start polling for new broadcasts every 5 minutes
+// Check once, then whenever /api/events announces a broadcast (no polling)
 function startBroadcastPolling() {
-  if (broadcastPollInterval) return; // Already running
-
-  // Check immediately
   checkPendingBroadcasts();
+  if (broadcastSubscribed || !window.K1Events) return; // Already subscribed
 
-  // Then poll every 5 minutes (300000ms)
-  broadcastPollInterval = setInterval(() => {
-    checkPendingBroadcasts();
-  }, 300000);
-
-  console.log('ðŸ“¢ Broadcast polling started (every 5 min)');
+  broadcastSubscribed = true;
+  K1Events.on('broadcast', checkPendingBroadcasts);
+  K1Events.on('reset', checkPendingBroadcasts);
+  K1Events.restart(); // pick up the logged-in user's channel
 }
 
 function stopBroadcastPolling() {
-  if (broadcastPollInterval) {
-    clearInterval(broadcastPollInterval);
-    broadcastPollInterval = null;
+  if (window.K1Events && K1Events.source) {
+    K1Events.source.close();
+    K1Events.source = null;
   }
 }
 
@@ -749,7 +745,8 @@ async function sendText(text) {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
-        "X-API-Token": localStorage.getItem("k1_api_token") || ""
+        "X-API-Token": localStorage.getItem("k1_api_token") || "",
+        "X-Session-Token": sessionStorage.getItem("k1_api_token") || ""
       },
       body: JSON.stringify({
         message: t,  // Super AI uses 'message' instead of 'text'
@@ -287,10 +287,14 @@ window.UserBroadcast = {
   }
 };
 
-// Auto-check broadcasts on page load for users
+// Check once on page load, then only when /api/events announces a broadcast
 document.addEventListener('DOMContentLoaded', () => {
   setTimeout(() => UserBroadcast.check(), 2000);
 });
+if (window.K1Events) {
+  K1Events.on('broadcast', () => UserBroadcast.check());
+  K1Events.on('reset', () => UserBroadcast.check());
+}
 
 // Make globally available
 window.loadBroadcast = () => AdminBroadcast.loadPanel();
@@ -0,0 +1,62 @@
+// KELION - Server-Sent Events client
+// One EventSource per page for broadcasts, presence and live user counts (replaces polling)
+
+window.K1Events = {
+  source: null,
+  handlers: {},
+  lastEventId: '',
+  retryMs: 3000,
+
+  on(type, fn) {
+    if (!this.handlers[type]) {
+      this.handlers[type] = [];
+      if (this.source) this._listen(type);
+    }
+    this.handlers[type].push(fn);
+  },
+
+  _dispatch(type, e) {
+    if (e.lastEventId) this.lastEventId = e.lastEventId;
+    let data = {};
+    try { data = JSON.parse(e.data || '{}'); } catch (err) { }
+    (this.handlers[type] || []).forEach(fn => {
+      try { fn(data); } catch (err) { console.error(`K1Events ${type} handler failed:`, err); }
+    });
+  },
+
+  _listen(type) {
+    this.source.addEventListener(type, e => this._dispatch(type, e));
+  },
+
+  start() {
+    if (this.source || typeof EventSource === 'undefined') return;
+    const params = new URLSearchParams();
+    // The private channel (user broadcasts, presence) needs the login session token;
+    // EventSource can't send headers, so it goes in the query
+    const sessionToken = sessionStorage.getItem('k1_api_token');
+    if (sessionToken) params.set('session_token', sessionToken);
+    if (this.lastEventId) params.set('lastEventId', this.lastEventId);
+
+    this.source = new EventSource(`/api/events?${params}`);
+    Object.keys(this.handlers).forEach(type => this._listen(type));
+    this.source.onopen = () => { this.retryMs = 3000; };
+    this.source.onerror = () => {
+      // The browser reconnects by itself (with Last-Event-ID) unless the server refused the stream
+      if (this.source.readyState !== EventSource.CLOSED) return;
+      this.source = null;
+      setTimeout(() => this.start(), this.retryMs);
+      this.retryMs = Math.min(this.retryMs * 2, 60000);
+    };
+  },
+
+  // Reopen with the current session (after login / logout)
+  restart() {
+    if (this.source) {
+      this.source.close();
+      this.source = null;
+    }
+    this.start();
+  }
+};
+
+document.addEventListener('DOMContentLoaded', () => K1Events.start());
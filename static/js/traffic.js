@@ -33,24 +33,38 @@ window.loadTraffic = async function () {
             headers: { 'X-Admin-Token': adminToken }
         });
 
-        const auditRes = await fetch('/admin/audit?limit=500', {
+        // Per-day event counts from the audit_hourly rollup (no raw audit scan)
+        const auditRes = await fetch('/admin/audit/rollup?bucket=day&since=1970-01-01', {
+            headers: { 'X-Admin-Token': adminToken }
+        });
+
+        // Page views from the traffic_daily rollup (no raw visitors scan)
+        const since = new Date(Date.now() - 6 * 24 * 60 * 60 * 1000).toISOString().split('T')[0];
+        const trafficRes = await fetch(`/admin/traffic?bucket=day&since=${since}&top=5`, {
             headers: { 'X-Admin-Token': adminToken }
         });
 
         if (!usersRes.ok) throw new Error('Failed to load users');
 
         const usersData = await usersRes.json();
-        const auditData = auditRes.ok ? await auditRes.json() : { items: [] };
+        const auditData = auditRes.ok ? await auditRes.json() : { series: [], totals: {} };
+        const trafficData = trafficRes.ok ? await trafficRes.json() : { series: [], views: 0, top: {} };
+        const viewsByDay = {};
+        (trafficData.series || []).forEach(s => { viewsByDay[s.bucket] = s.views; });
+        const topLists = trafficData.top || {};
 
         const users = usersData.users || [];
-        const audits = auditData.items || [];
+        const byDay = {};
+        (auditData.series || []).forEach(s => { byDay[s.bucket] = s.total; });
+        const totals = auditData.totals || {};
+        const sumActions = match => Object.keys(totals).filter(match).reduce((n, a) => n + totals[a], 0);
 
         // Calculate stats
         const totalUsers = users.length;
         const today = new Date().toISOString().split('T')[0];
-        const activeToday = audits.filter(a => a.ts && a.ts.startsWith(today)).length;
-        const logins = audits.filter(a => a.action && a.action.includes('login')).length;
-        const messages = audits.filter(a => a.action && (a.action.includes('input') || a.action.includes('output'))).length;
+        const activeToday = byDay[today] || 0;
+        const logins = sumActions(a => a.includes('login'));
+        const messages = sumActions(a => a.includes('input') || a.includes('output'));
 
         // Calculate users by day (last 7 days)
         const last7Days = [];
@@ -59,11 +73,23 @@ window.loadTraffic = async function () {
             d.setDate(d.getDate() - i);
             const dateStr = d.toISOString().split('T')[0];
             const dayName = d.toLocaleDateString('en-US', { weekday: 'short' });
-            const count = audits.filter(a => a.ts && a.ts.startsWith(dateStr)).length;
-            last7Days.push({ day: dayName, count });
+            const count = byDay[dateStr] || 0;
+            last7Days.push({ day: dayName, count, views: viewsByDay[dateStr] || 0 });
         }
 
         const maxCount = Math.max(...last7Days.map(d => d.count), 1);
+        const maxViews = Math.max(...last7Days.map(d => d.views), 1);
+        const topTable = (title, key) => `
+          <div class="k1-top-list">
+            <h5>${title}</h5>
+            <table class="k1-table">
+              <tbody>
+                ${(topLists[key] || []).map(t => `
+                  <tr><td>${escapeTrafficText(t.value || '-')}</td><td>${t.views}</td></tr>
+                `).join('') || '<tr><td colspan="2">No data</td></tr>'}
+              </tbody>
+            </table>
+          </div>`;
 
         document.getElementById('trafficContent').innerHTML = `
         <div class="k1-stats-grid">
@@ -99,6 +125,26 @@ window.loadTraffic = async function () {
           </div>
         </div>
         
+        <div class="k1-chart-section">
+          <h4>Page Views (Last 7 Days): ${trafficData.views || 0}</h4>
+          <div class="k1-bar-chart">
+            ${last7Days.map(d => `
+              <div class="k1-bar-item">
+                <div class="k1-bar" style="height: ${(d.views / maxViews) * 100}%">
+                  <span class="k1-bar-value">${d.views}</span>
+                </div>
+                <div class="k1-bar-label">${d.day}</div>
+              </div>
+            `).join('')}
+          </div>
+          <div class="k1-stats-grid">
+            ${topTable('Top Pages', 'page')}
+            ${topTable('Referrers', 'referrer')}
+            ${topTable('Browsers', 'browser')}
+            ${topTable('Languages', 'language')}
+          </div>
+        </div>
+        
         <div class="k1-users-list">
           <h4>Recent Users</h4>
           <table class="k1-table">
@@ -149,6 +195,12 @@ function formatTimeAgo(ts) {
     return d.toLocaleDateString();
 }
 
+function escapeTrafficText(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
 function isRecent(ts) {
     if (!ts) return false;
     const d = new Date(ts);
@@ -0,0 +1,516 @@
+"""
+KELION AI - Static Asset Pipeline
+=================================
+Build step and server side for fingerprinted, precompressed static files.
+
+`python static_assets.py build` reads static/ and writes static_build/:
+- JS and CSS are minified, images copied, each under a content-hashed
+  name (`js/app.3f2a9c01d4.js`). References between assets (CSS `url()`,
+  ES module imports) are rewritten first, so a hash covers its dependencies.
+- HTML keeps its name, with `src` / `href` rewritten to the hashed files.
+- Text files get `.gz` (and `.br` when the `brotli` package is installed)
+  siblings.
+- manifest.json maps each logical path to its hashed path.
+
+`StaticAssets.send()` serves from that directory: it picks the best encoding
+the client accepts, marks hashed files `immutable` for a year and makes HTML
+revalidate (ETag) so a deploy is picked up on the next page load. Files that
+are not in the build (audio, or everything when no build exists) are left to
+Flask's static handler.
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import mimetypes
+from typing import Dict, List, Optional, Set
+
+try:
+    import brotli
+    HAVE_BROTLI = True
+except ImportError:
+    HAVE_BROTLI = False
+
+assets_logger = logging.getLogger("kelion.static")
+
+MANIFEST = "manifest.json"
+HASH_LENGTH = 10
+SKIP_DIRS = {"audio", "debug"}                 # generated at runtime / not shipped to pages
+MINIFIED = {".js", ".css"}
+HASHED = MINIFIED | {".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico", ".woff", ".woff2", ".glb", ".gltf"}
+COMPRESSED = MINIFIED | {".html", ".svg", ".json", ".gltf"}
+MIN_COMPRESS_BYTES = 512
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+# ============================================================================
+# MINIFIERS (conservative: comments and indentation go, line breaks stay)
+# ============================================================================
+
+_WORD = re.compile(r"[\w$\u0080-\uffff]")
+# After these (or at the start), "/" opens a regex literal rather than a division
+_REGEX_AFTER = set("(,=:[!&|?{};+-*%<>~^")
+_REGEX_KEYWORDS = {"return", "typeof", "case", "do", "else", "in", "of", "new", "delete",
+                   "void", "throw", "instanceof", "yield", "await"}
+
+
+def _skip_string(src: str, i: int) -> int:
+    """Index just past the quoted string starting at src[i]."""
+    quote, i = src[i], i + 1
+    while i < len(src):
+        if src[i] == "\\":
+            i += 2
+            continue
+        if src[i] == quote or src[i] == "\n":
+            return i + 1
+        i += 1
+    return i
+
+
+def _skip_template(src: str, i: int) -> int:
+    """Index just past the template literal starting at src[i], including nested ${...}."""
+    i += 1
+    while i < len(src):
+        c = src[i]
+        if c == "\\":
+            i += 2
+        elif c == "`":
+            return i + 1
+        elif c == "$" and src.startswith("${", i):
+            i = _skip_code_block(src, i + 2)
+        else:
+            i += 1
+    return i
+
+
+def _skip_code_block(src: str, i: int) -> int:
+    """Index just past the `}` closing a ${ expression that starts at src[i]."""
+    depth = 1
+    while i < len(src):
+        c = src[i]
+        if c in "'\"":
+            i = _skip_string(src, i)
+        elif c == "`":
+            i = _skip_template(src, i)
+        elif src.startswith("//", i):
+            end = src.find("\n", i)
+            i = len(src) if end < 0 else end
+        elif src.startswith("/*", i):
+            end = src.find("*/", i + 2)
+            i = len(src) if end < 0 else end + 2
+        elif c == "{":
+            depth += 1
+            i += 1
+        elif c == "}":
+            depth -= 1
+            i += 1
+            if depth == 0:
+                return i
+        else:
+            i += 1
+    return i
+
+
+def _skip_regex(src: str, i: int) -> int:
+    i += 1
+    in_class = False
+    while i < len(src):
+        c = src[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == "\n":
+            return i
+        if in_class:
+            in_class = c != "]"
+        elif c == "[":
+            in_class = True
+        elif c == "/":
+            return i + 1
+        i += 1
+    return i
+
+
+def minify_js(src: str) -> str:
+    src = src.lstrip("\ufeff")
+    out: List[str] = []
+    last = ""            # last emitted non-whitespace character
+    last_word = ""       # last identifier/keyword emitted, for the regex rule
+    newline = space = False
+    i, n = 0, len(src)
+    while i < n:
+        c = src[i]
+        if c in " \t\r\n\f\v\u00a0\ufeff":
+            if c == "\n":
+                newline = True
+            else:
+                space = True
+            i += 1
+            continue
+        if src.startswith("//", i):
+            end = src.find("\n", i)
+            i = n if end < 0 else end
+            continue
+        if src.startswith("/*", i):
+            end = src.find("*/", i + 2)
+            end = n if end < 0 else end + 2
+            if "\n" in src[i:end]:
+                newline = True
+            else:
+                space = True
+            i = end
+            continue
+
+        is_regex = c == "/" and (not last or last in _REGEX_AFTER or last_word in _REGEX_KEYWORDS)
+        if c in "'\"":
+            end = _skip_string(src, i)
+        elif c == "`":
+            end = _skip_template(src, i)
+        elif is_regex:
+            end = _skip_regex(src, i)
+        elif _WORD.match(c):
+            end = i + 1
+            while end < n and _WORD.match(src[end]):
+                end += 1
+        else:
+            end = i + 1
+        token = src[i:end]
+
+        # Whitespace before the token: keep line breaks (ASI), drop the rest unless it separates tokens
+        if out:
+            if newline and last not in "{;,([" and c not in ")]},;":
+                out.append("\n")
+            elif (newline or space) and (
+                (_WORD.match(last) and _WORD.match(c))
+                or (last in "+-" and c in "+-")
+                or (last == "/" and c == "/")
+                or (last.isdigit() and c == ".")
+            ):
+                out.append(" ")
+        newline = space = False
+
+        out.append(token)
+        last = token[-1]
+        last_word = token if _WORD.match(c) and c not in "'\"`" else ""
+        i = end
+    return "".join(out) + "\n"
+
+
+def _skip_css_url(src: str, i: int) -> int:
+    """Index just past an unquoted url(...) starting at src[i]."""
+    end = src.find(")", i)
+    return len(src) if end < 0 else end + 1
+
+
+def minify_css(src: str) -> str:
+    src = src.lstrip("\ufeff")
+    out: List[str] = []
+    space = False
+    i, n = 0, len(src)
+    while i < n:
+        c = src[i]
+        if c.isspace():
+            space = True
+            i += 1
+            continue
+        if src.startswith("/*", i):
+            end = src.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+            space = True
+            continue
+        if c in "'\"":
+            end = _skip_string(src, i)
+        elif src[i:i + 4].lower() == "url(" and src[i + 4:i + 5] not in ("'", '"'):
+            end = _skip_css_url(src, i)
+        else:
+            end = i + 1
+        token = src[i:end]
+        prev = out[-1][-1] if out else ""
+        if space and out and prev not in "{};:,>" and c not in "{};,>":
+            out.append(" ")
+        space = False
+        if c == "}" and prev == ";":
+            out.pop()
+        out.append(token)
+        i = end
+    return "".join(out) + "\n"
+
+
+# ============================================================================
+# REFERENCE REWRITING
+# ============================================================================
+
+_CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")\s]+)\1\s*\)""", re.I)
+_JS_IMPORT = re.compile(r"""(\bfrom\s*|\bimport\s*\(?\s*)(['"])([^'"]+)\2""")
+_HTML_REF = re.compile(r"""(\s(?:src|href)\s*=\s*)(['"])([^'"]+)\2""", re.I)
+
+
+def _resolve(ref: str, from_dir: str) -> Optional[str]:
+    """Logical path (relative to the static root) of a local reference, or None."""
+    if not ref or ref.startswith(("#", "data:", "mailto:", "tel:", "javascript:", "//")) or "://" in ref:
+        return None
+    path = ref.split("#", 1)[0].split("?", 1)[0]
+    if not path:
+        return None
+    if path.startswith("/"):
+        logical = path.lstrip("/")
+    else:
+        logical = os.path.normpath(os.path.join(from_dir, path)).replace(os.sep, "/")
+    return None if logical.startswith("..") else logical
+
+
+def _rewrite(pattern: re.Pattern, text: str, from_dir: str, manifest: Dict[str, str],
+             group: int, bare_imports: bool = True) -> str:
+    def swap(match):
+        ref = match.group(group)
+        if not bare_imports and not ref.startswith(("./", "../", "/")):
+            return match.group(0)   # bare module specifiers ("three") belong to the import map
+        logical = _resolve(ref, from_dir)
+        hashed = manifest.get(logical) if logical else None
+        if not hashed:
+            return match.group(0)
+        suffix = ref[len(ref.split("#", 1)[0].split("?", 1)[0]):]
+        new_ref = ("/" + hashed if ref.startswith("/") else
+                   os.path.relpath(hashed, from_dir or ".").replace(os.sep, "/"))
+        if ref.startswith("./") and not new_ref.startswith("."):
+            new_ref = "./" + new_ref
+        start, end = match.span(group)
+        whole = match.group(0)
+        offset = match.start(0)
+        return whole[:start - offset] + new_ref + suffix + whole[end - offset:]
+    return pattern.sub(swap, text)
+
+
+def rewrite_css(text: str, from_dir: str, manifest: Dict[str, str]) -> str:
+    return _rewrite(_CSS_URL, text, from_dir, manifest, 2)
+
+
+def rewrite_js(text: str, from_dir: str, manifest: Dict[str, str]) -> str:
+    return _rewrite(_JS_IMPORT, text, from_dir, manifest, 3, bare_imports=False)
+
+
+def rewrite_html(text: str, from_dir: str, manifest: Dict[str, str]) -> str:
+    return _rewrite(_HTML_REF, text, from_dir, manifest, 3)
+
+
+# ============================================================================
+# BUILD
+# ============================================================================
+
+def hashed_name(logical: str, content: bytes) -> str:
+    root, ext = os.path.splitext(logical)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def _write(out_dir: str, logical: str, content: bytes) -> List[str]:
+    """Write a file and its compressed siblings; returns the files written."""
+    path = os.path.join(out_dir, logical)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    written = [logical]
+    if os.path.splitext(logical)[1] in COMPRESSED and len(content) >= MIN_COMPRESS_BYTES:
+        variants = [(".gz", gzip.compress(content, compresslevel=9, mtime=0))]
+        if HAVE_BROTLI:
+            variants.append((".br", brotli.compress(content, quality=11)))
+        for suffix, data in variants:
+            if len(data) < len(content):
+                with open(path + suffix, "wb") as f:
+                    f.write(data)
+                written.append(logical + suffix)
+    return written
+
+
+def _source_files(src_dir: str) -> List[str]:
+    files = []
+    for root, dirs, names in os.walk(src_dir):
+        rel_root = os.path.relpath(root, src_dir)
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS and not d.startswith("."))
+        for name in sorted(names):
+            ext = os.path.splitext(name)[1].lower()
+            if ext in HASHED or ext == ".html":
+                files.append(os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, "/"))
+    return files
+
+
+def build(src_dir: str = "static", out_dir: str = "static_build") -> Dict[str, str]:
+    """Build `out_dir` from `src_dir`; returns the manifest {logical: hashed}."""
+    files = _source_files(src_dir)
+    sources = {}
+    for logical in files:
+        with open(os.path.join(src_dir, logical), "rb") as f:
+            sources[logical] = f.read()
+
+    tmp_dir = out_dir.rstrip("/\\") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    manifest: Dict[str, str] = {}
+    visiting: Set[str] = set()
+
+    def emit(logical: str):
+        """Hash `logical` after the assets it references (depth first)."""
+        if logical in manifest or logical in visiting:
+            return   # done, or an import cycle: that edge keeps the unhashed name
+        visiting.add(logical)
+        ext = os.path.splitext(logical)[1].lower()
+        from_dir = os.path.dirname(logical)
+        content = sources[logical]
+        if ext in MINIFIED:
+            text = content.decode("utf-8")
+            pattern, rewrite, minify = ((_CSS_URL, rewrite_css, minify_css) if ext == ".css" else
+                                        (_JS_IMPORT, rewrite_js, minify_js))
+            group = 2 if ext == ".css" else 3
+            for match in pattern.finditer(text):
+                dep = _resolve(match.group(group), from_dir)
+                if dep in sources and dep != logical and os.path.splitext(dep)[1].lower() in HASHED:
+                    emit(dep)
+            content = minify(rewrite(text, from_dir, manifest)).encode("utf-8")
+        name = hashed_name(logical, content)
+        _write(tmp_dir, name, content)
+        manifest[logical] = name
+        visiting.discard(logical)
+
+    for logical in files:
+        if os.path.splitext(logical)[1].lower() in HASHED:
+            emit(logical)
+    for logical in files:
+        if logical.endswith(".html"):
+            text = sources[logical].decode("utf-8")
+            _write(tmp_dir, logical, rewrite_html(text, os.path.dirname(logical), manifest).encode("utf-8"))
+
+    with open(os.path.join(tmp_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    # Swap in the finished build
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return manifest
+
+
+# ============================================================================
+# SERVING
+# ============================================================================
+
+def accepted_encodings(accept_encoding: str) -> Set[str]:
+    """Codings the client accepts (q > 0) from an Accept-Encoding header."""
+    accepted, refused, wildcard = set(), set(), False
+    for part in (accept_encoding or "").lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if not coding:
+            continue
+        if coding == "*":
+            wildcard = q > 0
+        elif q > 0:
+            accepted.add(coding)
+        else:
+            refused.add(coding)
+    if wildcard:
+        accepted |= {"br", "gzip"} - refused
+    return accepted
+
+
+class StaticAssets:
+    """Serves a static_assets build; `available` is False when there is no build."""
+
+    ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+    def __init__(self, build_dir: str = "static_build"):
+        self.build_dir = os.path.abspath(build_dir)
+        self.manifest: Dict[str, str] = {}
+        self._hashed: Set[str] = set()
+        self._files: Set[str] = set()
+        self.reload()
+
+    @property
+    def available(self) -> bool:
+        return bool(self._files)
+
+    def reload(self):
+        path = os.path.join(self.build_dir, MANIFEST)
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest, self._hashed, self._files = {}, set(), set()
+            return
+        self._hashed = set(self.manifest.values())
+        files = set()
+        for root, _, names in os.walk(self.build_dir):
+            for name in names:
+                files.add(os.path.relpath(os.path.join(root, name), self.build_dir).replace(os.sep, "/"))
+        self._files = files
+        assets_logger.info(f"Static build: {len(self.manifest)} fingerprinted assets from {self.build_dir}")
+
+    def url(self, logical: str) -> str:
+        """Public URL of a static file: the hashed name when built."""
+        logical = logical.lstrip("/")
+        return "/" + self.manifest.get(logical, logical)
+
+    def has(self, filename: str) -> bool:
+        return filename in self._files and filename != MANIFEST
+
+    def send(self, filename: str, accept_encoding: str = ""):
+        """Response for a file of the build (see has()), precompressed when the client accepts it."""
+        from flask import send_from_directory
+
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        if mimetype.startswith("text/") or mimetype in ("application/javascript", "text/javascript"):
+            mimetype += "; charset=utf-8"
+        accepted = accepted_encodings(accept_encoding)
+        chosen, served = None, filename
+        for coding, suffix in self.ENCODINGS:
+            if coding in accepted and (filename + suffix) in self._files:
+                chosen, served = coding, filename + suffix
+                break
+        resp = send_from_directory(self.build_dir, served, mimetype=mimetype, conditional=True)
+        if chosen:
+            resp.headers["Content-Encoding"] = chosen
+        if any((filename + suffix) in self._files for _, suffix in self.ENCODINGS):
+            resp.headers["Vary"] = "Accept-Encoding"
+        resp.headers["Cache-Control"] = IMMUTABLE if filename in self._hashed else REVALIDATE
+        return resp
+
+
+def main(argv: List[str]) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    command = argv[1] if len(argv) > 1 else "build"
+    src_dir = os.getenv("K1_STATIC_DIR", "static")
+    out_dir = os.getenv("K1_STATIC_BUILD_DIR", "static_build")
+    if command != "build":
+        print(f"Unknown command: {command}. Use build")
+        return 2
+    manifest = build(src_dir, out_dir)
+    before = sum(os.path.getsize(os.path.join(src_dir, logical)) for logical in manifest)
+    after = sum(os.path.getsize(os.path.join(out_dir, hashed)) for hashed in manifest.values())
+    print(f"Built {len(manifest)} fingerprinted assets into {out_dir}: {before} -> {after} bytes minified"
+          f"{'' if HAVE_BROTLI else ' (brotli not installed: .gz only)'}")
+    return 0
+
+
+__all__ = [
+    'build',
+    'minify_js',
+    'minify_css',
+    'rewrite_css',
+    'rewrite_js',
+    'rewrite_html',
+    'accepted_encodings',
+    'StaticAssets',
+]
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
+
@@ -5,14 +5,16 @@ Toate endpoint-urile pentru funcționalitățile Super AI.
 Securitate îmbunătățită conform auditului AI.
 """
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, g, jsonify, request
 import os
 import base64
 import logging
+import math
 import threading
 import time
 from functools import wraps
-from collections import defaultdict
+
+from rate_limiter import RateLimit, get_rate_limiter
 
 # Setup logging
 api_logger = logging.getLogger("kelion.api")
@@ -27,7 +29,8 @@ try:
     )
     from claude_brain import (
         call_claude, get_memory, get_usage_tracker,
-        analyze_own_code, register_voiceprint, verify_voiceprint
+        analyze_own_code, register_voiceprint, verify_voiceprint,
+        reset_after_fork as reset_brain_after_fork
     )
     from vision_module import (
         analyze_image, get_face_tracking, get_vision_observer
@@ -45,6 +48,10 @@ except ImportError as e:
     SUPER_AI_AVAILABLE = False
     api_logger.error(f"Super AI modules not available: {e}")
 
+# Sub gunicorn (preload_app) procesul master doar importă aplicația: firele de
+# fundal pornesc în fiecare worker, din start_background() (gunicorn.conf.py)
+PREFORK = os.getenv("K1_PREFORK", "false").lower() == "true"
+
 # Blueprint
 super_ai_bp = Blueprint('super_ai', __name__, url_prefix='/api/super')
 
@@ -102,67 +109,44 @@ def require_admin():
 # ============================================================================
 
 class APIRateLimiter:
-    """Rate limiter simplu pentru API endpoints."""
+    """Rate limiter pentru API endpoints (motorul comun din rate_limiter.py)."""
     
-    def __init__(self):
-        self._requests = defaultdict(list)
-        self._lock = threading.RLock()
-        # Start cleanup thread
-        t = threading.Thread(target=self._cleanup_loop, daemon=True)
-        t.start()
+    def __init__(self, limiter=None):
+        self._limiter = limiter or get_rate_limiter()
     
     def is_allowed(self, identifier: str, max_requests: int = 60, window_seconds: int = 60) -> bool:
         """Verifică dacă request-ul este permis."""
-        now = time.time()
-        cutoff = now - window_seconds
-        
-        with self._lock:
-            return self._check_and_add(identifier, now, cutoff, max_requests)
+        return self._limiter.check("api", identifier, rate=RateLimit(max_requests, window_seconds)).allowed
     
-    def _check_and_add(self, identifier: str, now: float, cutoff: float, max_requests: int) -> bool:
-        # Cleanup old requests for this specific user inline
-        self._requests[identifier] = [ts for ts in self._requests[identifier] if ts > cutoff]
-        
-        if len(self._requests[identifier]) >= max_requests:
-            return False
-        
-        self._requests[identifier].append(now)
-        return True
-
-    def _cleanup_loop(self):
-        while True:
-            time.sleep(300) # Cleanup every 5 minutes
-            with self._lock:
-                now = time.time()
-                cutoff = now - 3600 # Clear anything older than 1 hour
-                keys_to_del = []
-                for k, v in self._requests.items():
-                    # Keep recent
-                    new_v = [ts for ts in v if ts > cutoff]
-                    if not new_v:
-                        keys_to_del.append(k)
-                    else:
-                        self._requests[k] = new_v
-                for k in keys_to_del:
-                    del self._requests[k]
+    def check(self, policy: str, identifier: str, default: RateLimit):
+        """O(1): o singură valoare (TAT) per cheie; politica poate fi suprascrisă din K1_RATE_LIMITS."""
+        if policy not in self._limiter.policies:
+            self._limiter.define(policy, default)
+        return self._limiter.check(policy, identifier)
 
 
 _rate_limiter = APIRateLimiter()
 
 
 def rate_limit(max_requests: int = 30, window_seconds: int = 60):
-    """Decorator pentru rate limiting pe endpoint."""
+    """Decorator pentru rate limiting pe endpoint (politică proprie: super.<endpoint>)."""
     def decorator(func):
+        policy = f"super.{func.__name__}"
+        default = RateLimit(max_requests, window_seconds)
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
             identifier = request.remote_addr or "unknown"
+            decision = _rate_limiter.check(policy, identifier, default)
             
-            if not _rate_limiter.is_allowed(identifier, max_requests, window_seconds):
+            if not decision.allowed:
                 api_logger.warning(f"Rate limited: {identifier} on {request.path}")
-                return jsonify({
+                resp = jsonify({
                     "error": "RATE_LIMITED",
                     "message": "Prea multe cereri. Așteaptă câteva secunde."
-                }), 429
+                })
+                resp.headers["Retry-After"] = str(max(1, math.ceil(decision.retry_after)))
+                return resp, 429
             
             return func(*args, **kwargs)
         return wrapper
@@ -281,12 +265,19 @@ def chat():
     if not message:
         return jsonify({"error": "Mesajul este obligatoriu"}), 400
     
-    # Procesare AI
-    result = call_claude(message, include_context=include_context)
+    # Procesare AI: bugetul de tokeni e al sesiunii autentificate, altfel al IP-ului (tier implicit);
+    # `userId` din corp nu alege contul
+    user_id = g.get("session_user") or f"ip:{request.remote_addr or 'unknown'}"
+    result = call_claude(message, include_context=include_context, user_id=user_id)
     
     if result.get("blocked"):
         return jsonify(result), 403
     
+    if result.get("budget_exceeded"):
+        resp = jsonify(result)
+        resp.headers["Retry-After"] = str(result["budget"]["retry_after"])
+        return resp, 429
+    
     if "error" in result:
         return jsonify(result), 500
 
@@ -930,33 +921,58 @@ class AutoPilot:
     def __init__(self):
         self._running = False
         self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
         self._issues = []
         self._fixes_applied = []
         self._last_check = 0
         self._check_interval = 60  # Check every 60 seconds
     
-    def start(self):
-        """Pornește monitorizarea automată."""
-        if self._running:
-            return
+    def start(self, defer: bool = False):
+        """Pornește monitorizarea automată (defer: doar o marchează pornită; firul vine din ensure_running)."""
         self._running = True
-        self._thread = threading.Thread(target=self._monitor_loop, daemon=True)
-        self._thread.start()
+        if not defer:
+            self.ensure_running()
+    
+    def ensure_running(self):
+        """Verificare ieftină (pid): repornește firul într-un worker creat prin fork."""
+        if not self._running:
+            return
+        if self._alive():
+            return
+        with self._lock:
+            if self._alive():
+                return
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self._monitor_loop, args=(self._stop_event,),
+                                            name="autopilot", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
         api_logger.info("🤖 AUTO-PILOT started")
     
+    def _alive(self) -> bool:
+        return (self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+                and not self._stop_event.is_set())
+    
+    def pause(self):
+        """Oprește firul din acest proces, păstrând starea dorită (oprirea workerului)."""
+        self._stop_event.set()
+    
     def stop(self):
         """Oprește monitorizarea."""
         self._running = False
+        self._stop_event.set()
         api_logger.info("🤖 AUTO-PILOT stopped")
     
-    def _monitor_loop(self):
+    def _monitor_loop(self, stop_event: threading.Event):
         """Loop principal de monitorizare."""
-        while self._running:
+        while self._running and not stop_event.is_set():
             try:
                 self._run_health_check()
             except Exception as e:
                 api_logger.error(f"AUTO-PILOT error: {e}")
-            time.sleep(self._check_interval)
+            stop_event.wait(self._check_interval)
     
     def _run_health_check(self):
         """Rulează verificarea de sănătate și repară problemele."""
@@ -1118,11 +1134,23 @@ def init_super_ai(app):
     """Inițializează Super AI și înregistrează blueprint-ul."""
     app.register_blueprint(super_ai_bp)
     
-    # Start AUTO-PILOT automatically
-    _auto_pilot.start()
+    # Start AUTO-PILOT automatically (under PREFORK in each worker, see start_background)
+    _auto_pilot.start(defer=PREFORK)
     
     print("✅ Kelion Super AI Complete Routes loaded")
     print(f"   📍 Endpoints: /api/super/*")
     print(f"   🧠 Modules: Security, Brain, Vision, Voice, Extensions")
     print(f"   🤖 AUTO-PILOT: Active")
     return True
+
+
+def start_background():
+    """În fiecare worker după fork: memoria / consumul recitite din fișiere și AUTO-PILOT pornit aici."""
+    if SUPER_AI_AVAILABLE:
+        reset_brain_after_fork()
+    _auto_pilot.ensure_running()
+
+
+def stop_background():
+    """La oprirea workerului: firul AUTO-PILOT se oprește fără a schimba starea dorită."""
+    _auto_pilot.pause()
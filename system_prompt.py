@@ -0,0 +1,109 @@
+"""
+KELION AI - System Prompt Assembly
+==================================
+Builds the chat system prompt for call_openai_chat / call_deepseek_chat
+without touching the database on every turn.
+
+- The admin rules block is rendered once per process and cached under a
+  version number; admin_rules_upsert bumps the version.
+- User summaries are cached per user; set_user_summary invalidates them.
+- Both caches also expire after `ttl` seconds, so other worker processes
+  pick up changes they did not see invalidated.
+
+Layout is most-stable-first so provider prompt-prefix caching hits:
+static instructions (identical for every request), then admin rules
+(shared by all users), then the per-user summary.
+"""
+
+import threading
+from typing import Callable, Dict, List
+
+from ttl_cache import TTLCache
+
+_BASE_INSTRUCTIONS = (
+    "You are Kelion, a WebGL hologram assistant.\n"
+    "Default language: {language}.\n"
+    "Tone: friendly, conversational.\n"
+    "You should answer directly. Do not mention tools.\n"
+    "If the user asks to delete/reset memory: refuse politely. Users cannot delete data; only admin/legal process.\n"
+    "When the situation is ambiguous or information is uncertain: ask a clarifying question first.\n"
+    "If after clarification you believe the request is illegal or unsafe: refuse politely and explain limits.\n"
+)
+
+PROVIDER_INSTRUCTIONS = {
+    "deepseek": "Return: plain answer text.\n",
+    "openai": (
+        "You may use web search for up-to-date information when needed.\n"
+        "Return: plain answer text + optionally sources list.\n"
+    ),
+}
+
+
+def render_rules(rules: List[Dict]) -> str:
+    return "\n".join([f"- {r['title']}: {r['body']}" for r in rules])
+
+
+class SystemPromptBuilder:
+    """Cached, versioned system-prompt assembly."""
+
+    def __init__(self, load_rules: Callable[[], List[Dict]], load_summary: Callable[[str], str],
+                 language: str = "en", ttl: float = 60.0, summary_cache_size: int = 5000):
+        self._load_rules = load_rules
+        self._load_summary = load_summary
+        self.language = language
+        self._lock = threading.Lock()
+        self._rules_version = 0
+        self._prefixes = TTLCache(maxsize=16, ttl=ttl)       # (provider, version) -> prefix
+        self._summaries = TTLCache(maxsize=summary_cache_size, ttl=ttl)
+
+    @property
+    def rules_version(self) -> int:
+        return self._rules_version
+
+    def invalidate_rules(self):
+        """Bump the rules version; the next prompt re-renders the rules block."""
+        with self._lock:
+            self._rules_version += 1
+        self._prefixes.clear()
+
+    def invalidate_summary(self, user_id: str):
+        self._summaries.pop(user_id)
+
+    def summary(self, user_id: str) -> str:
+        cached = self._summaries.get(user_id)
+        if cached is not None:
+            return cached
+        value = self._load_summary(user_id) or ""
+        self._summaries.set(user_id, value)
+        return value
+
+    def prefix(self, provider: str) -> str:
+        """Static instructions + admin rules: identical for every user until the rules change."""
+        key = (provider, self._rules_version)
+        cached = self._prefixes.get(key)
+        if cached is not None:
+            return cached
+        value = (
+            _BASE_INSTRUCTIONS.format(language=self.language)
+            + PROVIDER_INSTRUCTIONS[provider]
+            + "ADMIN RULES (must follow):\n" + render_rules(self._load_rules()) + "\n"
+        )
+        if key[1] == self._rules_version:  # don't cache a block rendered across an invalidation
+            self._prefixes.set(key, value)
+        return value
+
+    def build(self, provider: str, user_id: str) -> str:
+        return (
+            self.prefix(provider)
+            + "USER SUMMARY (persistent memory, may be empty):\n" + self.summary(user_id) + "\n"
+        )
+
+    def stats(self) -> Dict:
+        return {
+            "rules_version": self._rules_version,
+            "prefixes": self._prefixes.stats(),
+            "summaries": self._summaries.stats(),
+        }
+
+
+__all__ = ['SystemPromptBuilder', 'PROVIDER_INSTRUCTIONS', 'render_rules']
@@ -0,0 +1,125 @@
+import sqlite3
+
+import db_migrations
+from db_migrations import Migration, MigrationError, migrate, verify
+
+
+def test_migrate_is_idempotent_and_verifies(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "k1.db"))
+    applied = migrate(con, "sqlite")
+    assert applied == [m.version for m in db_migrations.MIGRATIONS]
+    assert migrate(con, "sqlite") == []
+
+    report = verify(con, "sqlite")
+    assert report["ok"], report
+    assert report["current"] == db_migrations.head_version()
+
+    plan = con.execute(
+        "EXPLAIN QUERY PLAN SELECT role, content FROM messages WHERE user_id = ? AND session_id = ? ORDER BY created_at DESC LIMIT 14",
+        ("u", "s")
+    ).fetchall()
+    assert any("idx_messages_user_session_created" in str(row) for row in plan)
+
+
+def test_verify_detects_pending_and_newer_schema(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "k1.db"))
+    first = db_migrations.MIGRATIONS[:1]
+    migrate(con, "sqlite", first)
+    report = verify(con, "sqlite")
+    assert not report["ok"] and report["pending"]
+
+    try:
+        migrate(con, "sqlite", [Migration(0, "older", [])])
+    except MigrationError:
+        pass
+    else:
+        raise AssertionError("expected MigrationError for a database ahead of the code")
+
+
+def test_failed_migration_rolls_back(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "k1.db"))
+    broken = [Migration(1, "broken", ["CREATE TABLE t (x INTEGER)", "NOT VALID SQL"])]
+    try:
+        migrate(con, "sqlite", broken)
+    except MigrationError:
+        pass
+    assert con.execute("SELECT name FROM sqlite_master WHERE name = 't'").fetchone() is None
+    assert db_migrations.applied_versions(con, "sqlite") == {}
+
+
+def test_user_columns_backfilled_from_profile(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "k1.db"))
+    migrate(con, "sqlite", db_migrations.MIGRATIONS[:2])
+    con.execute(
+        "INSERT INTO users (user_id, created_at, last_seen_at, profile_json) VALUES (?,?,?,?)",
+        ("Alice", "t", "t", '{"email": "Alice@Example.com", "tier": "Pro", "stripe_customer": "cus_1"}')
+    )
+    con.commit()
+    migrate(con, "sqlite")
+
+    row = con.execute("SELECT user_key, email, tier, user_type, stripe_customer FROM users").fetchone()
+    assert row == ("alice", "alice@example.com", "Pro", None, "cus_1")
+    plan = con.execute("EXPLAIN QUERY PLAN SELECT user_id FROM users WHERE email = ?", ("x",)).fetchall()
+    assert any("idx_users_email" in str(r) for r in plan)
+
+
+def test_usage_counters_backfilled_from_messages(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "k1.db"))
+    migrate(con, "sqlite", db_migrations.MIGRATIONS[:3])
+    con.executemany(
+        "INSERT INTO messages (id, user_id, session_id, role, content, created_at, meta_json) VALUES (?,?,?,?,?,?,?)",
+        [("1", "u", "s", "user", "a", "2026-01-01T10:00:00+00:00", "{}"),
+         ("2", "u", "s", "assistant", "b", "2026-01-01T10:00:01+00:00", "{}"),
+         ("3", "u", "s", "user", "c", "2026-01-02T09:00:00+00:00", "{}")]
+    )
+    con.commit()
+    migrate(con, "sqlite")
+    rows = con.execute("SELECT day, messages, user_messages FROM usage_counters WHERE user_id = 'u' ORDER BY day").fetchall()
+    assert rows == [("*", 3, 2), ("2026-01-01", 2, 1), ("2026-01-02", 1, 1)]
+
+
+def test_audit_keyset_indexes_and_hourly_backfill(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "k1.db"))
+    migrate(con, "sqlite", db_migrations.MIGRATIONS[:4])
+    con.executemany(
+        "INSERT INTO audit (id, ts, user_id, session_id, action, detail_json) VALUES (?,?,?,?,?,?)",
+        [("a", "2026-01-01T10:05:00", "u", "s", "login", "{}"),
+         ("b", "2026-01-01T10:45:00", "u", "s", "login", "{}"),
+         ("c", "2026-01-01T11:00:00", "u", "s", "user_input", "{}")]
+    )
+    con.commit()
+    migrate(con, "sqlite")
+    assert verify(con, "sqlite")["ok"]
+    assert con.execute("SELECT hour, action, count FROM audit_hourly ORDER BY hour").fetchall() == [
+        ("2026-01-01T10", "login", 2), ("2026-01-01T11", "user_input", 1)]
+
+    plan = con.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM audit WHERE action = ? AND (ts, id) < (?, ?) ORDER BY ts DESC, id DESC LIMIT 10",
+        ("login", "2026-02-01", "z")
+    ).fetchall()
+    assert any("idx_audit_action_ts_id" in str(r) for r in plan)
+    assert not any("TEMP B-TREE" in str(r) for r in plan)
+
+
+def test_stats_counters_seeded_from_tables(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "k1.db"))
+    migrate(con, "sqlite", db_migrations.MIGRATIONS[:6])
+    con.executemany("INSERT INTO users (user_id, created_at, last_seen_at, profile_json) VALUES (?,?,?,?)",
+                    [("u1", "t", "t", "{}"), ("u2", "t", "t", "{}")])
+    con.execute("INSERT INTO leads (id, ts, name, email, message) VALUES ('l', 't', 'n', 'e', 'm')")
+    con.commit()
+    migrate(con, "sqlite")
+    assert dict(con.execute("SELECT name, SUM(value) FROM stats GROUP BY name").fetchall()) == {
+        "users": 2, "messages": 0, "leads": 1}
+
+
+def test_broadcast_receipts_backfilled_from_json(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "k1.db"))
+    migrate(con, "sqlite", db_migrations.MIGRATIONS[:8])
+    con.execute("INSERT INTO broadcasts (id, title, body, created_at, confirmations_json) VALUES "
+                "('b1', 't', 'b', '2026-01-01T00:00:00+00:00', '[\"u1\", \"u2\", \"u1\"]')")
+    con.commit()
+    migrate(con, "sqlite")
+    assert verify(con, "sqlite")["ok"]
+    assert con.execute("SELECT confirmed_count FROM broadcasts").fetchone() == (2,)
+    assert con.execute("SELECT user_id FROM broadcast_receipts ORDER BY user_id").fetchall() == [("u1",), ("u2",)]
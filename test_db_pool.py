@@ -0,0 +1,179 @@
+import threading
+import time
+
+import pytest
+
+from db_pool import PGConnectionPool, PoolExhaustedError, SQLiteConnectionCache, UnitOfWork
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise RuntimeError("server closed the connection")
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+def test_pool_reuses_connections():
+    created = []
+
+    def connect():
+        c = FakeConn()
+        created.append(c)
+        return c
+
+    pool = PGConnectionPool(connect, minconn=0, maxconn=2)
+    for _ in range(5):
+        with pool.connection() as con:
+            assert con.cursor() is not None
+    assert len(created) == 1
+    stats = pool.stats()
+    assert stats["acquired"] == 5
+    assert stats["created"] == 1
+    assert stats["in_use"] == 0 and stats["idle"] == 1
+
+
+def test_pool_bounds_and_timeout():
+    pool = PGConnectionPool(FakeConn, minconn=0, maxconn=1, acquire_timeout=0.05)
+    held = pool.acquire()
+    with pytest.raises(PoolExhaustedError):
+        pool.acquire()
+    assert pool.stats()["timeouts"] == 1
+
+    def give_back():
+        time.sleep(0.05)
+        pool.release(held)
+
+    threading.Thread(target=give_back).start()
+    again = pool.acquire(timeout=2)
+    assert again is held
+    assert pool.stats()["waited"] == 1
+
+
+def test_pool_recycles_expired_and_unhealthy():
+    pool = PGConnectionPool(FakeConn, minconn=0, maxconn=2, max_lifetime=0.01, health_check_after=None)
+    first = pool.acquire()
+    pool.release(first)
+    time.sleep(0.02)
+    second = pool.acquire()
+    assert second is not first and first.closed
+    pool.release(second)
+
+    pool = PGConnectionPool(FakeConn, minconn=0, maxconn=2, max_lifetime=0, health_check_after=0)
+    first = pool.acquire()
+    pool.release(first)
+    first.broken = True
+    second = pool.acquire()
+    assert second is not first
+    assert pool.stats()["health_check_failures"] == 1
+
+
+def test_sqlite_cache_is_per_thread(tmp_path):
+    cache = SQLiteConnectionCache(str(tmp_path / "k1.db"))
+    con = cache.get()
+    assert cache.get() is con
+    assert con.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    other = []
+    t = threading.Thread(target=lambda: other.append(cache.get()))
+    t.start()
+    t.join()
+    assert other[0] is not con
+    assert cache.stats()["opened"] == 2
+
+
+def _uow(tmp_path):
+    cache = SQLiteConnectionCache(str(tmp_path / "k1.db"))
+    cache.get().execute("CREATE TABLE t (v INTEGER)")
+    return UnitOfWork(cache.get, lambda c: None), cache
+
+
+def _values(cache):
+    return [r[0] for r in cache.get().execute("SELECT v FROM t ORDER BY v")]
+
+
+def test_unit_of_work_scopes_helper_failures_with_savepoints(tmp_path):
+    uow, cache = _uow(tmp_path)
+    with uow.connection() as con:
+        con.execute("INSERT INTO t VALUES (1)")
+        con.commit()                              # deferred to the unit of work
+    assert uow.pending
+
+    try:
+        with uow.connection() as con:             # a helper that fails and is caught
+            con.execute("INSERT INTO t VALUES (2)")
+            raise ValueError("helper failed")
+    except ValueError:
+        pass
+    with uow.connection() as con:
+        con.execute("INSERT INTO t VALUES (3)")
+        con.rollback()                            # undoes this block only
+        con.execute("INSERT INTO t VALUES (4)")
+
+    assert not uow.failed and uow.scope_rollbacks == 2
+    uow.commit()
+    assert _values(cache) == [1, 4]
+
+
+def test_unit_of_work_first_block_failure_and_checkpoint(tmp_path):
+    uow, cache = _uow(tmp_path)
+    with pytest.raises(ValueError):
+        with uow.connection() as con:             # nothing pending before: plain rollback
+            con.execute("INSERT INTO t VALUES (1)")
+            raise ValueError
+    assert not uow.pending
+
+    with uow.connection() as con:
+        con.execute("INSERT INTO t VALUES (2)")
+        uow.checkpoint()                          # e.g. db_checkpoint() before an upstream call
+    assert _values(cache) == [2] and not uow.active
+
+
+def test_after_commit_callbacks_follow_the_transaction(tmp_path):
+    uow, cache = _uow(tmp_path)
+    ran = []
+    with uow.connection() as con:
+        con.execute("INSERT INTO t VALUES (1)")
+        con.after_commit(lambda: ran.append(1))
+    try:
+        with uow.connection() as con:
+            con.after_commit(lambda: ran.append(2))
+            raise ValueError
+    except ValueError:
+        pass
+    uow.commit()
+    assert ran == [1]
+
+    with uow.connection() as con:
+        con.execute("INSERT INTO t VALUES (3)")
+        con.after_commit(lambda: ran.append(3))
+    uow.rollback()
+    uow.commit()
+    assert ran == [1]
@@ -0,0 +1,64 @@
+import sqlite3
+
+from db_query import PGConnection, Row, compile_statement, translate_sql
+
+
+class FakePGCursor:
+    def __init__(self, log):
+        self.log = log
+        self.description = [("user_id",), ("tier",)]
+        self.rowcount = 1
+
+    def execute(self, sql, params=None):
+        self.log.append((sql, params))
+
+    def fetchone(self):
+        return ("u1", "Pro")
+
+    def fetchall(self):
+        return [("u1", "Pro"), ("u2", None)]
+
+    def close(self):
+        pass
+
+
+class FakePGConn:
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return FakePGCursor(self.log)
+
+
+def test_translate_placeholders_outside_literals():
+    sql = "SELECT COUNT(*) c FROM messages WHERE role = 'why?' AND created_at LIKE ? AND x = '50%'"
+    assert translate_sql(sql, "sqlite") is sql
+    assert translate_sql(sql, "postgres") == (
+        "SELECT COUNT(*) c FROM messages WHERE role = 'why?' AND created_at LIKE %s AND x = '50%%'"
+    )
+    assert compile_statement("SELECT '100%'").text == "SELECT '100%'"
+    assert compile_statement("DELETE FROM t WHERE a = ? AND b = ?").prepare_text == "DELETE FROM t WHERE a = $1 AND b = $2"
+
+
+def test_row_matches_sqlite_row():
+    con = sqlite3.connect(":memory:")
+    con.row_factory = sqlite3.Row
+    expected = con.execute("SELECT 'u1' AS user_id, 'Pro' AS tier").fetchone()
+    row = Row({"user_id": 0, "tier": 1}, ("u1", "Pro"))
+    assert row[0] == expected[0] and row["tier"] == expected["tier"] and row["TIER"] == "Pro"
+    assert row.keys() == expected.keys()
+    assert dict(row) == dict(expected)
+    assert list(row) == list(expected)
+
+
+def test_pg_connection_prepares_hot_statements():
+    raw = FakePGConn()
+    con = PGConnection(raw, prepare_threshold=2)
+    sql = "SELECT user_id, tier FROM users WHERE user_id = ?"
+    for _ in range(3):
+        row = con.execute(sql, ("u1",)).fetchone()
+        assert row["tier"] == "Pro"
+    executed = [s for s, _ in raw.log]
+    assert executed[:2] == ["SELECT user_id, tier FROM users WHERE user_id = %s"] * 2
+    assert executed[2] == "PREPARE k1_stmt_1 AS SELECT user_id, tier FROM users WHERE user_id = $1"
+    assert raw.log[3] == ("EXECUTE k1_stmt_1 (%s)", ("u1",))
@@ -0,0 +1,75 @@
+from event_hub import EventHub, format_sse, sse_stream
+
+
+class FakeEvents:
+    def __init__(self):
+        self.rows = []
+
+    def add(self, event_id, channel, event_type="broadcast", data=None):
+        self.rows.append((event_id, channel, event_type, data or {}))
+        self.rows.sort()
+
+    def hub(self, **kwargs):
+        return EventHub(
+            lambda cursor, limit: [r for r in self.rows if r[0] > cursor][:limit],
+            lambda channels, after, limit: [r for r in self.rows if r[0] > after and r[1] in channels][:limit],
+            latest_id=lambda: max((r[0] for r in self.rows), default=0),
+            oldest_id=lambda: min((r[0] for r in self.rows), default=None),
+            poll_interval=60, **kwargs
+        )
+
+
+def test_fan_out_by_channel_and_resume():
+    events = FakeEvents()
+    events.add(1, "all")
+    hub = events.hub()
+    ana = hub.subscribe(["all", "user:ana"])
+    bob = hub.subscribe(["all", "user:bob"])
+    events.add(2, "user:ana", data={"id": "b2"})
+    events.add(3, "all")
+    assert hub.poll() == 2
+    assert [ana.queue.get_nowait()[0] for _ in range(2)] == [2, 3]
+    assert bob.queue.get_nowait()[0] == 3 and bob.queue.empty()
+
+    backlog, reset = hub.missed(["all", "user:bob"], 1)
+    assert [e[0] for e in backlog] == [3] and not reset
+    events.rows = events.rows[2:]   # ids 1-2 purged
+    assert hub.missed(["all"], 0)[1]
+
+
+def test_reorder_window_delivers_late_commits_once():
+    events = FakeEvents()
+    hub = events.hub(reorder_window=10)
+    sub = hub.subscribe(["all"])
+    events.add(2, "all")
+    assert hub.poll() == 1
+    events.add(1, "all")   # smaller id committed later
+    assert hub.poll() == 1 and hub.poll() == 0
+    assert [sub.queue.get_nowait()[0] for _ in range(2)] == [2, 1]
+
+
+def test_stream_replays_backlog_heartbeats_and_unsubscribes():
+    events = FakeEvents()
+    hub = events.hub(max_subscribers=1)
+    sub = hub.subscribe(["all"])
+    assert hub.subscribe(["all"]) is None   # worker full
+    backlog = [(5, "all", "broadcast", {"id": "x"})]
+    sub.offer((5, "all", "broadcast", {"id": "x"}))   # also arrives live: sent once
+    frames = list(sse_stream(hub, sub, backlog, reset=False, heartbeat=0.01, max_duration=0.05))
+    assert frames[0].startswith(b"retry:")
+    assert frames[1] == format_sse(5, "broadcast", {"id": "x"})
+    assert frames.count(frames[1]) == 1
+    assert b": heartbeat\n\n" in frames
+    assert hub.subscribers() == []
+
+
+def test_close_ends_open_streams_and_refuses_new_ones():
+    events = FakeEvents()
+    hub = events.hub()
+    sub = hub.subscribe(["all"])
+    stream = sse_stream(hub, sub, [], reset=False, heartbeat=30, max_duration=60)
+    assert next(stream).startswith(b"retry:")
+    hub.close()
+    assert list(stream) == []   # returns at once instead of waiting for a heartbeat
+    assert hub.subscribers() == [] and hub.subscribe(["all"]) is None
+    assert hub.stats()["closed"]
@@ -0,0 +1,42 @@
+import io
+import json
+import sqlite3
+import zipfile
+
+import db_migrations
+from gdpr_export import ndjson_stream, zip_stream
+
+
+def _seeded(tmp_path):
+    path = str(tmp_path / "k1.db")
+    con = sqlite3.connect(path)
+    db_migrations.migrate(con, "sqlite")
+    con.execute("INSERT INTO users (user_id, created_at, last_seen_at, profile_json) VALUES (?,?,?,?)",
+                ("u", "t", "t", json.dumps({"email": "u@x.io", "password_hash": "secret"})))
+    con.executemany(
+        "INSERT INTO messages (id, user_id, session_id, role, content, created_at, meta_json) VALUES (?,?,?,?,?,?,?)",
+        [(str(i), "u", "s", "user", f"m{i}", f"2026-01-01T00:00:{i:02d}", "{}") for i in range(25)]
+    )
+    con.commit()
+
+    def connect():
+        c = sqlite3.connect(path)
+        c.row_factory = sqlite3.Row
+        return c
+    return connect
+
+
+def test_ndjson_and_zip_exports(tmp_path):
+    connect = _seeded(tmp_path)
+    chunks = list(ndjson_stream(connect, "sqlite", "u", "now", batch_size=10))
+    assert len(chunks) > 2  # produced incrementally, not as one document
+    records = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+    assert records[0]["table"] == "export"
+    user = [r["row"] for r in records if r["table"] == "user"][0]
+    assert "password_hash" not in user["profile_json"]
+    assert [r["row"]["content"] for r in records if r["table"] == "messages"] == [f"m{i}" for i in range(25)]
+
+    data = b"".join(zip_stream(connect, "sqlite", "u", "now", batch_size=10))
+    zf = zipfile.ZipFile(io.BytesIO(data))
+    assert zf.testzip() is None
+    assert len(zf.read("messages.ndjson").splitlines()) == 25
@@ -0,0 +1,64 @@
+import sqlite3
+
+import db_migrations
+from message_search import fts5_query, search_messages
+
+
+def _db(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "k1.db"))
+    con.row_factory = sqlite3.Row
+    db_migrations.migrate(con, "sqlite")
+    return con
+
+
+def _add(con, mid, user_id, role, content, created_at):
+    con.execute(
+        "INSERT INTO messages (id, user_id, session_id, role, content, created_at, meta_json) VALUES (?,?,?,?,?,?,?)",
+        (mid, user_id, "s1", role, content, created_at, "{}")
+    )
+
+
+def test_fts5_query_quotes_user_input():
+    assert fts5_query('vreau "bilete" AND tren*') == '"vreau" "bilete" "AND" "tren"*'
+    assert fts5_query("   ") == ""
+
+
+def test_search_ranks_filters_and_tracks_writes(tmp_path):
+    con = _db(tmp_path)
+    _add(con, "1", "ana", "user", "Vreau bilete de tren spre Cluj", "2026-01-01T10:00:00")
+    _add(con, "2", "ana", "assistant", "Trenul spre Cluj pleacă la 10. Bilete tren tren.", "2026-01-01T10:00:05")
+    _add(con, "3", "bob", "user", "Ce tren merge la Iași?", "2026-02-01T10:00:00")
+    con.commit()
+
+    hits = search_messages(con, "sqlite", "tren")
+    assert {h["id"] for h in hits} == {"1", "2", "3"}
+    assert hits[0]["rank"] >= hits[-1]["rank"]
+    assert "[tren]" in hits[0]["snippet"].lower()
+
+    assert [h["id"] for h in search_messages(con, "sqlite", "tren", user_id="ana", role="user")] == ["1"]
+    assert [h["id"] for h in search_messages(con, "sqlite", "tren", since="2026-01-15")] == ["3"]
+    assert [h["id"] for h in search_messages(con, "sqlite", "iasi")] == ["3"]  # diacritics folded
+
+    con.execute("DELETE FROM messages WHERE user_id = 'bob'")
+    con.commit()
+    assert search_messages(con, "sqlite", "iasi") == []
+
+
+def test_fts_keyed_on_seq_survives_vacuum(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "k1.db"))
+    con.row_factory = sqlite3.Row
+    db_migrations.migrate(con, "sqlite", [m for m in db_migrations.MIGRATIONS if m.version < 14])
+    for i in range(6):
+        _add(con, f"m{i}", "ana", "user", f"mesaj {i} cuvant{i}", f"2026-01-0{i + 1}T10:00:00")
+    con.execute("DELETE FROM messages WHERE id IN ('m0', 'm2')")   # gaps VACUUM could close
+    con.commit()
+
+    assert db_migrations.migrate(con, "sqlite") == [14]
+    con.execute("VACUUM")
+    _add(con, "m9", "ana", "user", "mesaj nou cuvant9", "2026-01-09T10:00:00")
+    con.commit()
+
+    for i in (1, 3, 4, 5, 9):
+        assert [h["id"] for h in search_messages(con, "sqlite", f"cuvant{i}")] == [f"m{i}"]
+    assert search_messages(con, "sqlite", "cuvant2") == []
+    assert db_migrations.verify(con, "sqlite")["ok"]
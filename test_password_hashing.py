@@ -0,0 +1,75 @@
+import hashlib
+import threading
+
+import pytest
+
+import password_hashing
+from password_hashing import PasswordHasher, PasswordHasherBusy, check_password, hash_password_sync
+
+
+def test_check_password_reads_legacy_formats_and_flags_rehash():
+    salt = "abc123"
+    app_sha = "sha256$%s$%s" % (salt, hashlib.sha256(("pw" + salt).encode()).hexdigest())
+    core_sha = "sha256$%s$%s" % (salt, hashlib.sha256(f"{salt}:pw".encode()).hexdigest())
+    pbkdf2 = "pbkdf2$%s$%s" % (salt, hashlib.pbkdf2_hmac("sha256", b"pw", salt.encode(), 100000).hex())
+    stretched = hashlib.sha256(("pw" + salt).encode()).hexdigest()
+    for _ in range(10000):
+        stretched = hashlib.sha256(stretched.encode()).hexdigest()
+    stretched = f"sha256_stretched${salt}${stretched}"
+
+    for stored in (app_sha, core_sha, pbkdf2, stretched):
+        assert check_password("pw", stored) == (True, True)
+        assert check_password("nope", stored) == (False, False)
+
+    current = hash_password_sync("pw", rounds=4)
+    assert check_password("pw", current, rounds=4) == (True, False)
+    assert check_password("pw", current, rounds=5) == (True, True)   # cost raised since
+    assert check_password("pw", "bcrypt$" + current, rounds=4) == (True, True)
+    assert check_password("pw", "garbage") == (False, False)
+
+
+def test_hasher_rejects_when_saturated_and_reports_metrics(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def slow(password, rounds):
+        started.set()
+        release.wait(2)
+        return hash_password_sync(password, rounds)
+
+    monkeypatch.setattr(password_hashing, "hash_password_sync", slow)
+    hasher = PasswordHasher(workers=0, max_queue=0, rounds=4)
+    worker = threading.Thread(target=hasher.hash, args=("pw",))
+    worker.start()
+    assert started.wait(1)
+    with pytest.raises(PasswordHasherBusy):
+        hasher.check("pw", "sha256$a$b")
+    assert hasher.stats()["in_flight"] == 1
+    release.set()
+    worker.join(2)
+
+    assert hasher.check("pw", "sha256$a$b") == (False, False)
+    stats = hasher.stats()
+    assert stats["rejected"] == 1 and stats["hash"] == 1 and stats["verify"] == 1
+    assert stats["in_flight"] == 0 and stats["hash_ms_p95"] is not None
+
+
+def test_hasher_process_pool_round_trip():
+    hasher = PasswordHasher(workers=1, max_queue=1, rounds=4)
+    try:
+        hashed = hasher.hash("secret")
+        assert hasher.check("secret", hashed) == (True, False)
+        assert hasher.check("wrong", hashed) == (False, False)
+    finally:
+        hasher.close()
+
+
+def test_pool_processes_come_from_a_forkserver_and_share_the_cpus(monkeypatch):
+    import multiprocessing
+    from password_hashing import _pool_context, default_pool_size
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        assert _pool_context().get_start_method() == "forkserver"
+    monkeypatch.setattr("os.cpu_count", lambda: 8)
+    monkeypatch.setenv("K1_WEB_WORKERS", "4")
+    assert default_pool_size() == 2
+    monkeypatch.setenv("K1_WEB_WORKERS", "16")
+    assert default_pool_size() == 1
@@ -0,0 +1,29 @@
+import threading
+
+from periodic import PeriodicJob
+
+
+def test_periodic_job_runs_wakes_and_records_failures():
+    calls = []
+    ran = threading.Event()
+
+    def work():
+        calls.append(1)
+        ran.set()
+        if len(calls) == 2:
+            raise RuntimeError("boom")
+
+    job = PeriodicJob("test", work, interval=60)
+    job.ensure_running()
+    job.ensure_running()  # idempotent in the same process
+    assert not ran.wait(0.05)  # first run waits for the interval
+
+    job.wake()
+    assert ran.wait(1)
+    job.stop()
+    job._thread.join(1)
+    job.run_now()
+
+    stats = job.stats()
+    assert stats["runs"] == 2 and stats["failures"] == 1
+    assert stats["last_error"] == "boom"
@@ -0,0 +1,34 @@
+from pricing_snapshot import PricingSnapshot, etag_matches
+
+
+def test_snapshot_is_reused_until_invalidated():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return {"currency": "USD", "tiers": [{"id": "PRO", "price": 59 + len(loads)}]}
+
+    cache = PricingSnapshot(load, ttl=60)
+    first = cache.get()
+    assert cache.get() is first and len(loads) == 1
+    assert first.body.startswith(b'{"currency":"USD"')
+
+    cache.invalidate()
+    second = cache.get()
+    assert len(loads) == 2 and second.etag != first.etag and second.version == 1
+    assert cache.stats()["builds"] == 2 and cache.stats()["hits"] == 1
+
+
+def test_snapshot_expires_and_etag_is_content_hash():
+    cache = PricingSnapshot(lambda: {"tiers": []}, ttl=0)
+    a, b = cache.get(), cache.get()
+    assert a is not b and a.etag == b.etag   # rebuilt, same content -> same validator
+
+
+def test_etag_matches_if_none_match_forms():
+    etag = '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('"x", W/"abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"abd"', etag)
+    assert not etag_matches(None, etag)
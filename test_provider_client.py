@@ -0,0 +1,95 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from provider_client import ProviderClient, host_key
+
+
+class Upstream(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+    script = []                     # (status, headers) answered in order, then 200
+    seen = []
+
+    def _answer(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        Upstream.seen.append((self.command, self.path, body, self.client_address[1]))
+        status, headers = Upstream.script.pop(0) if Upstream.script else (200, {})
+        payload = b"" if self.command == "HEAD" else b'{"ok": true}'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_HEAD = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    Upstream.script, Upstream.seen = [], []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_calls_reuse_one_connection_per_host(upstream):
+    client = ProviderClient(pool_size=2)
+    assert client.warm([upstream + "/v1"]) == {host_key(upstream): True}
+    for i in range(3):
+        r = client.post(upstream + "/v1/chat", json={"i": i}, timeout=5)
+        assert r.json() == {"ok": True}
+    ports = {port for _, _, _, port in Upstream.seen}
+    assert len(ports) == 1                       # warm-up and all three calls on one socket
+
+    host = client.stats()["hosts"][host_key(upstream)]
+    assert host["requests"] == 3 and host["2xx"] == 3 and host["connections_opened"] == 1
+    assert host["latency_ms"]["p50"] is not None
+    client.close()
+
+
+def test_retries_429_and_5xx_with_backoff_then_returns_last_answer(upstream):
+    waits = []
+    client = ProviderClient(retries=2, backoff=0.5, backoff_max=8, sleep=waits.append)
+
+    Upstream.script = [(503, {}), (429, {"Retry-After": "3"})]
+    r = client.post(upstream + "/tts", data=b"hello", timeout=5)
+    assert r.status_code == 200
+    assert [body for _, _, body, _ in Upstream.seen] == [b"hello"] * 3
+    assert 0 <= waits[0] <= 0.5 and waits[1] == 3.0
+
+    Upstream.script = [(500, {})] * 3
+    assert client.get(upstream + "/x", timeout=5).status_code == 500
+    Upstream.script = [(429, {"Retry-After": "120"})]     # longer than backoff_max: not waited for
+    assert client.get(upstream + "/x", timeout=5, retries=5).status_code == 429
+    Upstream.script = [(404, {})]
+    assert client.get(upstream + "/x", timeout=5).status_code == 404
+
+    host = client.stats()["hosts"][host_key(upstream)]
+    assert host["requests"] == 4 and host["attempts"] == 8 and host["retries"] == 4
+    assert host["2xx"] == 1 and host["4xx"] == 2 and host["5xx"] == 1
+
+
+def test_connection_errors_retry_then_raise():
+    waits = []
+    client = ProviderClient(retries=1, connect_timeout=0.5, sleep=waits.append)
+    with pytest.raises(requests.ConnectionError):
+        client.get("http://127.0.0.1:9/", timeout=1)     # discard port: refused
+    host = client.stats()["hosts"]["http://127.0.0.1:9"]
+    assert host["attempts"] == 2 and host["errors"] == 1 and len(waits) == 1
+
+
+def test_child_process_gets_fresh_sessions(upstream):
+    client = ProviderClient()
+    parent = client.session(upstream)
+    client._pid = -1                               # as seen from a forked child
+    assert client.session(upstream) is not parent
+    assert client.stats()["hosts"][host_key(upstream)]["requests"] == 0
@@ -0,0 +1,66 @@
+import multiprocessing
+
+import pytest
+
+from rate_limiter import MemoryBackend, RateLimit, RateLimiter, SQLiteBackend, parse_rate
+
+
+def _burst(backend, rate, now=1000.0, n=5):
+    return [backend.acquire("k", rate, now) for _ in range(n)]
+
+
+@pytest.mark.parametrize("make", [lambda tmp: MemoryBackend(), lambda tmp: SQLiteBackend(str(tmp / "rl.db"))])
+def test_gcra_allows_burst_then_paces(tmp_path, make):
+    backend = make(tmp_path)
+    rate = RateLimit(3, 60)
+    decisions = _burst(backend, rate, n=4)
+    assert [d.allowed for d in decisions] == [True, True, True, False]
+    assert [d.remaining for d in decisions[:3]] == [2, 1, 0]
+    assert decisions[3].retry_after == pytest.approx(20)
+    assert not backend.acquire("k", rate, 1019.0).allowed
+    assert backend.acquire("k", rate, 1020.0).allowed        # one slot per period/limit
+    assert backend.acquire("other", rate, 1020.0).allowed   # keys are independent
+
+
+def test_memory_backend_is_bounded():
+    backend = MemoryBackend(max_keys=10)
+    for i in range(50):
+        backend.acquire(f"k{i}", RateLimit(1, 60), 1000.0)
+    stats = backend.stats()
+    assert stats["keys"] <= 10 and stats["evicted"] >= 40
+    backend.acquire("late", RateLimit(1, 60), 2000.0)        # each write also drops up to 2 expired keys
+    assert backend.stats()["keys"] == 9
+
+
+def test_policies_tiers_overrides_and_counters():
+    limiter = RateLimiter(MemoryBackend(), overrides="chat=2/60,chat@Pro=4/60,bad=x")
+    limiter.define("chat", RateLimit(1, 60), tiers={"Elite": RateLimit(9, 60)})
+    assert str(limiter.policies["chat"].rate_for()) == "2/60"
+    assert str(limiter.policies["chat"].rate_for("Pro")) == "4/60"
+    assert str(limiter.policies["chat"].rate_for("Elite")) == "9/60"
+    results = [limiter.check("chat", "u1").allowed for _ in range(3)]
+    assert results == [True, True, False]
+    assert limiter.check("chat", "u2", tier="Pro").allowed
+    stats = limiter.stats()["policies"]["chat"]
+    assert stats["allowed"] == 3 and stats["rejected"] == 1
+    with pytest.raises(KeyError):
+        limiter.check("missing", "u1")
+    with pytest.raises(ValueError):
+        parse_rate("0/60")
+
+
+def _hammer(path, n, out):
+    backend = SQLiteBackend(path)
+    out.put(sum(backend.acquire("shared", RateLimit(50, 3600), 1000.0).allowed for _ in range(n)))
+
+
+def test_sqlite_backend_is_shared_across_processes(tmp_path):
+    path = str(tmp_path / "shared.db")
+    SQLiteBackend(path)
+    out = multiprocessing.get_context("fork").Queue()
+    procs = [multiprocessing.get_context("fork").Process(target=_hammer, args=(path, 40, out)) for _ in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(20)
+    assert sum(out.get(timeout=5) for _ in procs) == 50
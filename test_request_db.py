@@ -0,0 +1,171 @@
+import os
+import tempfile
+
+os.environ.setdefault("K1_DB_PATH", os.path.join(tempfile.mkdtemp(), "k1.db"))
+os.environ.setdefault("K1_PREFORK", "true")   # no background threads at import
+os.environ.setdefault("K1_TOKEN_HMAC_KEY", "test-token-key")
+
+import pytest  # noqa: E402
+
+import app  # noqa: E402
+from db_pool import UnitOfWork  # noqa: E402
+
+
+def test_failed_request_commit_answers_json_500(monkeypatch):
+    def broken_commit(self):
+        raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr(UnitOfWork, "commit", broken_commit)
+    response = app.app.test_client().get("/api/live-users")
+    assert response.status_code == 500
+    assert response.get_json() == {"error": "Database commit failed"}
+
+
+def test_raw_db_in_a_request_is_not_the_unit_of_work_connection():
+    with app.app.test_request_context():
+        with app.db() as con:
+            con.execute("INSERT INTO stats (name, shard, value) VALUES ('uow_probe', 0, 1)")
+        with app._raw_db() as out_of_band:
+            assert out_of_band.execute("SELECT COUNT(*) FROM stats WHERE name = 'uow_probe'").fetchone()[0] == 0
+        app._request_uow().rollback()
+
+
+def test_token_key_is_required_or_derived(monkeypatch):
+    monkeypatch.delenv("K1_TOKEN_HMAC_KEY")
+    monkeypatch.setattr(app, "K1_ADMIN_TOKEN", app._DEFAULT_ADMIN_TOKEN)
+    with pytest.raises(RuntimeError):
+        app._token_hmac_key()
+    monkeypatch.setattr(app, "K1_ADMIN_TOKEN", "deployment-admin-secret")
+    derived = app._token_hmac_key()
+    assert derived and derived != "deployment-admin-secret"
+
+
+def test_used_tokens_expire_and_purge_uses_the_expiry_index():
+    with app.app.test_request_context():
+        token = app.create_token("tok_user", "reset")
+        assert app.verify_token("tok_user", token, "reset")
+        assert not app.verify_token("tok_user", token, "reset")
+        app.db_checkpoint()
+    assert app.purge_tokens() >= 1
+    with app._raw_db() as con:
+        assert con.execute("SELECT COUNT(*) FROM tokens WHERE user_id = 'tok_user'").fetchone()[0] == 0
+        plan = con.execute("EXPLAIN QUERY PLAN DELETE FROM tokens WHERE expires_at < ?", ("x",)).fetchall()
+    assert any("idx_tokens_expires_at" in str(tuple(row)) for row in plan)
+
+
+def test_rate_limit_identity_comes_from_the_session_token_not_the_body(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "user_tier", lambda user_id: "Elite")
+    allowed = app.rate_limiter.check("api_register", "probe")
+    monkeypatch.setattr(app.rate_limiter, "check", lambda policy, key, tier=None: calls.append((policy, key, tier)) or allowed)
+    body = {"userId": "victim", "text": "hi"}
+    with app.app.test_request_context("/api/chat", method="POST", json=body, environ_base={"REMOTE_ADDR": "10.0.0.9"}):
+        app.limit_check()
+    token = app.session_tokens.issue("ana.b")
+    with app.app.test_request_context("/api/chat", method="POST", json=body, headers={"X-Session-Token": token}):
+        app.limit_check()
+    assert calls[1] == ("api_chat", "ip:10.0.0.9", None)
+    assert calls[3] == ("api_chat", "user:ana.b", "Elite")
+
+
+def test_anonymous_super_chat_is_metered_on_the_client_ip(monkeypatch):
+    import super_ai_routes
+
+    seen = []
+    monkeypatch.setattr(super_ai_routes, "call_claude",
+                        lambda message, include_context=True, user_id=None: seen.append(user_id) or {"error": "stop"})
+    client = app.app.test_client()
+    client.post("/api/super/chat", json={"message": "hi", "userId": "victim"}, environ_base={"REMOTE_ADDR": "10.0.0.7"})
+    client.post("/api/super/chat", json={"message": "hi", "userId": "victim"},
+                headers={"X-Session-Token": app.session_tokens.issue("ana")}, environ_base={"REMOTE_ADDR": "10.0.0.7"})
+    assert seen == ["ip:10.0.0.7", "ana"]
+
+
+def test_event_streams_leave_half_the_worker_threads_free():
+    assert app.EVENTS_MAX_STREAMS == max(1, app.WEB_THREADS // 2) <= 100
+    held = [app.events_hub.subscribe(["all"]) for _ in range(app.EVENTS_MAX_STREAMS)]
+    try:
+        assert all(held)
+        response = app.app.test_client().get("/api/events")
+        assert response.status_code == 503 and response.headers["Retry-After"] == "5"
+    finally:
+        for sub in held:
+            app.events_hub.unsubscribe(sub)
+
+
+def test_chat_tokens_are_charged_to_the_session_or_ip_not_the_body_user_id(monkeypatch):
+    charged = []
+
+    def reserve(user_id, estimate, enforce=True):
+        charged.append(("reserve", user_id))
+        raise RuntimeError("no upstream in tests")
+
+    monkeypatch.setattr(app.token_ledger, "check", lambda user_id, estimate: charged.append(("check", user_id)))
+    monkeypatch.setattr(app.token_ledger, "reserve", reserve)
+    monkeypatch.setattr(app, "AI_PROVIDER", "deepseek")
+    monkeypatch.setattr(app, "DEEPSEEK_API_KEY", "test-key")
+    client = app.app.test_client()
+    body = {"userId": "elite_victim", "text": "hi"}
+    assert client.post("/api/chat", json=body, environ_base={"REMOTE_ADDR": "10.0.0.8"}).status_code == 200
+    assert client.post("/api/chat", json=body, headers={"X-Session-Token": app.session_tokens.issue("bob")},
+                       environ_base={"REMOTE_ADDR": "10.0.0.8"}).status_code == 200
+    assert charged == [("check", "ip:10.0.0.8"), ("reserve", "ip:10.0.0.8"), ("check", "bob"), ("reserve", "bob")]
+    assert app.get_usage("ip:10.0.0.8", app.utc_now_iso()[:10])[1] == 1
+    assert app.get_usage("elite_victim", app.utc_now_iso()[:10])[1] == 1   # the conversation row, not the budget
+
+
+def test_cors_preflight_allows_the_session_token_header():
+    response = app.app.test_client().options("/api/chat", headers={
+        "Origin": "https://example.com", "Access-Control-Request-Method": "POST",
+        "Access-Control-Request-Headers": "content-type, x-session-token"})
+    assert "X-Session-Token" in response.headers["Access-Control-Allow-Headers"]
+
+
+def test_private_event_channel_needs_a_session_token():
+    client = app.app.test_client()
+    opened = []
+    for query in ("user_id=victim", "user_id=victim&session_token=" + app.session_tokens.issue("ana")):
+        before = set(app.events_hub.subscribers())
+        response = client.get("/api/events?" + query)
+        assert response.status_code == 200
+        (sub,) = set(app.events_hub.subscribers()) - before
+        opened.append(sub.channels)
+        response.close()
+    assert opened == [frozenset({"all"}), frozenset({"all", "user:ana"})]
+
+
+def test_usage_cache_miss_after_a_bump_in_the_same_request_counts_once():
+    day = app.utc_now_iso()[:10]
+    with app.app.test_request_context():
+        assert app.get_usage("cnt_user", day) == (0, 0)          # cached before the bump
+        app.add_message("cnt_user", "s", "user", "hi")
+        app._usage_cache.pop(("cnt_user", app.USAGE_LIFETIME))  # evicted mid-request
+        assert app.get_usage("cnt_user") == (1, 1)               # sees the uncommitted +1, not cached
+        app.db_checkpoint()
+        assert app.get_usage("cnt_user", day) == (1, 1)          # cached entry bumped on commit
+        assert app.get_usage("cnt_user") == (1, 1)
+        app.add_message("cnt_user", "s", "assistant", "hello")
+        app.db_checkpoint()
+    assert app.get_usage("cnt_user") == (2, 1) and app.get_usage("cnt_user", day) == (2, 1)
+
+
+def test_cache_invalidation_waits_for_the_request_commit_without_forcing_it():
+    ran = []
+    with app.app.test_request_context():
+        app.on_request_commit(lambda: ran.append("idle"))            # nothing pending: runs now
+        with app.db() as con:
+            con.execute("INSERT INTO stats (name, shard, value) VALUES ('invalidate_probe', 0, 1)")
+        app.on_request_commit(lambda: ran.append("rolled back"))
+        uow = app._request_uow()
+        with app._raw_db() as out_of_band:                             # no early commit
+            assert out_of_band.execute("SELECT COUNT(*) FROM stats WHERE name = 'invalidate_probe'").fetchone()[0] == 0
+        uow.rollback()
+        with app.db() as con:
+            con.execute("INSERT INTO stats (name, shard, value) VALUES ('invalidate_probe', 0, 1)")
+        app.on_request_commit(lambda: ran.append("committed"))
+        assert ran == ["idle"]
+        uow.commit()
+        app.db_checkpoint()
+    assert ran == ["idle", "committed"]
+    with app._raw_db() as con:
+        con.execute("DELETE FROM stats WHERE name = 'invalidate_probe'")
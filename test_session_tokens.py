@@ -0,0 +1,39 @@
+import hashlib
+import hmac
+
+import pytest
+
+from session_tokens import SessionTokens
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_issue_verify_expiry_and_forgery():
+    clock = Clock(1_790_000_000.0)
+    tokens = SessionTokens("k", hours=1, clock=clock)
+    token = tokens.issue("ana.b")                    # dots in the user id are fine
+    assert tokens.verify(token) == "ana.b"
+
+    body, _, signature = token.rpartition(".")
+    assert tokens.verify(f"{body}.{'0' * len(signature)}") is None
+    assert tokens.verify(token.replace("ana.b", "bob", 1)) is None
+    assert SessionTokens("other", clock=clock).verify(token) is None
+    assert tokens.verify("") is None and tokens.verify("no-dots") is None
+
+    clock.now += 3601
+    assert tokens.verify(token) is None
+
+
+def test_signature_is_domain_separated_from_plain_digests():
+    tokens = SessionTokens("k")
+    body, _, signature = tokens.issue("ana").rpartition(".")
+    # the reset / verify token digest construction over the same bytes must not match
+    assert signature != hmac.new(b"k", body.encode(), hashlib.sha256).hexdigest()
+    with pytest.raises(ValueError):
+        SessionTokens("")
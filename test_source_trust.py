@@ -0,0 +1,33 @@
+from source_trust import SourceTrustMap, SuffixTrie
+
+
+def test_suffix_trie_matches_domain_and_subdomains():
+    trie = SuffixTrie.from_csv(" Wikipedia.org, ,gov.ro ")
+    assert len(trie) == 2
+    assert trie.matches("wikipedia.org") and trie.matches("en.wikipedia.org")
+    assert trie.matches("www.anaf.gov.ro")
+    assert not trie.matches("notwikipedia.org") and not trie.matches("org") and not trie.matches("")
+
+
+def test_trust_map_single_batched_fallback():
+    table = {"a.com": 90, "b.com": 10, "c.com": 70}
+    queries = []
+
+    def load_all(limit):
+        return dict(list(table.items())[:limit])
+
+    def load_some(domains):
+        queries.append(list(domains))
+        return {d: table[d] for d in domains if d in table}
+
+    complete = SourceTrustMap(load_all, load_some)
+    assert complete.lookup_many(["a.com", "zzz.com"]) == {"a.com": 90, "zzz.com": 50}
+    assert queries == []
+
+    partial = SourceTrustMap(load_all, load_some, full_load_limit=1)
+    assert partial.lookup_many(["a.com", "b.com", "c.com", "x.com"]) == {"a.com": 90, "b.com": 10, "c.com": 70, "x.com": 50}
+    assert partial.lookup_many(["b.com", "x.com"]) == {"b.com": 10, "x.com": 50}
+    assert queries == [["b.com", "c.com", "x.com"]]
+
+    partial.set("x.com", 99)
+    assert partial.get("x.com") == 99
@@ -0,0 +1,65 @@
+import gzip
+import json
+import os
+
+from static_assets import accepted_encodings, build, minify_css, minify_js
+
+
+def test_minify_js_keeps_strings_templates_regexes_and_line_breaks():
+    src = (
+        "// header\n"
+        "const a = 'x // not a comment';  /* block */\n"
+        "let t = `line ${ {k: 1}.k } // kept`;\n"
+        "const re = /[/*]+\\//g, half = a.length / 2;\n"
+        "return x\n"
+        "++y\n"
+    )
+    out = minify_js(src)
+    assert "header" not in out and "block" not in out
+    assert "'x // not a comment'" in out
+    assert "`line ${ {k: 1}.k } // kept`" in out
+    assert "/[/*]+\\//g" in out and "a.length/2" in out
+    assert "return x\n++y" in out
+    assert minify_js(out) == out
+
+
+def test_minify_css():
+    out = minify_css("a :hover { color: red ; }\n/* c */ .b > .c , .d { width: calc(100% - 2px); content: '/* x */' }")
+    assert out == "a :hover{color:red}.b>.c,.d{width:calc(100% - 2px);content:'/* x */'}\n"
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("gzip, deflate, br") == {"gzip", "deflate", "br"}
+    assert accepted_encodings("br;q=0, gzip;q=0.5") == {"gzip"}
+    assert accepted_encodings("*;q=1, gzip;q=0") == {"br"}
+    assert accepted_encodings("") == set()
+
+
+def test_build_hashes_rewrites_and_compresses(tmp_path):
+    src = tmp_path / "static"
+    (src / "js").mkdir(parents=True)
+    (src / "css").mkdir()
+    (src / "audio").mkdir()
+    (src / "js" / "dep.js").write_text("export const x = 1;\n" * 60)
+    (src / "js" / "main.js").write_text('import { x } from "./dep.js";\nimport * as T from "three";\nconsole.log(x);\n')
+    (src / "css" / "site.css").write_text("body { background: url('/img/bg.png') }\n")
+    (src / "img").mkdir()
+    (src / "img" / "bg.png").write_bytes(b"\x89PNG")
+    (src / "audio" / "a.js").write_text("skipped")
+    (src / "index.html").write_text(
+        '<link href="/css/site.css"><script type="module" src="/js/main.js?v=1"></script>'
+        '<a href="https://x.io/js/main.js">' + " " * 600)
+
+    out = tmp_path / "build"
+    manifest = build(str(src), str(out))
+    assert set(manifest) == {"js/dep.js", "js/main.js", "css/site.css", "img/bg.png"}
+    assert json.loads((out / "manifest.json").read_text()) == manifest
+
+    main = (out / manifest["js/main.js"]).read_text()
+    assert '"./' + os.path.basename(manifest["js/dep.js"]) + '"' in main and 'from"three"' in main
+    assert manifest["img/bg.png"] in (out / manifest["css/site.css"]).read_text()
+    html = (out / "index.html").read_text()
+    assert f'src="/{manifest["js/main.js"]}?v=1"' in html and f'href="/{manifest["css/site.css"]}"' in html
+    assert 'href="https://x.io/js/main.js"' in html
+    assert gzip.decompress((out / (manifest["js/dep.js"] + ".gz")).read_bytes()).startswith(b"export const x=1;")
+    assert not (out / "audio").exists()
@@ -0,0 +1,35 @@
+from system_prompt import SystemPromptBuilder
+
+
+def test_prompt_is_cached_until_invalidated():
+    calls = {"rules": 0, "summary": 0}
+    rules = [{"title": "Be kind", "body": "Always."}]
+    summaries = {"u1": "Likes tea."}
+
+    def load_rules():
+        calls["rules"] += 1
+        return list(rules)
+
+    def load_summary(user_id):
+        calls["summary"] += 1
+        return summaries.get(user_id, "")
+
+    builder = SystemPromptBuilder(load_rules, load_summary, language="ro")
+    first = builder.build("openai", "u1")
+    assert builder.build("openai", "u1") == first
+    assert calls == {"rules": 1, "summary": 1}
+    assert first.index("Default language: ro.") < first.index("ADMIN RULES") < first.index("Likes tea.")
+
+    # every user shares the same prefix (static text + rules)
+    other = builder.build("openai", "u2")
+    assert other.startswith(builder.prefix("openai")) and first.startswith(builder.prefix("openai"))
+    assert calls["rules"] == 1
+
+    rules.append({"title": "New", "body": "Rule."})
+    builder.invalidate_rules()
+    assert "- New: Rule." in builder.build("openai", "u1")
+
+    summaries["u1"] = "Likes coffee."
+    assert "Likes tea." in builder.build("deepseek", "u1")
+    builder.invalidate_summary("u1")
+    assert "Likes coffee." in builder.build("deepseek", "u1")
@@ -0,0 +1,92 @@
+import sqlite3
+
+import pytest
+
+import db_migrations
+from token_budget import (Budget, TokenBudgetExceeded, TokenLedger, estimate_tokens, parse_budgets,
+                          parse_prices, usage_tokens)
+
+
+def _ledger(budgets, tier="Starter", stored=(0, 0)):
+    recorded = []
+    ledger = TokenLedger(lambda user_id, day, month: stored,
+                         lambda *row: recorded.append(row),
+                         lambda user_id: tier,
+                         budgets=budgets, prices={"gpt-4o": (2.5, 10.0)})
+    return ledger, recorded
+
+
+def test_parsing_and_usage_shapes():
+    budgets = parse_budgets("Pro=10/100, Elite=0/0, bad=x")
+    assert budgets["Pro"] == Budget(10, 100) and budgets["Elite"] == Budget(0, 0)
+    assert "bad" not in budgets and budgets["Starter"] == Budget(50_000, 1_000_000)
+    assert parse_prices("m=1/2")["m"] == (1.0, 2.0)
+
+    assert usage_tokens({"prompt_tokens": 3, "completion_tokens": 4}) == (3, 4)
+    assert usage_tokens({"input_tokens": 5, "output_tokens": 6}) == (5, 6)
+    assert usage_tokens(None) == (None, None)
+    assert estimate_tokens("a" * 40, "") == 10 + 4 + 4
+
+
+def test_reserve_settle_release_against_budget():
+    ledger, recorded = _ledger({"Starter": Budget(1000, 0)}, stored=(600, 600))
+
+    first = ledger.reserve("u", 300)
+    with pytest.raises(TokenBudgetExceeded) as e:   # 600 used + 300 in flight + 200 > 1000
+        ledger.reserve("u", 200)
+    assert e.value.period == "day" and e.value.used == 900 and e.value.retry_after >= 1
+
+    cost = ledger.settle(first, "gpt-4o-2024-08-06", 100, 50)
+    assert cost == pytest.approx((100 * 2.5 + 50 * 10.0) / 1_000_000)
+    assert recorded == [("u", first.day, first.month, 100, 50, cost)]
+    assert ledger.used("u", first.day, first.month) == (750, 750)
+
+    second = ledger.reserve("u", 200)   # fits now that the reservation became 150 real tokens
+    ledger.release(second)
+    ledger.check("u", 250)
+    with pytest.raises(TokenBudgetExceeded):
+        ledger.check("u", 251)
+    stats = ledger.stats()
+    assert stats["in_flight_tokens"] == 0 and stats["settled"] == 1 and stats["released"] == 1
+
+
+def test_monthly_budget_unlimited_tiers_and_unmetered_calls():
+    ledger, _ = _ledger({"Starter": Budget(0, 500)}, stored=(0, 450))
+    with pytest.raises(TokenBudgetExceeded) as e:
+        ledger.reserve("u", 100)
+    assert e.value.period == "month"
+    ledger.release(ledger.reserve("u", 100, enforce=False))   # accounted, not enforced
+
+    elite, _ = _ledger({"Elite": Budget(0, 0)}, tier="Elite", stored=(10 ** 9, 10 ** 9))
+    elite.release(elite.reserve("u", 10 ** 6))
+    assert elite.status("u")["day"]["remaining"] is None
+
+
+def test_settle_keeps_going_when_the_write_fails():
+    def broken(*row):
+        raise sqlite3.OperationalError("locked")
+
+    ledger = TokenLedger(lambda *a: (0, 0), broken, lambda u: "Starter")
+    ledger.settle(ledger.reserve("u", 10), "unknown-model", None, None)
+    stats = ledger.stats()
+    assert stats["record_errors"] == 1 and stats["input_tokens"] == 10 and stats["cost_usd"] == 0
+
+
+def test_token_usage_table_upsert(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "k1.db"))
+    db_migrations.migrate(con, "sqlite")
+    for _ in range(2):
+        con.execute(
+            """INSERT INTO token_usage (user_id, period, input_tokens, output_tokens, cost_usd, requests)
+               VALUES (?,?,?,?,?,1)
+               ON CONFLICT(user_id, period) DO UPDATE SET
+               input_tokens = token_usage.input_tokens + excluded.input_tokens,
+               output_tokens = token_usage.output_tokens + excluded.output_tokens,
+               cost_usd = token_usage.cost_usd + excluded.cost_usd,
+               requests = token_usage.requests + 1""",
+            ("u", "2026-10", 10, 5, 0.25)
+        )
+    assert con.execute("SELECT input_tokens, output_tokens, cost_usd, requests FROM token_usage").fetchone() == (20, 10, 0.5, 2)
+    plan = con.execute("EXPLAIN QUERY PLAN SELECT user_id FROM token_usage WHERE period = ? ORDER BY cost_usd DESC",
+                       ("2026-10",)).fetchall()
+    assert any("idx_token_usage_period_cost" in str(row) for row in plan)
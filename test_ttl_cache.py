@@ -0,0 +1,29 @@
+import time
+
+from ttl_cache import TTLCache
+
+
+def test_ttl_cache_expiry_lru_and_update():
+    cache = TTLCache(maxsize=2, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # evicts least recently used "b"
+    assert cache.get("b") is None and cache.get("c") == 3
+
+    assert cache.update("a", lambda v: v + 1) and cache.get("a") == 2
+    assert not cache.update("missing", lambda v: v + 1)
+
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 3
+
+
+def test_update_keeps_the_original_expiry():
+    cache = TTLCache(maxsize=4, ttl=0.05)
+    cache.set("n", 1)
+    time.sleep(0.03)
+    assert cache.update("n", lambda v: v + 1) and cache.get("n") == 2
+    time.sleep(0.03)
+    assert cache.get("n") is None                 # not renewed by the update
+    assert cache.discard_where(lambda k: True) == 0 and len(cache) == 0
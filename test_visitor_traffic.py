@@ -0,0 +1,31 @@
+from visitor_traffic import (browser_family, hit_dimensions, page_path, primary_language,
+                             referrer_host, rollup_counts)
+
+CHROME = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+EDGE = CHROME + " Edg/120.0"
+SAFARI = "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 Version/17.0 Mobile/15E148 Safari/604.1"
+
+
+def test_dimension_parsing():
+    assert browser_family(CHROME) == "Chrome"
+    assert browser_family(EDGE) == "Edge"
+    assert browser_family(SAFARI) == "Safari"
+    assert browser_family("Googlebot/2.1") == "Bot"
+    assert browser_family("") == "(unknown)"
+    assert referrer_host("https://www.Google.com:443/search?q=x") == "google.com"
+    assert referrer_host("") == "(direct)"
+    assert primary_language("ro-RO,ro;q=0.9,en;q=0.8") == "ro"
+    assert primary_language("*") == "(unknown)"
+    assert page_path("/pricing?utm=x#top") == "/pricing"
+
+
+def test_rollup_counts_by_hour_and_day():
+    a = hit_dimensions("/", "", CHROME, "en-US")
+    b = hit_dimensions("/pricing", "https://google.com/", EDGE, "ro")
+    hits = [("2026-01-01T10:05:00", a), ("2026-01-01T10:50:00", a), ("2026-01-01T11:00:00", b)]
+    hourly = rollup_counts(hits, 13)
+    assert hourly[("2026-01-01T10", "total", "")] == 2
+    assert hourly[("2026-01-01T11", "referrer", "google.com")] == 1
+    daily = rollup_counts(hits, 10)
+    assert daily[("2026-01-01", "total", "")] == 3
+    assert daily[("2026-01-01", "browser", "Chrome")] == 2
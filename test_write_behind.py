@@ -0,0 +1,72 @@
+import threading
+import time
+
+from write_behind import WriteBehindBuffer
+
+
+def test_batches_by_size_and_latency():
+    batches = []
+    buf = WriteBehindBuffer("t", batches.append, max_batch=3, max_latency=0.05)
+    for i in range(7):
+        buf.put(i)
+    assert buf.flush(timeout=2)
+    assert [x for b in batches for x in b] == list(range(7))
+    assert max(len(b) for b in batches) <= 3
+
+    batches.clear()
+    buf.put("late")
+    time.sleep(0.2)
+    assert batches == [["late"]]
+    stats = buf.stats()
+    assert stats["queued"] == stats["written"] == 8 and stats["pending"] == 0
+    buf.close()
+
+
+def test_overflow_policies():
+    gate = threading.Event()
+    written = []
+
+    def slow(batch):
+        gate.wait(2)
+        written.extend(batch)
+
+    buf = WriteBehindBuffer("t", slow, max_batch=1, max_latency=0, max_queue=2, overflow="drop_oldest")
+    buf.put(0)
+    time.sleep(0.05)  # writer is now blocked on item 0
+    for i in range(1, 5):
+        buf.put(i)
+    gate.set()
+    buf.flush(timeout=2)
+    assert written == [0, 3, 4]
+    assert buf.stats()["dropped"] == 2
+
+    gate.clear()
+    written.clear()
+    buf = WriteBehindBuffer("t", slow, max_batch=1, max_latency=0, max_queue=1,
+                            overflow="block", block_timeout=0.01)
+    buf.put(0)
+    time.sleep(0.05)
+    assert buf.put(1) is True
+    assert buf.put(2) is False
+    gate.set()
+    buf.close()
+    assert written == [0, 1]
+
+
+def test_failed_batches_are_retried_then_dropped():
+    calls = []
+
+    def flaky(batch):
+        calls.append(list(batch))
+        if len(calls) < 2:
+            raise RuntimeError("database is locked")
+
+    buf = WriteBehindBuffer("t", flaky, max_latency=0, retries=1, retry_delay=0)
+    buf.put("a")
+    buf.flush(timeout=2)
+    assert calls == [["a"], ["a"]] and buf.stats()["written"] == 1
+
+    buf = WriteBehindBuffer("t", lambda b: 1 / 0, max_latency=0, retries=0)
+    buf.put("b")
+    buf.close()
+    assert buf.stats()["dropped"] == 1 and buf.put("c") is False
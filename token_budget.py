@@ -0,0 +1,307 @@
+"""
+KELION AI - Token Budgets
+=========================
+Per-user LLM token ledger and per-tier daily / monthly budgets.
+
+Every provider call reserves an estimate first (prompt characters / 4 plus
+the expected answer) against the user's cached usage and the calls still in
+flight in this process; past the tier budget `TokenBudgetExceeded` is raised
+before any request leaves. When the provider answers, the reservation is
+settled with the `usage` it reports: tokens and cost are added to the
+user's day ('YYYY-MM-DD') and month ('YYYY-MM') rows of token_usage
+(migration 12). A failed call releases its reservation.
+
+Cached usage may lag other workers by up to `ttl` seconds, so a user running
+several workers at once can overshoot a budget by that much.
+
+Configuration:
+  K1_TOKEN_BUDGETS  per tier "daily/monthly" tokens, 0 = unlimited,
+                    e.g. "Starter=50000/1000000,Pro=500000/10000000,Elite=0/0"
+  K1_TOKEN_PRICES   USD per 1M tokens "input/output" by model (prefix match),
+                    e.g. "gpt-4o=2.5/10,deepseek-chat=0.27/1.1"
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+from ttl_cache import TTLCache
+
+budget_logger = logging.getLogger("kelion.tokens")
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4     # role / framing tokens per chat message
+
+
+class Budget(NamedTuple):
+    daily: int      # tokens per UTC day (0 = unlimited)
+    monthly: int    # tokens per UTC month (0 = unlimited)
+
+
+DEFAULT_TIER = "Starter"
+DEFAULT_BUDGETS: Dict[str, Budget] = {
+    "Starter": Budget(50_000, 1_000_000),
+    "Pro": Budget(500_000, 10_000_000),
+    "Elite": Budget(0, 0),
+}
+
+# USD per 1M tokens (input, output)
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "deepseek-chat": (0.27, 1.10),
+    "deepseek-reasoner": (0.55, 2.19),
+}
+
+
+def parse_budgets(spec: str, base: Optional[Dict[str, Budget]] = None) -> Dict[str, Budget]:
+    """'Starter=50000/1000000,Elite=0/0' over the defaults."""
+    budgets = dict(DEFAULT_BUDGETS if base is None else base)
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        try:
+            tier, _, value = item.partition("=")
+            daily, _, monthly = value.strip().partition("/")
+            budgets[tier.strip()] = Budget(int(daily), int(monthly or 0))
+        except ValueError:
+            budget_logger.warning(f"Ignoring token budget {item!r}")
+    return budgets
+
+
+def parse_prices(spec: str, base: Optional[Dict[str, Tuple[float, float]]] = None) -> Dict[str, Tuple[float, float]]:
+    """'gpt-4o=2.5/10' over the defaults."""
+    prices = dict(DEFAULT_PRICES if base is None else base)
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        try:
+            model, _, value = item.partition("=")
+            price_in, _, price_out = value.strip().partition("/")
+            prices[model.strip()] = (float(price_in), float(price_out or price_in))
+        except ValueError:
+            budget_logger.warning(f"Ignoring token price {item!r}")
+    return prices
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Cheap upper-ish estimate for chat messages, no tokenizer needed."""
+    return sum(len(t or "") // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS for t in texts)
+
+
+def usage_tokens(usage: Optional[Dict]) -> Tuple[Optional[int], Optional[int]]:
+    """(input, output) from a chat/completions or a responses `usage` block."""
+    usage = usage or {}
+    input_tokens = usage.get("prompt_tokens", usage.get("input_tokens"))
+    output_tokens = usage.get("completion_tokens", usage.get("output_tokens"))
+    return (None if input_tokens is None else int(input_tokens),
+            None if output_tokens is None else int(output_tokens))
+
+
+def periods(now: Optional[float] = None) -> Tuple[str, str]:
+    """The UTC ('YYYY-MM-DD', 'YYYY-MM') ledger periods for `now`."""
+    day = datetime.fromtimestamp(time.time() if now is None else now, timezone.utc).strftime("%Y-%m-%d")
+    return day, day[:7]
+
+
+def _seconds_until_reset(period: str, now: float) -> int:
+    current = datetime.fromtimestamp(now, timezone.utc)
+    if period == "day":
+        start = current.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = start.timestamp() + 86400
+    else:
+        year, month = (current.year + 1, 1) if current.month == 12 else (current.year, current.month + 1)
+        end = current.replace(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0).timestamp()
+    return max(1, int(end - now))
+
+
+class TokenBudgetExceeded(Exception):
+    """The call would take the user past their tier's daily or monthly budget."""
+
+    def __init__(self, user_id: str, tier: str, period: str, used: int, budget: int, retry_after: int):
+        super().__init__(f"Token budget exceeded for {user_id} ({tier}, {period}: {used}/{budget})")
+        self.user_id = user_id
+        self.tier = tier
+        self.period = period            # "day" | "month"
+        self.used = used
+        self.budget = budget
+        self.retry_after = retry_after  # seconds until the period resets
+
+    def to_dict(self) -> Dict:
+        return {"tier": self.tier, "period": self.period, "used": self.used,
+                "budget": self.budget, "retry_after": self.retry_after}
+
+
+class Reservation(NamedTuple):
+    user_id: str
+    day: str
+    month: str
+    tokens: int
+
+
+class TokenLedger:
+    """
+    Reserve / settle / release against per-user usage.
+
+    load(user_id, day, month) -> (day_tokens, month_tokens)
+    record(user_id, day, month, input_tokens, output_tokens, cost) persists one call
+    tier_of(user_id) -> subscription tier name
+    """
+
+    def __init__(self, load: Callable[[str, str, str], Tuple[int, int]],
+                 record: Callable[[str, str, str, int, int, float], None],
+                 tier_of: Callable[[str], str],
+                 budgets: Optional[Dict[str, Budget]] = None,
+                 prices: Optional[Dict[str, Tuple[float, float]]] = None,
+                 ttl: float = 30.0, maxsize: int = 10000):
+        self._load = load
+        self._record = record
+        self._tier_of = tier_of
+        self.budgets = dict(DEFAULT_BUDGETS if budgets is None else budgets)
+        self.prices = dict(DEFAULT_PRICES if prices is None else prices)
+        self._used = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._pending: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._metrics = {"reserved": 0, "rejected": 0, "settled": 0, "released": 0, "record_errors": 0,
+                         "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+
+    def budget_for(self, tier: str) -> Budget:
+        return self.budgets.get(tier) or self.budgets.get(DEFAULT_TIER) or Budget(0, 0)
+
+    def cost(self, model: str, input_tokens: int, output_tokens: int) -> float:
+        """USD for one call; the longest configured prefix of `model` sets the price."""
+        model = model or ""
+        match = max((m for m in self.prices if model.startswith(m)), key=len, default=None)
+        if match is None:
+            return 0.0
+        price_in, price_out = self.prices[match]
+        return (input_tokens * price_in + output_tokens * price_out) / 1_000_000
+
+    def used(self, user_id: str, day: str, month: str) -> Tuple[int, int]:
+        key = (user_id, day)
+        value = self._used.get(key)
+        if value is None:
+            value = tuple(int(v or 0) for v in self._load(user_id, day, month))
+            self._used.set(key, value)
+        return value
+
+    def check(self, user_id: str, estimate: int = 0):
+        """Raise TokenBudgetExceeded if `estimate` more tokens would not fit, without holding them."""
+        reservation = self.reserve(user_id, estimate)
+        with self._lock:
+            self._unhold(reservation)
+            self._metrics["reserved"] -= 1
+
+    def reserve(self, user_id: str, estimate: int, enforce: bool = True) -> Reservation:
+        """Hold `estimate` tokens for one call; raises TokenBudgetExceeded when enforcing."""
+        now = time.time()
+        day, month = periods(now)
+        budget = Budget(0, 0)
+        tier = DEFAULT_TIER
+        if enforce:
+            tier = self._tier_of(user_id)
+            budget = self.budget_for(tier)
+        used_day, used_month = self.used(user_id, day, month) if any(budget) else (0, 0)
+        with self._lock:
+            pending = self._pending.get(user_id, 0)
+            for period, used, limit in (("day", used_day, budget.daily), ("month", used_month, budget.monthly)):
+                if limit and used + pending + estimate > limit:
+                    self._metrics["rejected"] += 1
+                    raise TokenBudgetExceeded(user_id, tier, period, used + pending, limit,
+                                              _seconds_until_reset(period, now))
+            self._pending[user_id] = pending + estimate
+            self._metrics["reserved"] += 1
+        return Reservation(user_id, day, month, estimate)
+
+    def _unhold(self, reservation: Reservation):
+        left = self._pending.get(reservation.user_id, 0) - reservation.tokens
+        if left > 0:
+            self._pending[reservation.user_id] = left
+        else:
+            self._pending.pop(reservation.user_id, None)
+
+    def release(self, reservation: Reservation):
+        """The call failed before using tokens."""
+        with self._lock:
+            self._unhold(reservation)
+            self._metrics["released"] += 1
+
+    def settle(self, reservation: Reservation, model: str,
+               input_tokens: Optional[int], output_tokens: Optional[int]) -> float:
+        """Replace the reservation with the provider-reported usage; returns the cost.
+        Missing usage counts the whole estimate as input."""
+        input_tokens = reservation.tokens if input_tokens is None else input_tokens
+        output_tokens = output_tokens or 0
+        cost = self.cost(model, input_tokens, output_tokens)
+        try:
+            self._record(reservation.user_id, reservation.day, reservation.month, input_tokens, output_tokens, cost)
+        except Exception as e:
+            budget_logger.error(f"Token usage not recorded for {reservation.user_id}: {e}")
+            with self._lock:
+                self._metrics["record_errors"] += 1
+        total = input_tokens + output_tokens
+        self._used.update((reservation.user_id, reservation.day), lambda v: (v[0] + total, v[1] + total))
+        with self._lock:
+            self._unhold(reservation)
+            self._metrics["settled"] += 1
+            self._metrics["input_tokens"] += input_tokens
+            self._metrics["output_tokens"] += output_tokens
+            self._metrics["cost_usd"] += cost
+        return cost
+
+    def status(self, user_id: str) -> Dict:
+        """Usage against the user's budget for the current day and month."""
+        day, month = periods()
+        tier = self._tier_of(user_id)
+        budget = self.budget_for(tier)
+        used_day, used_month = self.used(user_id, day, month)
+
+        def period(used, limit):
+            return {"used": used, "budget": limit or None, "remaining": max(0, limit - used) if limit else None}
+
+        return {"tier": tier, "day": dict(period(used_day, budget.daily), period=day),
+                "month": dict(period(used_month, budget.monthly), period=month)}
+
+    def forget(self, user_id: str):
+        self._used.discard_where(lambda k: k[0] == user_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            out = dict(self._metrics, in_flight_tokens=sum(self._pending.values()))
+        out["cost_usd"] = round(out["cost_usd"], 4)
+        out["budgets"] = {tier: list(b) for tier, b in self.budgets.items()}
+        out["cache"] = self._used.stats()
+        return out
+
+
+_ledger: Optional[TokenLedger] = None
+
+
+def set_token_ledger(ledger: Optional[TokenLedger]):
+    """Install the process-wide ledger (app.py does this at import)."""
+    global _ledger
+    _ledger = ledger
+
+
+def get_token_ledger() -> Optional[TokenLedger]:
+    """The ledger, or None when running outside the app (CLI scripts)."""
+    return _ledger
+
+
+__all__ = [
+    'Budget',
+    'Reservation',
+    'TokenLedger',
+    'TokenBudgetExceeded',
+    'estimate_tokens',
+    'usage_tokens',
+    'parse_budgets',
+    'parse_prices',
+    'periods',
+    'set_token_ledger',
+    'get_token_ledger',
+]
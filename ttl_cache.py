@@ -0,0 +1,94 @@
+"""
+KELION AI - In-Process TTL Cache
+================================
+Thread-safe LRU cache whose entries expire `ttl` seconds after they were
+set. Used in front of hot per-request lookups (usage counters, tiers,
+token usage, demo state, prompt parts) where a short staleness window
+across worker processes is acceptable.
+
+The storage is cachetools' TLRUCache behind a lock (cachetools caches are
+not thread-safe). It adds what the callers need on top: update() keeps the
+entry's original expiry, so values changed in place still get reloaded
+after `ttl`, plus bulk invalidation and hit / miss stats.
+"""
+
+import time
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from cachetools import TLRUCache
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU cache with per-entry expiry."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        if maxsize < 1:
+            raise ValueError("maxsize must be >= 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Stored as (expires_at, value), so update() can keep the expiry
+        self._data = TLRUCache(maxsize, ttu=lambda key, entry, now: entry[0], timer=time.monotonic)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self._misses += 1
+                return default
+            self._hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def update(self, key, fn: Callable[[Any], Any]) -> bool:
+        """Atomically replace a cached value with fn(value). No-op (False) if absent or expired."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return False
+            self._data[key] = (entry[0], fn(entry[1]))
+            return True
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return None if entry is None else entry[1]
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every key matching `predicate`. Returns how many were dropped."""
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 3) if total else 0.0,
+            }
+
+
+__all__ = ['TTLCache']
@@ -10,15 +10,19 @@ Punct 7: Vision (Deep Understanding)
 import os
 import json
 import base64
-import requests
 from datetime import datetime, timezone
 from typing import Optional, Dict, List
 
+from provider_client import get_provider_client
+
 # Configuration
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
 ANTHROPIC_BASE_URL = "https://api.anthropic.com/v1"
 CLAUDE_VISION_MODEL = os.getenv("CLAUDE_VISION_MODEL", "claude-sonnet-4-20250514")
 
+# Conexiuni keep-alive reutilizate per furnizor (vezi provider_client.py)
+provider_http = get_provider_client()
+
 # Storage pentru observații vizuale
 VISION_LOG_FILE = os.path.join(os.path.dirname(__file__), "data", "vision_observations.json")
 
@@ -113,7 +117,7 @@ Răspunde în format JSON structurat."""
         }
         
         try:
-            response = requests.post(
+            response = provider_http.post(
                 f"{ANTHROPIC_BASE_URL}/messages",
                 headers=headers,
                 json=payload,
@@ -0,0 +1,99 @@
+"""
+KELION AI - Visitor Traffic Rollups
+===================================
+Turns raw page views into the dimensions the traffic panel aggregates on:
+page path, referrer host, browser family and primary language.
+
+`rollup_counts()` folds a batch of hits into {(bucket, dimension, value): n}
+for the traffic_hourly / traffic_daily tables (see migration 0008), so a
+flush of N hits costs one upsert per distinct key instead of N.
+"""
+
+import re
+from collections import Counter
+from typing import Dict, Iterable, Tuple
+from urllib.parse import urlsplit
+
+DIMENSIONS = ("total", "page", "referrer", "browser", "language")
+DIRECT = "(direct)"
+UNKNOWN = "(unknown)"
+MAX_VALUE_LENGTH = 200
+
+# First match wins: Chromium-based browsers also announce "Chrome" and "Safari"
+_BROWSERS = (
+    ("Bot", re.compile(r"bot|crawl|spider|slurp|headless|lighthouse", re.I)),
+    ("Edge", re.compile(r"Edg(e|A|iOS)?/")),
+    ("Opera", re.compile(r"OPR/|Opera")),
+    ("Samsung Internet", re.compile(r"SamsungBrowser/")),
+    ("Firefox", re.compile(r"Firefox/|FxiOS/")),
+    ("Chrome", re.compile(r"Chrome/|CriOS/|Chromium/")),
+    ("Safari", re.compile(r"Safari/")),
+    ("Internet Explorer", re.compile(r"MSIE |Trident/")),
+)
+
+
+def browser_family(user_agent: str) -> str:
+    if not user_agent:
+        return UNKNOWN
+    for name, pattern in _BROWSERS:
+        if pattern.search(user_agent):
+            return name
+    return "Other"
+
+
+def referrer_host(referer: str) -> str:
+    if not referer:
+        return DIRECT
+    try:
+        host = (urlsplit(referer).hostname or "").lower()
+    except ValueError:
+        return UNKNOWN
+    if host.startswith("www."):
+        host = host[4:]
+    return host[:MAX_VALUE_LENGTH] or UNKNOWN
+
+
+def primary_language(accept_language: str) -> str:
+    """'ro-RO,ro;q=0.9,en;q=0.8' -> 'ro'."""
+    first = (accept_language or "").split(",", 1)[0].split(";", 1)[0].strip()
+    lang = first.split("-", 1)[0].lower()
+    return lang[:16] if lang and lang != "*" else UNKNOWN
+
+
+def page_path(page: str) -> str:
+    path = (page or "/").split("?", 1)[0].split("#", 1)[0].strip()
+    return (path or "/")[:MAX_VALUE_LENGTH]
+
+
+def hit_dimensions(page: str, referer: str, user_agent: str, accept_language: str) -> Dict[str, str]:
+    return {
+        "total": "",
+        "page": page_path(page),
+        "referrer": referrer_host(referer),
+        "browser": browser_family(user_agent),
+        "language": primary_language(accept_language),
+    }
+
+
+def rollup_counts(hits: Iterable[Tuple[str, Dict[str, str]]], width: int) -> Counter:
+    """(visited_at ISO timestamp, dimensions) pairs -> {(bucket, dimension, value): count}.
+
+    width 13 buckets by hour ('YYYY-MM-DDTHH'), 10 by day ('YYYY-MM-DD').
+    """
+    counts: Counter = Counter()
+    for visited_at, dims in hits:
+        bucket = visited_at[:width]
+        for dimension, value in dims.items():
+            counts[(bucket, dimension, value)] += 1
+    return counts
+
+
+__all__ = [
+    'DIMENSIONS',
+    'browser_family',
+    'referrer_host',
+    'primary_language',
+    'page_path',
+    'hit_dimensions',
+    'rollup_counts',
+]
@@ -11,16 +11,20 @@ import re
 import json
 import hashlib
 import base64
-import requests
 from datetime import datetime, timezone
 from typing import Optional, Dict, List
 
+from provider_client import get_provider_client
+
 # Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY", "")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
 DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY", "")
 
+# Conexiuni keep-alive reutilizate per furnizor (vezi provider_client.py)
+provider_http = get_provider_client()
+
 # TTS Configuration
 TTS_PROVIDER = os.getenv("TTS_PROVIDER", "openai")  # browser, openai, elevenlabs, deepgram
 OPENAI_TTS_VOICE = os.getenv("OPENAI_TTS_VOICE", "onyx")  # Male voice
@@ -103,6 +107,7 @@ class VoiceAuthority:
                 "pitch": 0.9,
                 "voice_name": voice  # Male voices preferred
             }
+        }
     
     def make_viseme_timeline(self, words: List[Dict]) -> List[Dict]:
         """Convertește timpii cuvintelor -> timeline de viseme (euristică)."""
@@ -150,7 +155,7 @@ class VoiceAuthority:
                 "timestamp_granularities[]": "word"
             }
             
-            r = requests.post(
+            r = provider_http.post(
                 "https://api.openai.com/v1/audio/transcriptions",
                 headers=headers,
                 files=files,
@@ -167,7 +172,6 @@ class VoiceAuthority:
             }
         except Exception:
             return None
-        }
     
     def _openai_tts(self, text: str, voice: str, cache_key: str) -> Dict:
         """Sintetizează cu OpenAI TTS."""
@@ -187,7 +191,7 @@ class VoiceAuthority:
                 "response_format": "mp3"
             }
             
-            response = requests.post(
+            response = provider_http.post(
                 "https://api.openai.com/v1/audio/speech",
                 headers=headers,
                 json=payload,
@@ -231,7 +235,7 @@ class VoiceAuthority:
                 }
             }
             
-            response = requests.post(
+            response = provider_http.post(
                 f"https://api.elevenlabs.io/v1/text-to-speech/{ELEVENLABS_VOICE_ID}",
                 headers=headers,
                 json=payload,
@@ -263,7 +267,7 @@ class VoiceAuthority:
             # Use configured voice model
             voice_model = DEEPGRAM_VOICE
             
-            response = requests.post(
+            response = provider_http.post(
                 f"https://api.deepgram.com/v1/speak?model={voice_model}",
                 headers=headers,
                 json={"text": text},
@@ -451,7 +455,7 @@ Răspunde DOAR cu traducerea, fără explicații."""
         }
         
         try:
-            response = requests.post(
+            response = provider_http.post(
                 "https://api.anthropic.com/v1/messages",
                 headers=headers,
                 json=payload,
@@ -0,0 +1,232 @@
+"""
+KELION AI - Write-Behind Buffers
+================================
+In-process queues drained by a background writer thread, so request
+threads never wait on a database round-trip for fire-and-forget rows
+(audit events, tracking, counters).
+
+- Group commit: the writer hands `write_batch` up to `max_batch` items at
+  once, at most `max_latency` seconds after the oldest one was queued.
+- Bounded memory: at most `max_queue` pending items. On overflow the
+  policy is "drop_oldest", "drop_newest" or "block" (wait up to
+  `block_timeout` for room, then drop the new item).
+- `flush()` waits until everything queued so far is written; every
+  buffer is flushed and stopped at interpreter exit (`close_all`).
+- Fork-aware: the writer thread starts lazily, and a child process starts
+  its own with an empty queue (the parent still owns what it queued).
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+import weakref
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+write_behind_logger = logging.getLogger("kelion.write_behind")
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+_buffers: "weakref.WeakSet[WriteBehindBuffer]" = weakref.WeakSet()
+
+
+class WriteBehindBuffer:
+    """Bounded queue with a background group-commit writer."""
+
+    def __init__(self, name: str, write_batch: Callable[[List], None], max_batch: int = 200,
+                 max_latency: float = 0.25, max_queue: int = 10000, overflow: str = "block",
+                 block_timeout: float = 0.05, retries: int = 2, retry_delay: float = 0.2):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, got {overflow!r}")
+        if max_batch < 1 or max_queue < 1:
+            raise ValueError("max_batch and max_queue must be >= 1")
+        self.name = name
+        self._write_batch = write_batch
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+        self._cond = threading.Condition(threading.Lock())
+        self._queue: deque = deque()   # (enqueued_at, item)
+        self._inflight = 0
+        self._flushing = 0
+        self._closing = False
+        self._thread: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+
+        self._metrics = {
+            "queued": 0,
+            "written": 0,
+            "dropped": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "max_batch_seen": 0,
+            "blocked": 0,
+        }
+        _buffers.add(self)
+
+    # --- internals (caller holds self._cond unless noted) ---
+
+    def _ensure_writer(self):
+        if self._pid != os.getpid():
+            self._queue.clear()
+            self._inflight = 0
+            self._flushing = 0
+            self._thread = None
+            self._pid = os.getpid()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f"write-behind-{self.name}", daemon=True)
+            self._thread.start()
+
+    def _next_batch(self) -> Optional[List]:
+        while not self._queue:
+            if self._closing:
+                return None
+            self._cond.wait()
+        deadline = self._queue[0][0] + self.max_latency
+        while len(self._queue) < self.max_batch and not self._closing and not self._flushing:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        n = min(self.max_batch, len(self._queue))
+        batch = [self._queue.popleft()[1] for _ in range(n)]
+        self._inflight = n
+        self._cond.notify_all()  # room for blocked producers
+        return batch
+
+    def _write(self, batch: List) -> bool:
+        """Write one batch with retries. Called WITHOUT the lock."""
+        for attempt in range(self.retries + 1):
+            try:
+                self._write_batch(batch)
+                return True
+            except Exception as e:
+                if attempt == self.retries:
+                    write_behind_logger.error(f"[{self.name}] dropping batch of {len(batch)} after error: {e}")
+                    return False
+                time.sleep(self.retry_delay * (attempt + 1))
+        return False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = self._next_batch()
+            if batch is None:
+                return
+            ok = self._write(batch)
+            with self._cond:
+                m = self._metrics
+                if ok:
+                    m["written"] += len(batch)
+                    m["batches"] += 1
+                    m["max_batch_seen"] = max(m["max_batch_seen"], len(batch))
+                else:
+                    m["dropped"] += len(batch)
+                    m["failed_batches"] += 1
+                self._inflight = 0
+                self._cond.notify_all()
+
+    # --- public API ---
+
+    def put(self, item) -> bool:
+        """Queue an item for writing. Returns False if it was dropped."""
+        with self._cond:
+            if self._closing:
+                self._metrics["dropped"] += 1
+                return False
+            self._ensure_writer()
+            if len(self._queue) >= self.max_queue:
+                if self.overflow == "drop_oldest":
+                    self._queue.popleft()
+                    self._metrics["dropped"] += 1
+                elif self.overflow == "block":
+                    self._metrics["blocked"] += 1
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._queue) >= self.max_queue:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                if len(self._queue) >= self.max_queue:
+                    self._metrics["dropped"] += 1
+                    return False
+            self._queue.append((time.monotonic(), item))
+            self._metrics["queued"] += 1
+            if len(self._queue) >= self.max_batch or len(self._queue) == 1:
+                self._cond.notify_all()
+            return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued so far is written. False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._pid != os.getpid():
+                return True
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                while self._queue or self._inflight:
+                    if self._thread is None or not self._thread.is_alive():
+                        self._ensure_writer()
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._flushing -= 1
+
+    def close(self, timeout: float = 5.0) -> bool:
+        """Flush pending items and stop the writer. Later puts are dropped."""
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        return flushed
+
+    def stats(self) -> Dict:
+        with self._cond:
+            m = dict(self._metrics)
+            m.update({
+                "pending": len(self._queue) + self._inflight,
+                "max_queue": self.max_queue,
+                "max_batch": self.max_batch,
+                "max_latency_ms": round(self.max_latency * 1000),
+                "overflow": self.overflow,
+                "avg_batch": round(m["written"] / m["batches"], 2) if m["batches"] else 0.0,
+            })
+            return m
+
+
+def flush_all(timeout: float = 5.0) -> bool:
+    """Flush every live buffer (e.g. before a graceful worker shutdown)."""
+    return all([b.flush(timeout) for b in list(_buffers)])
+
+
+def close_all(timeout: float = 5.0):
+    for buf in list(_buffers):
+        try:
+            buf.close(timeout)
+        except Exception as e:
+            write_behind_logger.warning(f"[{buf.name}] close failed: {e}")
+
+
+atexit.register(close_all)
+
+
+__all__ = [
+    'WriteBehindBuffer',
+    'OVERFLOW_POLICIES',
+    'flush_all',
+    'close_all',
+]